@@ -1,9 +1,10 @@
 import streamlit as st
-from utils.crime_data_db import get_db_connection
+from utils.crime_data_db import get_db_pool
 
-# Store connection in session state
+# Store the shared connection pool in session state (None when the database is
+# not available and the police API is used instead)
 if "db_connection" not in st.session_state:
-    st.session_state["db_connection"] = get_db_connection()
+    st.session_state["db_connection"] = get_db_pool()
 
 map_click_page = st.Page(
     "maps/map_click.py", title="Clickable Crime Map", icon=":material/location_on:", default=True
@@ -14,13 +15,16 @@ map_postcode_page = st.Page(
 map_area_page = st.Page(
     "maps/map_area.py", title="Area Crime Map", icon=":material/polyline:", default=False
 )
+map_compare_page = st.Page(
+    "maps/map_compare.py", title="Compare Postcodes", icon=":material/compare_arrows:", default=False
+)
 llm_page = st.Page(
     "llm/chat.py", title="Chat", icon=":material/chat:", default=False
 )
 
 pg = st.navigation(
         {
-            "Interactive Crime Maps": [map_click_page, map_postcode_page, map_area_page, llm_page],
+            "Interactive Crime Maps": [map_click_page, map_postcode_page, map_area_page, map_compare_page, llm_page],
         }
     )
     
@@ -1,7 +1,9 @@
 import utils.crime_data_fetch as api
 import utils.crime_data_db as db
-from utils.map_utils import color_function, add_crime_counts_to_map, write_selected_location_in_st
+from utils.map_utils import color_function, add_crime_counts_to_map, add_grid_counts_to_map, add_crime_tiles_to_map, write_selected_location_in_st
+import utils.tile_server as tiles
 import utils.data_utils as dutils
+from utils.geo_utils import grid_cell_size
 import streamlit as st
 import folium
 from streamlit_folium import st_folium
@@ -17,6 +19,10 @@ if "selected_location_area" not in st.session_state:
     st.session_state["selected_location_area"] = None
 if "crime_data_area" not in st.session_state:
     st.session_state["crime_data_area"] = None
+if "crime_counts_area" not in st.session_state:
+    st.session_state["crime_counts_area"] = None
+if "location_counts_area" not in st.session_state:
+    st.session_state["location_counts_area"] = None
 
 # Create base map
 center = [52, -1]
@@ -41,19 +47,28 @@ if 'map_area' in st.session_state:
 # Display date selectors and store a list of dates in st.session_state[key+"list_crime_dates"]
 dutils.add_start_end_month(key="map_area_")
 
+# Heatmap mode bins the crimes into a grid whose cell size follows the zoom
+# level, tiles mode streams vector tiles of the visible area
+display_mode = dutils.add_map_display_selector(key="map_area_", modes=("Bubbles", "Heatmap"))
+
 # Display crimes in selected location
 if st.session_state["selected_location_area"]:
     # Getting the crimes within the bounded area
     if st.session_state["db_connection"] != None:
-        st.session_state["crime_data_area"] = db.get_crime_street_level_area_dates(
+        if display_mode == "Bubbles":
+            st.session_state["location_counts_area"] = db.get_crime_location_counts_area_dates(
+                st.session_state["selected_location_area"], 
+                st.session_state["map_area_list_crime_dates"])
+        st.session_state["crime_counts_area"] = db.get_crime_counts_area_dates(
             st.session_state["selected_location_area"], 
             st.session_state["map_area_list_crime_dates"])
         status_code = 200
     else:
-        list_crimes, status_code = api.get_crime_street_level_area_dates(
+        st.session_state["crime_data_area"], status_code = dutils.get_crime_data_area_dates(
             st.session_state["selected_location_area"], 
             st.session_state["map_area_list_crime_dates"])
-        st.session_state["crime_data_area"] = api.list_crimes_to_df(list_crimes)
+        st.session_state["crime_counts_area"] = dutils.count_crimes_by_month_type(st.session_state["crime_data_area"])
+        st.session_state["location_counts_area"] = dutils.count_crimes_by_location(st.session_state["crime_data_area"])
     # Extract longitudes and latitudes separately
     lons, lats = zip(*st.session_state["selected_location_area"])
     # Compute the center
@@ -64,9 +79,33 @@ if st.session_state["selected_location_area"]:
     zoom = 13
 
     # Filters the data to include only the crimes with certain categories
-    st.session_state["filtered_crime_data_area"] = dutils.add_pills_filter_df(st.session_state["crime_data_area"])
-    # Count and plot crime occurrences
-    add_crime_counts_to_map(st.session_state["filtered_crime_data_area"], fg)
+    selected_crime_types = dutils.add_pills_filter()
+    st.session_state["filtered_crime_counts_area"] = dutils.filter_crime_types(st.session_state["crime_counts_area"], selected_crime_types)
+    if display_mode == "Heatmap":
+        # Use the zoom the user left the map at, if any
+        map_zoom = st.session_state["map_area"].get("zoom") if "map_area" in st.session_state else None
+        cell_size = grid_cell_size(round(map_zoom or zoom))
+        if st.session_state["db_connection"] != None:
+            grid_counts = db.get_crime_grid_counts_area_dates(
+                st.session_state["selected_location_area"], 
+                st.session_state["map_area_list_crime_dates"],
+                cell_size,
+                selected_crime_types)
+        else:
+            grid_counts = dutils.count_crimes_by_grid(
+                dutils.filter_crime_types(st.session_state["crime_data_area"], selected_crime_types),
+                cell_size)
+        # Plot the non-empty grid cells
+        add_grid_counts_to_map(grid_counts, fg)
+    elif display_mode == "Tiles":
+        add_crime_tiles_to_map(map_area, tiles.tile_url(
+            tiles.start_tile_server(), 
+            st.session_state["map_area_list_crime_dates"], 
+            selected_crime_types))
+    else:
+        st.session_state["filtered_location_counts_area"] = dutils.filter_location_counts(st.session_state["location_counts_area"], selected_crime_types)
+        # Count and plot crime occurrences
+        add_crime_counts_to_map(st.session_state["filtered_location_counts_area"], fg)
 else: 
     # Shows the pills
     dutils.add_pills_filter_df()
@@ -78,7 +117,7 @@ map_data = st_folium(map_area,
     height=500, 
     width=700, 
     key='map_area',
-    returned_objects=["last_active_drawing"],
+    returned_objects=["last_active_drawing"] + (["zoom"] if display_mode == "Heatmap" else []),
     center=center)
 
 # Display selected location
@@ -96,7 +135,7 @@ else:
 
 # Display crime statistics
 if st.session_state["selected_location_area"]:
-    dutils.add_area_line_plot_crime_statistics(st.session_state["filtered_crime_data_area"], key="map_area_")
-    dutils.add_bar_plot_crime_statistics(st.session_state["filtered_crime_data_area"])
+    dutils.add_area_line_plot_crime_statistics(st.session_state["filtered_crime_counts_area"], key="map_area_")
+    dutils.add_bar_plot_crime_statistics(st.session_state["filtered_crime_counts_area"])
 else:
     st.subheader("Crime statistics")
\ No newline at end of file
@@ -1,7 +1,9 @@
 import utils.crime_data_fetch as api
 import utils.crime_data_db as db
-from utils.map_utils import color_function, add_crime_counts_to_map, write_selected_location_in_st
+from utils.map_utils import color_function, add_crime_counts_to_map, add_grid_counts_to_map, add_crime_tiles_to_map, write_selected_location_in_st
+import utils.tile_server as tiles
 import utils.data_utils as dutils
+from utils.geo_utils import snap_point, grid_cell_size, CLICK_SNAP_PRECISION
 import streamlit as st
 import folium
 from streamlit_folium import st_folium
@@ -16,6 +18,10 @@ if "selected_location_click" not in st.session_state:
     st.session_state["selected_location_click"] = None
 if "crime_data_clickable" not in st.session_state:
     st.session_state["crime_data_clickable"] = None
+if "crime_counts_clickable" not in st.session_state:
+    st.session_state["crime_counts_clickable"] = None
+if "location_counts_clickable" not in st.session_state:
+    st.session_state["location_counts_clickable"] = None
 
 # Create base map
 center = [52, -1]
@@ -30,24 +36,36 @@ if 'map_click' in st.session_state:
 # Display date selectors and store a list of dates in st.session_state[key+"list_crime_dates"]
 dutils.add_start_end_month(key="map_click_")
 
+# Heatmap mode bins the crimes into a grid whose cell size follows the zoom
+# level, tiles mode streams vector tiles of the visible area
+display_mode = dutils.add_map_display_selector(key="map_click_", modes=("Bubbles", "Heatmap"))
+
 # Display crimes in selected location
 if st.session_state["selected_location_click"]:
     lat, lon = (
         st.session_state["selected_location_click"]["lat"], 
         st.session_state["selected_location_click"]["lng"]
     )
+    # Snap the clicked point to a grid cell centre so nearby clicks share cached results
+    query_lat, query_lon, snap_distance = snap_point(lat, lon, CLICK_SNAP_PRECISION)
     if st.session_state["db_connection"] != None:
-        st.session_state["crime_data_clickable"] = db.get_crime_street_level_point_dates(
-            lat, 
-            lon, 
+        if display_mode == "Bubbles":
+            st.session_state["location_counts_clickable"] = db.get_crime_location_counts_point_dates(
+                query_lat, 
+                query_lon, 
+                st.session_state["map_click_list_crime_dates"])
+        st.session_state["crime_counts_clickable"] = db.get_crime_counts_point_dates(
+            query_lat, 
+            query_lon, 
             st.session_state["map_click_list_crime_dates"])
         status_code = 200
     else:
-        list_crimes, status_code = api.get_crime_street_level_point_dates(
-            lat, 
-            lon, 
+        st.session_state["crime_data_clickable"], status_code = dutils.get_crime_data_point_dates(
+            query_lat, 
+            query_lon, 
             st.session_state["map_click_list_crime_dates"])
-        st.session_state["crime_data_clickable"] = api.list_crimes_to_df(list_crimes)
+        st.session_state["crime_counts_clickable"] = dutils.count_crimes_by_month_type(st.session_state["crime_data_clickable"])
+        st.session_state["location_counts_clickable"] = dutils.count_crimes_by_location(st.session_state["crime_data_clickable"])
     f_error, error, postcode_info  = api.get_postcode_info_from_lat_long(lat, lon)
     fg.add_child(
         folium.Marker(
@@ -57,9 +75,34 @@ if st.session_state["selected_location_click"]:
     zoom = 13
 
     # Filters the data to include only the crimes with certain categories
-    st.session_state["filtered_crime_data_clickable"] = dutils.add_pills_filter_df(st.session_state["crime_data_clickable"])
-    # Count and plot crime occurrences
-    add_crime_counts_to_map(st.session_state["filtered_crime_data_clickable"], fg)
+    selected_crime_types = dutils.add_pills_filter()
+    st.session_state["filtered_crime_counts_clickable"] = dutils.filter_crime_types(st.session_state["crime_counts_clickable"], selected_crime_types)
+    if display_mode == "Heatmap":
+        # Use the zoom the user left the map at, if any
+        map_zoom = st.session_state["map_click"].get("zoom") if "map_click" in st.session_state else None
+        cell_size = grid_cell_size(round(map_zoom or zoom))
+        if st.session_state["db_connection"] != None:
+            grid_counts = db.get_crime_grid_counts_point_dates(
+                query_lat, 
+                query_lon, 
+                st.session_state["map_click_list_crime_dates"],
+                cell_size,
+                selected_crime_types)
+        else:
+            grid_counts = dutils.count_crimes_by_grid(
+                dutils.filter_crime_types(st.session_state["crime_data_clickable"], selected_crime_types),
+                cell_size)
+        # Plot the non-empty grid cells
+        add_grid_counts_to_map(grid_counts, fg)
+    elif display_mode == "Tiles":
+        add_crime_tiles_to_map(map_click, tiles.tile_url(
+            tiles.start_tile_server(), 
+            st.session_state["map_click_list_crime_dates"], 
+            selected_crime_types))
+    else:
+        st.session_state["filtered_location_counts_clickable"] = dutils.filter_location_counts(st.session_state["location_counts_clickable"], selected_crime_types)
+        # Count and plot crime occurrences
+        add_crime_counts_to_map(st.session_state["filtered_location_counts_clickable"], fg)
 else: 
     # Shows the pills
     dutils.add_pills_filter_df()
@@ -71,7 +114,7 @@ map_data = st_folium(map_click,
     height=500, 
     width=700, 
     key='map_click',
-    returned_objects=["last_clicked"],
+    returned_objects=["last_clicked"] + (["zoom"] if display_mode == "Heatmap" else []),
     center=center)
 
 # Display selected location
@@ -84,12 +127,14 @@ if st.session_state["selected_location_click"]:
         lon, 
         status_code
     )
+    if snap_distance > 0:
+        st.caption(f"Crimes are shown around {query_lat:.6f}, {query_lon:.6f}, {snap_distance:.0f} m from the selected location.")
 else:
     st.subheader("Selected location")
 
 # Display crime statistics
 if st.session_state["selected_location_click"]:
-    dutils.add_area_line_plot_crime_statistics(st.session_state["filtered_crime_data_clickable"], key="map_click_")
-    dutils.add_bar_plot_crime_statistics(st.session_state["filtered_crime_data_clickable"])
+    dutils.add_area_line_plot_crime_statistics(st.session_state["filtered_crime_counts_clickable"], key="map_click_")
+    dutils.add_bar_plot_crime_statistics(st.session_state["filtered_crime_counts_clickable"])
 else:
     st.subheader("Crime statistics")
\ No newline at end of file
@@ -0,0 +1,92 @@
+import utils.crime_data_fetch as api
+import utils.crime_data_db as db
+import utils.data_utils as dutils
+import streamlit as st
+import folium
+from streamlit_folium import st_folium
+import pandas as pd
+import re
+
+# Maximum number of postcodes compared at once
+MAX_COMPARE_POSTCODES = 10
+
+# Streamlit UI
+st.title("UK Crime Data Explorer")
+st.write("Enter postcodes to compare their street-level crime data.")
+
+# Initialize session state
+if "compare_counts" not in st.session_state:
+    st.session_state["compare_counts"] = None
+
+# Postcodes input
+postcodes_text = st.text_area(f"Postcodes to compare (up to {MAX_COMPARE_POSTCODES}, one per line or separated by commas):")
+postcodes = list(dict.fromkeys(
+    postcode.strip().upper() for postcode in re.split(r"[,\n]", postcodes_text) if postcode.strip()
+))[:MAX_COMPARE_POSTCODES]
+
+# Display date selectors and store a list of dates in st.session_state[key+"list_crime_dates"]
+dutils.add_start_end_month(key="map_compare_")
+
+# Create base map
+map_compare = folium.Map(location=[52, -1], zoom_start=7)
+fg = folium.FeatureGroup(name="Markers")
+
+located = []
+if postcodes:
+    if st.session_state["db_connection"] != None:
+        # Resolves all the postcodes at once and counts them with one query
+        compare_counts, located, unresolved = db.get_crime_counts_postcodes_dates(
+            postcodes,
+            st.session_state["map_compare_list_crime_dates"])
+        compare_counts = compare_counts.rename(columns={'postcode': 'location'})
+    else:
+        located, unresolved = api.locate_postcodes(postcodes)
+        frames = []
+        for postcode, lat, lon in located:
+            crime_data, status_code = dutils.get_crime_data_point_dates(
+                lat,
+                lon,
+                st.session_state["map_compare_list_crime_dates"])
+            if status_code != 200:
+                st.write(f"Crime API error for {postcode}: status_code {status_code}. Retry query.")
+            counts = dutils.count_crimes_by_month_type(crime_data)
+            counts.insert(0, 'location', postcode)
+            frames.append(counts)
+        compare_counts = pd.concat(frames, ignore_index=True) if frames else None
+    if unresolved:
+        st.write(f":red[Postcodes not found: {', '.join(unresolved)}]")
+
+if located:
+    st.session_state["compare_counts"] = compare_counts
+
+    for postcode, lat, lon in located:
+        fg.add_child(folium.Marker([lat, lon], tooltip=postcode))
+    lats = [lat for _, lat, _ in located]
+    lons = [lon for _, _, lon in located]
+    map_compare.fit_bounds([[min(lats), min(lons)], [max(lats), max(lons)]], max_zoom=13)
+
+    # Filters the data to include only the crimes with certain categories
+    selected_crime_types = dutils.add_pills_filter()
+    st.session_state["filtered_compare_counts"] = dutils.filter_crime_types(st.session_state["compare_counts"], selected_crime_types)
+else:
+    # Shows the pills
+    dutils.add_pills_filter_df()
+
+# Display map
+map_data = st_folium(map_compare,
+    feature_group_to_add=fg,
+    height=500,
+    width=700,
+    key='map_compare',
+    returned_objects=[])
+
+# Display crime statistics
+if located:
+    totals = st.session_state["filtered_compare_counts"].groupby('location')['count'].sum()
+    st.subheader("Total crimes")
+    st.dataframe(
+        totals.reindex([postcode for postcode, _, _ in located], fill_value=0).rename("Crimes").rename_axis("Postcode"),
+        use_container_width=True)
+    dutils.add_compare_plot_crime_statistics(st.session_state["filtered_compare_counts"])
+else:
+    st.subheader("Crime statistics")
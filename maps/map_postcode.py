@@ -1,6 +1,7 @@
 import utils.crime_data_fetch as api
 import utils.crime_data_db as db
-from utils.map_utils import color_function, add_crime_counts_to_map, write_selected_location_in_st
+from utils.map_utils import color_function, add_crime_counts_to_map, add_crime_tiles_to_map, write_selected_location_in_st
+import utils.tile_server as tiles
 import utils.data_utils as dutils
 import streamlit as st
 import folium
@@ -16,6 +17,10 @@ if "selected_location_postcode" not in st.session_state:
     st.session_state["selected_location_postcode"] = None
 if "crime_data_postcode" not in st.session_state:
     st.session_state["crime_data_postcode"] = None
+if "crime_counts_postcode" not in st.session_state:
+    st.session_state["crime_counts_postcode"] = None
+if "location_counts_postcode" not in st.session_state:
+    st.session_state["location_counts_postcode"] = None
 
 # Create base map
 center = [52, -1]
@@ -43,6 +48,9 @@ with col1:
 # Display date selectors and store a list of dates in st.session_state[key+"list_crime_dates"]
 dutils.add_start_end_month(key="map_postcode_")
 
+# Tiles mode streams vector tiles of the visible area
+display_mode = dutils.add_map_display_selector(key="map_postcode_", modes=("Bubbles",))
+
 # Display crimes in selected location
 if st.session_state["selected_location_postcode"]:
     lat, lon = (
@@ -50,17 +58,23 @@ if st.session_state["selected_location_postcode"]:
         st.session_state["selected_location_postcode"]["postcode_info"]["longitude"]
     )
     if st.session_state["db_connection"] != None:
-        st.session_state["crime_data_postcode"] = db.get_crime_street_level_point_dates(
+        if display_mode == "Bubbles":
+            st.session_state["location_counts_postcode"] = db.get_crime_location_counts_point_dates(
+                lat, 
+                lon, 
+                st.session_state["map_postcode_list_crime_dates"])
+        st.session_state["crime_counts_postcode"] = db.get_crime_counts_point_dates(
             lat, 
             lon, 
             st.session_state["map_postcode_list_crime_dates"])
         status_code = 200
     else:
-        list_crimes, status_code = api.get_crime_street_level_point_dates(
+        st.session_state["crime_data_postcode"], status_code = dutils.get_crime_data_point_dates(
             lat, 
             lon, 
             st.session_state["map_postcode_list_crime_dates"])
-        st.session_state["crime_data_postcode"] = api.list_crimes_to_df(list_crimes)
+        st.session_state["crime_counts_postcode"] = dutils.count_crimes_by_month_type(st.session_state["crime_data_postcode"])
+        st.session_state["location_counts_postcode"] = dutils.count_crimes_by_location(st.session_state["crime_data_postcode"])
     fg.add_child(
         folium.Marker(
             [lat, lon], tooltip="Selected location"
@@ -69,9 +83,17 @@ if st.session_state["selected_location_postcode"]:
     zoom = 13
 
     # Filters the data to include only the crimes with certain categories
-    st.session_state["filtered_crime_data_postcode"] = dutils.add_pills_filter_df(st.session_state["crime_data_postcode"])
-    # Count and plot crime occurrences
-    add_crime_counts_to_map(st.session_state["filtered_crime_data_postcode"], fg)
+    selected_crime_types = dutils.add_pills_filter()
+    st.session_state["filtered_crime_counts_postcode"] = dutils.filter_crime_types(st.session_state["crime_counts_postcode"], selected_crime_types)
+    if display_mode == "Tiles":
+        add_crime_tiles_to_map(map_postcode, tiles.tile_url(
+            tiles.start_tile_server(), 
+            st.session_state["map_postcode_list_crime_dates"], 
+            selected_crime_types))
+    else:
+        st.session_state["filtered_location_counts_postcode"] = dutils.filter_location_counts(st.session_state["location_counts_postcode"], selected_crime_types)
+        # Count and plot crime occurrences
+        add_crime_counts_to_map(st.session_state["filtered_location_counts_postcode"], fg)
 else: 
     # Shows the pills
     dutils.add_pills_filter_df()
@@ -100,7 +122,7 @@ else:
 
 # Display crime statistics
 if st.session_state["selected_location_postcode"]:
-    dutils.add_area_line_plot_crime_statistics(st.session_state["filtered_crime_data_postcode"], key="map_postcode_")
-    dutils.add_bar_plot_crime_statistics(st.session_state["filtered_crime_data_postcode"])
+    dutils.add_area_line_plot_crime_statistics(st.session_state["filtered_crime_counts_postcode"], key="map_postcode_")
+    dutils.add_bar_plot_crime_statistics(st.session_state["filtered_crime_counts_postcode"])
 else:
     st.subheader("Crime statistics")
\ No newline at end of file
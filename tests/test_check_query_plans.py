@@ -0,0 +1,28 @@
+import utils.check_query_plans as check
+
+# EXPLAIN (FORMAT JSON) plan of a query reading a month partition sequentially
+SEQ_SCAN_PLAN = {
+    "Node Type": "Aggregate",
+    "Plans": [{
+        "Node Type": "Append",
+        "Plans": [
+            {"Node Type": "Seq Scan", "Relation Name": "crimes_y2024m01"},
+            {"Node Type": "Bitmap Heap Scan", "Relation Name": "crimes_y2024m02",
+             "Plans": [{"Node Type": "Bitmap Index Scan", "Index Name": "crimes_y2024m02_geom_idx"}]},
+            {"Node Type": "Seq Scan", "Relation Name": "load_ledger"},
+        ],
+    }],
+}
+
+def test_seq_scans_finds_checked_tables_only():
+    assert list(check._seq_scans(SEQ_SCAN_PLAN)) == ["crimes_y2024m01"]
+
+def test_seq_scans_index_scan_passes():
+    plan = {"Node Type": "Index Scan", "Relation Name": "crime_location_counts"}
+    assert list(check._seq_scans(plan)) == []
+
+def test_check_fails_without_plans(monkeypatch):
+    monkeypatch.setattr(check.db.get_availability, "__wrapped__", lambda: ["2024-01"])
+    # Every query skipped: nothing was explained
+    monkeypatch.setattr(check, "app_queries", lambda lat, lon, dates: [("counts point", lambda: None)])
+    assert not check.check_query_plans(51.5, -0.12)
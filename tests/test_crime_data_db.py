@@ -0,0 +1,160 @@
+import pytest
+import psycopg2
+import utils.crime_data_db as db
+
+POLYGON = [[-0.13, 51.50], [-0.12, 51.50], [-0.12, 51.51], [-0.13, 51.51]]
+DATES = ["2024-01", "2024-02"]
+
+# Every area query of the app, with the caches bypassed
+AREA_QUERIES = {
+    "counts area": lambda: db.get_crime_counts_area_dates(POLYGON, DATES),
+    "grid counts area": lambda: db.get_crime_grid_counts_area_dates.__wrapped__(POLYGON, DATES, 100.0, ("Burglary",)),
+    "street level area": lambda: db.get_crime_street_level_area_dates(POLYGON, DATES),
+    "location counts area": lambda: db.get_crime_location_counts_area_dates.__wrapped__(POLYGON, DATES),
+}
+
+@pytest.fixture
+def sent_queries(monkeypatch):
+    queries = []
+    def fetch_all(query, params=None):
+        queries.append((query, params))
+        return []
+    monkeypatch.setattr(db, "fetch_all", fetch_all)
+    db.get_month_cache().entries.clear()
+    return queries
+
+@pytest.mark.parametrize("name", sorted(AREA_QUERIES))
+def test_area_queries_filter_geography(name, sent_queries):
+    AREA_QUERIES[name]()
+    assert sent_queries
+    for query, params in sent_queries:
+        # geom is a geography: there is no ST_Within(geography, geometry)
+        assert "ST_Within" not in query
+        assert "ST_GeomFromText" not in query
+        assert db.AREA_FILTER in query
+        assert query.count("%s") == len(params)
+        assert db._polygon_wkt(POLYGON) in params
+
+def test_location_counts_aggregated_over_the_months(sent_queries, monkeypatch):
+    # One row per location and crime type, with the archive name
+    rows = [(51.5, -0.12, "Violence and sexual offences", 4), (51.5, -0.12, "Burglary", 1), (51.6, -0.13, "Burglary", 2)]
+    monkeypatch.setattr(db, "fetch_all", lambda query, params=None: sent_queries.append((query, params)) or rows)
+    counts = db.get_crime_location_counts_point_dates.__wrapped__(51.5, -0.12, ["2024-01", "2024-02", "2024-03"])
+    [(query, params)] = sent_queries
+    assert "GROUP BY latitude, longitude, crime_type;" in query
+    assert params[-2:] == ("2024-01-01", "2024-03-01")
+    assert counts.columns.tolist() == ["latitude", "longitude", "Burglary", "Violent crime"]
+    assert counts["Burglary"].tolist() == [1, 2]
+    assert counts["Violent crime"].tolist() == [4, 0]
+
+def test_counts_without_months_is_empty(sent_queries):
+    counts = db.get_crime_counts_point_dates(51.5, -0.12, [])
+    assert sent_queries == []
+    assert counts.columns.tolist() == ["month", "crime_type", "count"]
+
+def test_archive_crime_types_are_renamed(monkeypatch):
+    # The archive calls violent crime "Violence and sexual offences"
+    monkeypatch.setattr(db, "fetch_all", lambda query, params=None: [
+        ("Violence and sexual offences", "id1", "2024-01-01", 51.5, -0.12),
+        ("Burglary", "id2", "2024-01-01", 51.5, -0.12),
+    ])
+    db.get_month_cache().entries.clear()
+    crimes = db.get_crime_street_level_point_dates(51.5, -0.12, ["2024-01"])
+    assert crimes["crime_type"].tolist() == ["Violent crime", "Burglary"]
+    assert crimes["crime_type"].dtype == db.api.CRIME_TYPE_DTYPE
+
+def test_archive_crime_types_filter_both_names():
+    assert db.api.archive_crime_types(["Violent crime", "Burglary"]) == [
+        "Violent crime", "Burglary", "Violence and sexual offences"]
+
+class FakeConnection:
+    """
+    Connection that raises OperationalError on every query once the database
+    restarted, while closed and the transaction status still look healthy.
+    """
+    def __init__(self, alive=True):
+        self.alive = alive
+        self.closed = 0
+        self.queries = []
+
+    def get_transaction_status(self):
+        return psycopg2.extensions.TRANSACTION_STATUS_IDLE
+
+    def cursor(self):
+        return FakeCursor(self)
+
+    def commit(self):
+        pass
+
+    def rollback(self):
+        pass
+
+class FakeCursor:
+    def __init__(self, conn):
+        self.conn = conn
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        return False
+
+    def execute(self, query, params=None):
+        if not self.conn.alive:
+            self.conn.closed = 2
+            raise psycopg2.OperationalError("server closed the connection unexpectedly")
+        self.conn.queries.append(query)
+
+    def fetchall(self):
+        return [(1,)]
+
+class FakePool:
+    def __init__(self, conns):
+        self.idle = list(conns)
+        self.discarded = []
+
+    def getconn(self):
+        return self.idle.pop(0) if self.idle else FakeConnection()
+
+    def putconn(self, conn, close=False):
+        (self.discarded if close else self.idle).append(conn)
+
+@pytest.fixture
+def stale_pool(monkeypatch):
+    # Every pooled connection died in a database restart
+    pool = FakePool([FakeConnection(alive=False) for _ in range(3)])
+    monkeypatch.setattr(db, "get_db_pool", lambda: pool)
+    monkeypatch.setattr(db, "_returned_at", {})
+    return pool
+
+def test_fetch_all_retries_past_stale_connections(stale_pool):
+    # Recently used: not pinged, so the query itself fails on each of them
+    for conn in stale_pool.idle:
+        db._returned_at[id(conn)] = db.time.monotonic()
+    assert db.fetch_all("SELECT 2;") == [(1,)]
+    assert len(stale_pool.discarded) == 3
+    assert len(stale_pool.idle) == 1
+    assert stale_pool.idle[0].queries[-1] == "SELECT 2;"
+
+def test_checkout_pings_idle_connections(stale_pool):
+    with db.checkout_connection() as conn:
+        assert conn.alive
+    assert len(stale_pool.discarded) == 3
+    # A connection returned just now is not pinged again
+    with db.checkout_connection() as again:
+        assert again is conn
+    assert conn.queries == ["SELECT 1;"]
+
+def test_counts_postcodes_resolves_each_postcode_once(monkeypatch):
+    lookups = []
+    def get_postcode_info_from_postcodes(postcodes):
+        lookups.append(list(postcodes))
+        return [{"latitude": 51.5, "longitude": -0.12}, None, {"latitude": 51.6, "longitude": -0.13}]
+    monkeypatch.setattr(db.api, "get_postcode_info_from_postcodes", get_postcode_info_from_postcodes)
+    monkeypatch.setattr(db, "fetch_all", lambda query, params=None: [(1, "2024-01-01", "Burglary", 3)])
+    counts, located, unresolved = db.get_crime_counts_postcodes_dates(["E1 6AN", "XX1 1XX", "N1 9GU"], ["2024-01"])
+    assert lookups == [["E1 6AN", "XX1 1XX", "N1 9GU"]]
+    assert located == [("E1 6AN", 51.5, -0.12), ("N1 9GU", 51.6, -0.13)]
+    assert unresolved == ["XX1 1XX"]
+    assert counts["postcode"].tolist() == ["N1 9GU"]
+    assert counts["count"].tolist() == [3]
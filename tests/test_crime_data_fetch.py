@@ -0,0 +1,14 @@
+import numpy as np
+import utils.crime_data_fetch as api
+import utils.crime_data_dtypes_benchmark as benchmark
+
+def test_compact_crimes_df_memory_per_row():
+    legacy = benchmark.legacy_crimes_df(2000, np.random.default_rng(0))
+    compact = api.compact_crimes_df(legacy)
+    assert compact.dtypes.tolist() == [api.CRIME_TYPE_DTYPE, api.CRIME_ID_DTYPE, legacy['month'].dtype, np.float32, np.float32]
+    assert compact['crime_type'].cat.codes.dtype.itemsize == 1
+    assert benchmark.memory_per_row(compact[['latitude', 'longitude']]) == 8
+    # 211 -> 84 bytes per row with these synthetic crimes
+    assert benchmark.memory_per_row(compact) < 0.5 * benchmark.memory_per_row(legacy)
+    assert benchmark.pickled_per_row(compact) < benchmark.pickled_per_row(legacy)
+    assert compact['crime_type'].astype(object).equals(legacy['crime_type'])
@@ -0,0 +1,205 @@
+import io
+import types
+import utils.database_update as dbu
+
+class FakeCursor:
+    """
+    Records the statements and returns canned rows for the queries whose
+    text contains a key of results.
+    """
+    def __init__(self, results=None):
+        self.results = results or {}
+        self.statements = []
+        self.rows = []
+
+    def execute(self, query, params=None):
+        self.statements.append((" ".join(query.split()), params))
+        self.rows = next((rows for key, rows in self.results.items() if key in query), [])
+
+    def fetchall(self):
+        return self.rows
+
+    def fetchone(self):
+        return self.rows[0] if self.rows else None
+
+def test_drop_stale_month_tables():
+    cursor = FakeCursor({"FROM pg_class": [("crimes_load_y2024m01_1700000000",), ("crimes_load_y2024m02_1700000001",)]})
+    dbu.drop_stale_month_tables(cursor)
+    statements = [query for query, _ in cursor.statements]
+    assert "DROP TABLE IF EXISTS crimes_load_y2024m01_1700000000;" in statements
+    assert "DROP TABLE IF EXISTS crimes_load_y2024m02_1700000001;" in statements
+    query, params = cursor.statements[-1]
+    assert query.startswith("UPDATE load_ledger SET checksum = NULL")
+    assert params == (["2024-01-01", "2024-02-01"],)
+
+def test_drop_stale_month_tables_none_left():
+    cursor = FakeCursor()
+    dbu.drop_stale_month_tables(cursor)
+    assert len(cursor.statements) == 1
+
+def test_attach_month_table_deduplicates_before_attaching():
+    cursor = FakeCursor({"RETURNING": [("2023-11",), ("2023-12",), ("2023-12",)]})
+    changed = dbu.attach_month_table(cursor, "crimes_load_y2024m01_1700000000", "2024-01")
+    assert changed == ["2023-11", "2023-12"]
+    statements = [query for query, _ in cursor.statements]
+    deletes = [i for i, query in enumerate(statements) if query.startswith("DELETE")]
+    attach = next(i for i, query in enumerate(statements) if "ATTACH PARTITION" in query)
+    assert len(deletes) == 2 and max(deletes) < attach
+    # Ids of later months win, earlier months lose theirs
+    assert cursor.statements[deletes[0]][1] == ("2024-02-01",)
+    assert cursor.statements[deletes[1]][1] == ("2024-01-01",)
+
+class CopyCursor(FakeCursor):
+    def copy_expert(self, sql, file, size=8192):
+        self.statements.append((" ".join(sql.split()), None))
+
+def test_copy_load_returns_the_months_crimes_moved_out_of():
+    csv_file = io.StringIO("Crime ID,Month,Crime type\nabc,2024-01,Burglary\n")
+    cursor = CopyCursor({"COUNT(*)": [(1,)], "TO_CHAR(c.month": [("2023-12",)]})
+    total_rows, moved_months = dbu.load_street_csv_copy(cursor, csv_file, "2024-01-city-of-london-street.csv")
+    assert total_rows == 1 and moved_months == {"2023-12"}
+    statements = [query for query, _ in cursor.statements]
+    moved = next(i for i, query in enumerate(statements) if "TO_CHAR(c.month" in query)
+    upsert = next(i for i, query in enumerate(statements) if "ON CONFLICT (crime_id)" in query)
+    # The old months must be read before the upsert moves the rows
+    assert moved < upsert
+
+def test_copy_load_into_month_table_has_nothing_to_move():
+    csv_file = io.StringIO("Crime ID,Month,Crime type\nabc,2024-01,Burglary\n")
+    cursor = CopyCursor({"COUNT(*)": [(1,)]})
+    _, moved_months = dbu.load_street_csv_copy(cursor, csv_file, "2024-01-city-of-london-street.csv", "crimes_load_y2024m01_1700000000")
+    assert moved_months == set()
+    assert not any("TO_CHAR(c.month" in query for query, _ in cursor.statements)
+
+class ServerCursor(FakeCursor):
+    def __init__(self, results, server_version):
+        super().__init__(results)
+        self.connection = types.SimpleNamespace(server_version=server_version)
+
+def test_cluster_partitions_before_postgresql_15():
+    cursor = ServerCursor({
+        "relkind": [(True,)],
+        "FROM pg_inherits": [("crime_location_counts_y2024m01", "crime_location_counts_y2024m01_geom_idx")],
+    }, 140000)
+    dbu.cluster_crime_location_counts(cursor)
+    statements = [query for query, _ in cursor.statements]
+    assert "CLUSTER crime_location_counts_y2024m01 USING crime_location_counts_y2024m01_geom_idx;" in statements
+    assert "CLUSTER crime_location_counts USING crime_location_counts_geom_idx;" not in statements
+
+def test_cluster_partitioned_table_from_postgresql_15():
+    cursor = ServerCursor({"relkind": [(True,)]}, 150000)
+    dbu.cluster_crime_location_counts(cursor)
+    assert cursor.statements[-1][0] == "CLUSTER crime_location_counts USING crime_location_counts_geom_idx;"
+
+class FakeMember:
+    def __init__(self, filename, crc, file_size=100):
+        self.filename = filename
+        self.CRC = crc
+        self.file_size = file_size
+
+class FakeConnection:
+    def __init__(self, cursor):
+        self._cursor = cursor
+
+    def cursor(self):
+        return self
+
+    def __enter__(self):
+        return self._cursor
+
+    def __exit__(self, *args):
+        return False
+
+    def commit(self):
+        pass
+
+    def close(self):
+        pass
+
+def test_select_changed_members_seeds_ledger_for_months_loaded_before_it(monkeypatch):
+    old = FakeMember("2024-01/2024-01-city-of-london-street.csv", 1)
+    changed = FakeMember("2024-02/2024-02-city-of-london-street.csv", 2)
+    new = FakeMember("2024-03/2024-03-city-of-london-street.csv", 3)
+    cursor = FakeCursor({
+        "FROM load_ledger": [("2024-02-city-of-london-street.csv", dbu.member_checksum(FakeMember("", 1)))],
+        "to_regclass": [(True,)],
+        "FROM crime_months": [("2024-01",), ("2024-02",)],
+    })
+    monkeypatch.setattr(dbu, "connect_db", lambda: FakeConnection(cursor))
+    assert dbu.select_changed_members([old, changed, new]) == [changed, new]
+    seeds = [params for query, params in cursor.statements if query.startswith("INSERT INTO load_ledger")]
+    assert seeds == [("2024-01-city-of-london-street.csv", "2024-01-city-of-london-street.csv", dbu.member_checksum(old), None)]
+
+class FakeResponse:
+    def __init__(self, status_code=200, headers=None, body=b""):
+        self.status_code = status_code
+        self.headers = headers or {}
+        self.body = body
+
+    def raise_for_status(self):
+        if self.status_code >= 400:
+            raise dbu.requests.HTTPError(f"{self.status_code} error")
+
+    def iter_content(self, chunk_size):
+        yield self.body
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        return False
+
+def fake_server(monkeypatch, head, responses):
+    """
+    Serves head to HEAD requests and responses in order to GET requests,
+    returns the headers of the GET requests.
+    """
+    sent = []
+    def get(url, headers=None, **kwargs):
+        sent.append(headers)
+        return responses.pop(0)
+    monkeypatch.setattr(dbu.requests, "head", lambda *args, **kwargs: head)
+    monkeypatch.setattr(dbu.requests, "get", get)
+    monkeypatch.setattr(dbu.time, "sleep", lambda seconds: None)
+    return sent
+
+def download(tmp_path, partial=None, state=None):
+    path = tmp_path / "latest.zip"
+    state_path = tmp_path / "latest.zip.state.json"
+    if partial is not None:
+        path.write_bytes(partial)
+    if state is not None:
+        dbu._write_download_state(state_path, state)
+    return dbu.download_crime_data("http://archive", str(path), str(state_path)), path, state_path
+
+def test_download_complete_partial_file_on_416(tmp_path, monkeypatch):
+    head = FakeResponse(headers={"ETag": '"v1"', "Content-Length": "6", "Accept-Ranges": "bytes"})
+    sent = fake_server(monkeypatch, head, [FakeResponse(416, {"ETag": '"v1"'})])
+    state = {"version": '"v1"', "size": 6, "complete": False, "loaded": False}
+    needs_loading, path, state_path = download(tmp_path, b"abcdef", state)
+    assert needs_loading
+    assert sent == [{"Range": "bytes=6-", "If-Range": '"v1"'}]
+    assert path.read_bytes() == b"abcdef"
+    assert dbu._read_download_state(state_path)["complete"]
+
+def test_download_restarts_when_resumed_archive_changed(tmp_path, monkeypatch):
+    head = FakeResponse(headers={"ETag": '"v1"', "Content-Length": "6", "Accept-Ranges": "bytes"})
+    responses = [FakeResponse(206, {"ETag": '"v2"'}, b"def"), FakeResponse(200, {"ETag": '"v2"', "Content-Length": "7"}, b"ABCDEFG")]
+    sent = fake_server(monkeypatch, head, responses)
+    state = {"version": '"v1"', "size": 6, "complete": False, "loaded": False}
+    needs_loading, path, state_path = download(tmp_path, b"abc", state)
+    assert needs_loading
+    assert sent[1] == {}
+    assert path.read_bytes() == b"ABCDEFG"
+    assert dbu._read_download_state(state_path) == {"version": '"v2"', "size": 7, "complete": True, "loaded": False}
+
+def test_download_without_content_length(tmp_path, monkeypatch):
+    head = FakeResponse(headers={"ETag": '"v1"'})
+    fake_server(monkeypatch, head, [FakeResponse(200, {"ETag": '"v1"'}, b"abcdef")])
+    needs_loading, path, state_path = download(tmp_path)
+    assert needs_loading
+    assert path.read_bytes() == b"abcdef"
+    assert dbu._read_download_state(state_path)["size"] is None
+    # The complete file is reused although its size is unknown
+    fake_server(monkeypatch, head, [])
+    assert download(tmp_path)[0]
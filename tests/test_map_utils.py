@@ -0,0 +1,22 @@
+import folium
+import pandas as pd
+from utils.map_utils import add_crime_counts_to_map
+
+def _location_counts(n):
+    return pd.DataFrame({
+        'latitude': [51.5 + i * 1e-4 for i in range(n)],
+        'longitude': [-0.12] * n,
+        'Burglary': list(range(1, n + 1)),
+        'Drugs': [1] * n,
+    })
+
+def test_geojson_bubbles_styled_once_from_properties():
+    folium_map = folium.Map()
+    feature_group = folium.FeatureGroup().add_to(folium_map)
+    assert add_crime_counts_to_map(_location_counts(300), feature_group, "geojson") == "geojson"
+    html = folium_map.get_root().render()
+    # No per-feature style switch, one copy of each radius (plus the default
+    # of the marker options)
+    assert "_styler" not in html and "case " not in html
+    assert html.count('"radius"') == 300 + 1
+    assert "layer.setRadius(properties.radius)" in html
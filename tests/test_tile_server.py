@@ -0,0 +1,61 @@
+import threading
+import urllib.error
+import urllib.request
+from http.server import ThreadingHTTPServer
+import pytest
+import utils.tile_server as tiles
+
+@pytest.fixture
+def tile_server(monkeypatch):
+    requested = []
+    def get_tile(z, x, y, date_start, date_end, crime_types, data_version=""):
+        requested.append((z, data_version))
+        return b"tile"
+    monkeypatch.setattr(tiles, "get_tile", get_tile)
+    monkeypatch.setattr(tiles, "get_data_version", lambda: "2024-03-01 10:00:00+00")
+    server = ThreadingHTTPServer(("127.0.0.1", 0), tiles.TileRequestHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    yield f"http://127.0.0.1:{server.server_address[1]}", requested
+    server.shutdown()
+
+def test_tiles_below_min_zoom_are_no_content(tile_server):
+    base_url, requested = tile_server
+    with urllib.request.urlopen(f"{base_url}/crimes/{tiles.TILE_MIN_ZOOM - 1}/1/1.pbf?start=2024-01&end=2024-02") as response:
+        assert response.status == 204
+    assert requested == []
+
+def test_tiles_are_cached_per_data_version(tile_server):
+    base_url, requested = tile_server
+    with urllib.request.urlopen(f"{base_url}/crimes/{tiles.TILE_MIN_ZOOM}/1/1.pbf?start=2024-01&end=2024-02") as response:
+        assert response.status == 200 and response.read() == b"tile"
+    assert requested == [(tiles.TILE_MIN_ZOOM, "2024-03-01 10:00:00+00")]
+    assert "v=2024-03-01" in tiles.tile_url(base_url, ["2024-01", "2024-02"], ["Drugs"])
+
+def test_tiles_mode_needs_a_public_url(monkeypatch):
+    monkeypatch.setattr(tiles, "TILE_SERVER_PUBLIC_URL", None)
+    assert tiles.start_tile_server.__wrapped__() is None
+
+def test_tile_errors_hide_the_exception(tile_server, monkeypatch):
+    base_url, _ = tile_server
+    def get_tile(*args):
+        raise RuntimeError("could not connect to server: host=db password=secret")
+    monkeypatch.setattr(tiles, "get_tile", get_tile)
+    with pytest.raises(urllib.error.HTTPError) as error:
+        urllib.request.urlopen(f"{base_url}/crimes/{tiles.TILE_MIN_ZOOM}/1/1.pbf?start=2024-01&end=2024-02")
+    assert error.value.code == 500
+    assert b"secret" not in error.value.read()
+
+def test_new_data_version_clears_the_tile_cache(monkeypatch):
+    version = ["2024-03-01"]
+    def fetch_all(query, params=None):
+        return [(version[0],)] if "load_ledger" in query else [(b"tile",)]
+    monkeypatch.setattr(tiles.db, "fetch_all", fetch_all)
+    monkeypatch.setattr(tiles, "DATA_VERSION_TTL", -1)
+    monkeypatch.setattr(tiles, "_data_version", (None, None))
+    tiles.get_tile.cache_clear()
+    tiles.get_tile(tiles.TILE_MIN_ZOOM, 1, 1, "2024-01", "2024-02", (), tiles.get_data_version())
+    assert tiles.get_data_version() == "2024-03-01"
+    assert tiles.get_tile.cache_info().currsize == 1
+    version[0] = "2024-04-01"
+    assert tiles.get_data_version() == "2024-04-01"
+    assert tiles.get_tile.cache_info().currsize == 0
@@ -0,0 +1,108 @@
+"""
+Checks that the app's queries use the indexes created by database_update.py.
+
+Every query function of crime_data_db (and the tile server) is run once with
+EXPLAIN instead of the query itself, and the check fails if any plan reads
+crimes or crime_location_counts with a sequential scan:
+    python -m utils.check_query_plans --lat 51.5074 --lon -0.1278
+
+Run it against a loaded database: on empty or freshly loaded tables without
+statistics the planner rightly prefers sequential scans.
+"""
+import sys
+import math
+import argparse
+import utils.crime_data_fetch as api
+import utils.crime_data_db as db
+import utils.tile_server as tiles
+from utils.geo_utils import grid_cell_size
+
+# Sequential scans on these tables (or their partitions) fail the check
+CHECKED_TABLES = ("crimes", "crime_location_counts")
+# Zoom of the tile and heatmap grid queries that are checked
+CHECK_ZOOM = 14
+
+def _seq_scans(plan):
+    """
+    Yields the checked tables read with a sequential scan anywhere in a plan.
+    """
+    if plan["Node Type"] == "Seq Scan":
+        relation = plan.get("Relation Name", "")
+        if any(relation == table or relation.startswith(f"{table}_") for table in CHECKED_TABLES):
+            yield relation
+    for child in plan.get("Plans", []):
+        yield from _seq_scans(child)
+
+def _tile_xy(lat, lon, zoom):
+    n = 2 ** zoom
+    x = int((lon + 180) / 360 * n)
+    y = int((1 - math.asinh(math.tan(math.radians(lat))) / math.pi) / 2 * n)
+    return x, y
+
+def app_queries(lat, lon, dates):
+    """
+    Returns (name, callable) for every database query of the app, with the
+    caches bypassed so that the queries are always sent to the database (the
+    month cache of crime_data_db is not used while explaining).
+    """
+    # Square of about 1 km around the point, as drawn on the area map
+    d = 0.005
+    polygon = [[lon - d, lat - d], [lon + d, lat - d], [lon + d, lat + d], [lon - d, lat + d], [lon - d, lat - d]]
+    crime_types = list(api.FROM_PRETTY_CATEGORIES.keys())
+    cell_size = grid_cell_size(CHECK_ZOOM)
+    tile_x, tile_y = _tile_xy(lat, lon, CHECK_ZOOM)
+    return [
+        ("street level point", lambda: db.get_crime_street_level_point_dates(lat, lon, dates)),
+        ("street level area", lambda: db.get_crime_street_level_area_dates(polygon, dates)),
+        ("counts point", lambda: db.get_crime_counts_point_dates(lat, lon, dates)),
+        ("counts area", lambda: db.get_crime_counts_area_dates(polygon, dates)),
+        ("counts locations", lambda: db.get_crime_counts_locations_dates.__wrapped__(((lat, lon), (lat + d, lon + d)), (polygon,), dates)),
+        ("location counts point", lambda: db.get_crime_location_counts_point_dates.__wrapped__(lat, lon, dates)),
+        ("location counts area", lambda: db.get_crime_location_counts_area_dates.__wrapped__(polygon, dates)),
+        ("grid counts point", lambda: db.get_crime_grid_counts_point_dates.__wrapped__(lat, lon, dates, cell_size, crime_types)),
+        ("grid counts area", lambda: db.get_crime_grid_counts_area_dates.__wrapped__(polygon, dates, cell_size, crime_types)),
+        ("vector tile", lambda: tiles.get_tile.__wrapped__(CHECK_ZOOM, tile_x, tile_y, dates[0], dates[-1], tuple(crime_types))),
+    ]
+
+def check_query_plans(lat, lon, months=12):
+    """
+    EXPLAINs the app's queries for a location and the last months available.
+
+    Returns:
+    --------
+    bool
+        True if at least one plan was checked and no query reads a checked
+        table with a sequential scan.
+    """
+    dates = sorted(db.get_availability.__wrapped__())[-months:]
+    if not dates:
+        print("No months available, load the database first")
+        return False
+
+    passed = True
+    checked = 0
+    for name, run in app_queries(lat, lon, dates):
+        with db.explain_queries() as plans:
+            run()
+        if not plans:
+            print(f"SKIP {name}: no query sent")
+        checked += len(plans)
+        for _, plan in plans:
+            seq_scans = sorted(set(_seq_scans(plan)))
+            if seq_scans:
+                passed = False
+                print(f"FAIL {name}: sequential scan on {', '.join(seq_scans)}")
+            else:
+                print(f"OK   {name}")
+    if checked == 0:
+        print("No query plans were checked")
+        return False
+    return passed
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Fail if the app's queries use sequential scans on the crime tables.")
+    parser.add_argument("--lat", type=float, default=51.5074, help="Latitude of the checked location (default: central London).")
+    parser.add_argument("--lon", type=float, default=-0.1278, help="Longitude of the checked location.")
+    parser.add_argument("--months", type=int, default=12, help="Number of most recent months queried (default: 12).")
+    args = parser.parse_args()
+    sys.exit(0 if check_query_plans(args.lat, args.lon, args.months) else 1)
@@ -1,44 +1,252 @@
 import pandas as pd
 import streamlit as st
 import psycopg2
+import psycopg2.extensions
+from psycopg2.pool import ThreadedConnectionPool
 import os
-from datetime import date
+import threading
+from contextlib import contextmanager
+from collections import OrderedDict
 import time
 import utils.crime_data_fetch as api
+from utils.geo_utils import grid_cell_bounds
+
+DB_POOL_MIN_CONN = 1
+DB_POOL_MAX_CONN = int(os.environ.get("DB_POOL_MAX_CONN", 10))
+# Connections idle for longer than this are pinged on checkout: after a
+# database restart the pooled connections are dead but still look healthy.
+DB_POOL_PING_AFTER_SECONDS = int(os.environ.get("DB_POOL_PING_AFTER_SECONDS", 30))
+
+# Limits checkouts to the pool size so that sessions wait for a free
+# connection instead of getting a PoolError.
+_pool_slots = threading.BoundedSemaphore(DB_POOL_MAX_CONN)
+
+# Time each connection was returned to the pool, by id(conn)
+_returned_at = {}
 
-# TODO: Handle what happens if the database breaks in the middle of a run.
 @st.cache_resource
-def get_db_connection():
+def get_db_pool():
+    """
+    Creates the connection pool shared by all sessions of the app.
+
+    Returns:
+    --------
+    psycopg2.pool.ThreadedConnectionPool or None
+        The pool, or None if the database is not reachable (the app then uses
+        the police API instead).
+    """
     try:
-        conn = psycopg2.connect(
+        pool = ThreadedConnectionPool(
+            DB_POOL_MIN_CONN,
+            DB_POOL_MAX_CONN,
             dbname=os.environ.get("DB_NAME"),
             user=os.environ.get("DB_USER"),
             password=os.environ.get("DB_PASSWORD"),
             host=os.environ.get("DB_HOST"),
             port=os.environ.get("DB_PORT")
         )
-        return conn
+        return pool
     except Exception as e:
         # st.error(f"Database connection failed: {e}")
         return None
 
+def _is_healthy(conn):
+    return (
+        not conn.closed
+        and conn.get_transaction_status() != psycopg2.extensions.TRANSACTION_STATUS_UNKNOWN
+    )
+
+def _is_alive(conn):
+    """
+    Pings a connection with SELECT 1 if it has been idle for longer than
+    DB_POOL_PING_AFTER_SECONDS (or is new to the pool).
+    """
+    if time.monotonic() - _returned_at.get(id(conn), float("-inf")) <= DB_POOL_PING_AFTER_SECONDS:
+        return True
+    try:
+        with conn.cursor() as cur:
+            cur.execute("SELECT 1;")
+        conn.rollback()
+        return True
+    except (psycopg2.OperationalError, psycopg2.InterfaceError):
+        return False
+
+def _discard(pool, conn):
+    _returned_at.pop(id(conn), None)
+    pool.putconn(conn, close=True)
+
+@contextmanager
+def checkout_connection():
+    """
+    Checks out a connection from the pool and returns it when done.
+
+    Broken connections, and idle ones that do not answer a ping, are
+    discarded until a live or new connection is found. The transaction is
+    committed on success and rolled back on error, so an aborted query never
+    leaks into other sessions.
+    """
+    pool = get_db_pool()
+    with _pool_slots:
+        # The pool holds at most DB_POOL_MAX_CONN dead connections
+        for _ in range(DB_POOL_MAX_CONN):
+            conn = pool.getconn()
+            if _is_healthy(conn) and _is_alive(conn):
+                break
+            _discard(pool, conn)
+        else:
+            conn = pool.getconn()
+        try:
+            yield conn
+            conn.commit()
+        except Exception:
+            if not conn.closed:
+                conn.rollback()
+            raise
+        finally:
+            if _is_healthy(conn):
+                _returned_at[id(conn)] = time.monotonic()
+                pool.putconn(conn)
+            else:
+                _discard(pool, conn)
+
+# (query, plan) pairs collected by fetch_all() inside explain_queries()
+_explained_plans = None
+
+@contextmanager
+def explain_queries():
+    """
+    Inside this block fetch_all() runs EXPLAIN on its queries instead of the
+    queries themselves and returns no rows. The yielded list collects the
+    (query, plan) of every query, see utils/check_query_plans.py.
+    """
+    global _explained_plans
+    _explained_plans = []
+    try:
+        yield _explained_plans
+    finally:
+        _explained_plans = None
+
+def _execute(query, params):
+    with checkout_connection() as conn, conn.cursor() as cur:
+        if _explained_plans is not None:
+            cur.execute("EXPLAIN (FORMAT JSON) " + query, params)
+            _explained_plans.append((query, cur.fetchone()[0][0]["Plan"]))
+            return []
+        cur.execute(query, params)
+        return cur.fetchall()
+
+def fetch_all(query, params=None):
+    """
+    Runs a query on a pooled connection and returns all rows. If the
+    connection drops (e.g. the database restarted) it is discarded and the
+    query is retried, up to the pool size, since the next pooled connections
+    may be dead as well. Cancelled queries (statement timeouts) are not
+    retried.
+    """
+    for attempt in range(DB_POOL_MAX_CONN):
+        try:
+            return _execute(query, params)
+        except psycopg2.extensions.QueryCanceledError:
+            raise
+        except (psycopg2.OperationalError, psycopg2.InterfaceError):
+            if attempt == DB_POOL_MAX_CONN - 1:
+                raise
+
 @st.cache_data(ttl='30d',max_entries=10000,show_spinner=False)
 def get_availability():
     try:
-        with st.session_state["db_connection"].cursor() as cur:
-            # TODO: The code below is slower but it might be worth to put it as a MATERIALIZED VIEW
-            # cur.execute("SELECT DISTINCT TO_CHAR(month, 'YYYY-MM') FROM crimes ORDER BY 1;")
-            # available_dates = [row[0] for row in cur.fetchall()]
-            # cur.execute("SELECT DISTINCT DATE_TRUNC('month', month)::DATE FROM crimes ORDER BY 1;")
-            # available_dates = [row[0].strftime("%Y-%m") for row in cur.fetchall()]
-            cur.execute("SELECT * FROM crime_months;")
-            available_dates = [row[0] for row in cur.fetchall()]
+        # TODO: The code below is slower but it might be worth to put it as a MATERIALIZED VIEW
+        # cur.execute("SELECT DISTINCT TO_CHAR(month, 'YYYY-MM') FROM crimes ORDER BY 1;")
+        # available_dates = [row[0] for row in cur.fetchall()]
+        # cur.execute("SELECT DISTINCT DATE_TRUNC('month', month)::DATE FROM crimes ORDER BY 1;")
+        # available_dates = [row[0].strftime("%Y-%m") for row in cur.fetchall()]
+        available_dates = [row[0] for row in fetch_all("SELECT * FROM crime_months;")]
         return available_dates
     except Exception as e:
         st.error(f"Error fetching available dates: {e}")
         return []
 
-@st.cache_data(ttl='30d',max_entries=10000,show_spinner=False)
+# Per (location, month) result cache used by the *_dates functions
+MONTH_CACHE_MAX_ENTRIES = 10000
+MONTH_CACHE_TTL_SECONDS = 30 * 24 * 3600
+
+class MonthCache:
+    """
+    Thread-safe LRU cache of query result DataFrames keyed by (location key, month),
+    with a time to live per entry.
+    """
+    def __init__(self, max_entries=MONTH_CACHE_MAX_ENTRIES, ttl=MONTH_CACHE_TTL_SECONDS):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+
+    def get(self, key):
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                return None
+            stored_at, df = entry
+            if time.monotonic() - stored_at > self.ttl:
+                del self.entries[key]
+                return None
+            self.entries.move_to_end(key)
+            return df
+
+    def put(self, key, df):
+        with self.lock:
+            self.entries[key] = (time.monotonic(), df)
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+
+@st.cache_resource
+def get_month_cache():
+    return MonthCache()
+
+def _rows_to_df(data):
+    return api.compact_crimes_df(pd.DataFrame(data, columns=api.DF_COLUMNS))
+
+def _get_dates_cached(location_key, dates, fetch_months, rows_to_df=_rows_to_df):
+    """
+    Assembles the results of a query for a list of months from the month
+    cache, querying the database only for the months that are not cached.
+
+    Parameters:
+    -----------
+    location_key : tuple
+        Hashable description of the query (kind of result, point and radius,
+        polygon).
+    dates : list of str
+        Months in YYYY-MM format.
+    fetch_months : callable
+        Takes a list of missing months and returns their rows as a DataFrame
+        with a 'month' column.
+    rows_to_df : callable, optional
+        Converts query rows to the DataFrame returned for an empty list of
+        months. Default is the crimes DataFrame.
+
+    Returns:
+    --------
+    pandas.DataFrame
+        Rows of all the months, in the order of dates.
+    """
+    if _explained_plans is not None:
+        # Cached months would send no query to explain
+        return fetch_months(dates)
+    cache = get_month_cache()
+    frames = {date: cache.get((location_key, date)) for date in dates}
+    missing = [date for date, df in frames.items() if df is None]
+    if missing:
+        df = fetch_months(missing)
+        df_months = df['month'].dt.strftime('%Y-%m')
+        for date in missing:
+            frames[date] = df[df_months == date].reset_index(drop=True)
+            cache.put((location_key, date), frames[date])
+    if not frames:
+        return rows_to_df([])
+    return pd.concat([frames[date] for date in dates], ignore_index=True)
+
 def get_crime_street_level_point_dates(lat, lon, dates, radius_meters=1609.34):
     query = """
     SELECT crime_type, crime_id, month, latitude, longitude
@@ -48,40 +256,359 @@ def get_crime_street_level_point_dates(lat, lon, dates, radius_meters=1609.34):
         ST_SetSRID(ST_MakePoint(%s, %s), 4326)::geography,
         %s
     )
-    AND month BETWEEN %s AND %s;
-    """
-    
-    with st.session_state["db_connection"].cursor() as cur:
-        date_start_fmt = f"{dates[0]}-01"
-        date_end_fmt = f"{dates[-1]}-01"
-        cur.execute(query, (lon, lat, radius_meters, date_start_fmt, date_end_fmt))
-        data = cur.fetchall()
-    df = pd.DataFrame(data, columns=api.DF_COLUMNS)
-    df['month'] = pd.to_datetime(df['month'])
-    return df
+    AND month = ANY(%s::date[]);
+    """
+
+    def fetch_months(months):
+        month_starts = [f"{month}-01" for month in months]
+        return _rows_to_df(fetch_all(query, (lon, lat, radius_meters, month_starts)))
+
+    return _get_dates_cached(("point", lat, lon, radius_meters), dates, fetch_months)
+
+def _polygon_wkt(polygon_points):
+    polygon_str = ",".join(f"{lon} {lat}" for lon, lat in polygon_points)
+    return f"POLYGON(({polygon_str}, {polygon_points[0][0]} {polygon_points[0][1]}))"
+
+# Filter of the area queries on a polygon WKT parameter. geom is a geography,
+# which has no ST_Within, so the polygon is read as a geography too and
+# ST_Intersects uses the GiST index on geom
+AREA_FILTER = "ST_Intersects(geom, ST_GeogFromText(%s))"
 
 # TODO: Test this function!
-@st.cache_data(ttl='30d',max_entries=10000,show_spinner=False)
 def get_crime_street_level_area_dates(polygon_points, dates):
-    polygon_str = ",".join(f"{lon} {lat}" for lon, lat in polygon_points)
-    polygon_wkt = f"POLYGON(({polygon_str}, {polygon_points[0][0]} {polygon_points[0][1]}))"
+    polygon_wkt = _polygon_wkt(polygon_points)
 
     query = """
     SELECT crime_type, crime_id, month, latitude, longitude
     FROM crimes
-    WHERE ST_Within(
-        geom, 
-        ST_GeomFromText(%s, 4326)
+    WHERE {area_filter}
+    AND month = ANY(%s::date[]);
+    """.format(area_filter=AREA_FILTER)
+
+    def fetch_months(months):
+        month_starts = [f"{month}-01" for month in months]
+        return _rows_to_df(fetch_all(query, (polygon_wkt, month_starts)))
+
+    return _get_dates_cached(("area", polygon_wkt), dates, fetch_months)
+
+
+def _counts_rows_to_df(data):
+    df = pd.DataFrame(data, columns=api.COUNT_COLUMNS)
+    df['month'] = pd.to_datetime(df['month'])
+    df['crime_type'] = api.pretty_crime_types(df['crime_type'])
+    df['count'] = df['count'].astype(int)
+    return df
+
+def _batch_counts_rows_to_df(data):
+    df = pd.DataFrame(data, columns=api.BATCH_COUNT_COLUMNS)
+    df['month'] = pd.to_datetime(df['month'])
+    df['crime_type'] = api.pretty_crime_types(df['crime_type'])
+    df['count'] = df['count'].astype(int)
+    return df
+
+# Columns of the crime counts per location and crime type over a date range
+LOCATION_COUNT_COLUMNS = ['latitude', 'longitude', 'crime_type', 'count']
+
+def _location_counts_rows_to_df(data):
+    """
+    Pivots the counts per location and crime type into one row per location
+    with one column per crime type.
+    """
+    if not data:
+        return pd.DataFrame(columns=['latitude', 'longitude'])
+    df = pd.DataFrame(data, columns=LOCATION_COUNT_COLUMNS)
+    df['crime_type'] = api.pretty_crime_types(df['crime_type'])
+    counts = (
+        df.groupby(['latitude', 'longitude', 'crime_type'])['count'].sum()
+        .unstack(fill_value=0)
+        .astype(int)
     )
-    AND month BETWEEN %s AND %s;
+    counts.columns.name = None
+    return counts[sorted(counts.columns)].reset_index()
+
+def get_crime_counts_point_dates(lat, lon, dates, radius_meters=1609.34):
     """
-    
-    with st.session_state["db_connection"].cursor() as cur:
-        date_start_fmt = f"{dates[0]}-01"
-        date_end_fmt = f"{dates[-1]}-01"
-        cur.execute(query, (polygon_wkt, date_start_fmt, date_end_fmt))
-        data = cur.fetchall()
+    Counts the crimes per month and crime type around a point using the
+    pre-aggregated crime_location_counts table. Only the months missing from
+    the month cache are queried.
 
-    df = pd.DataFrame(data, columns=api.DF_COLUMNS)
-    df['month'] = pd.to_datetime(df['month'])
-    return df
\ No newline at end of file
+    Parameters:
+    -----------
+    lat : float
+        Latitude of the point.
+    lon : float
+        Longitude of the point.
+    dates : list of str
+        Months in YYYY-MM format.
+    radius_meters : float, optional
+        Search radius, one mile by default.
+
+    Returns:
+    --------
+    pandas.DataFrame
+        One row per month and crime type with columns api.COUNT_COLUMNS.
+    """
+    query = """
+    SELECT month, crime_type, SUM(crime_count)
+    FROM crime_location_counts
+    WHERE ST_DWithin(
+        geom,
+        ST_SetSRID(ST_MakePoint(%s, %s), 4326)::geography,
+        %s
+    )
+    AND month = ANY(%s::date[])
+    GROUP BY month, crime_type
+    ORDER BY month, crime_type;
+    """
+
+    def fetch_months(months):
+        month_starts = [f"{month}-01" for month in months]
+        return _counts_rows_to_df(fetch_all(query, (lon, lat, radius_meters, month_starts)))
+
+    return _get_dates_cached(("counts point", lat, lon, radius_meters), dates, fetch_months, _counts_rows_to_df)
+
+def get_crime_counts_area_dates(polygon_points, dates):
+    """
+    Counts the crimes per month and crime type inside a polygon using the
+    pre-aggregated crime_location_counts table. See get_crime_counts_point_dates().
+    """
+    query = """
+    SELECT month, crime_type, SUM(crime_count)
+    FROM crime_location_counts
+    WHERE {area_filter}
+    AND month = ANY(%s::date[])
+    GROUP BY month, crime_type
+    ORDER BY month, crime_type;
+    """.format(area_filter=AREA_FILTER)
+    polygon_wkt = _polygon_wkt(polygon_points)
+
+    def fetch_months(months):
+        month_starts = [f"{month}-01" for month in months]
+        return _counts_rows_to_df(fetch_all(query, (polygon_wkt, month_starts)))
+
+    return _get_dates_cached(("counts area", polygon_wkt), dates, fetch_months, _counts_rows_to_df)
+
+@st.cache_data(ttl='30d',max_entries=10000,show_spinner=False)
+def get_crime_counts_locations_dates(points, polygons, dates, radius_meters=1609.34):
+    """
+    Counts the crimes per month and crime type of several locations (circles
+    around points and polygons) with a single query, so the latency does not
+    grow with the number of locations.
+
+    Parameters:
+    -----------
+    points : tuple of (float, float)
+        (latitude, longitude) of every point.
+    polygons : tuple of list
+        Vertices of every polygon as [longitude, latitude] pairs, as
+        get_crime_counts_area_dates() takes them.
+    dates : list of str
+        Months in YYYY-MM format.
+    radius_meters : float, optional
+        Search radius around the points, one mile by default.
+
+    Returns:
+    --------
+    pandas.DataFrame
+        One row per location, month and crime type with columns
+        api.BATCH_COUNT_COLUMNS. 'location_id' numbers the points first and
+        then the polygons, in the order given.
+    """
+    if len(points) + len(polygons) == 0:
+        return _batch_counts_rows_to_df([])
+    # A polygon is a location with a search radius of 0
+    values = ", ".join(
+        ["(%s, ST_SetSRID(ST_MakePoint(%s, %s), 4326)::geography, %s)"] * len(points)
+        + ["(%s, ST_GeogFromText(%s), %s)"] * len(polygons)
+    )
+    query = f"""
+    WITH locations (location_id, geom, radius) AS (
+        VALUES {values}
+    )
+    SELECT l.location_id, c.month, c.crime_type, SUM(c.crime_count)
+    FROM locations AS l
+    JOIN crime_location_counts AS c
+    ON ST_DWithin(c.geom, l.geom, l.radius)
+    WHERE c.month BETWEEN %s AND %s
+    GROUP BY l.location_id, c.month, c.crime_type
+    ORDER BY l.location_id, c.month, c.crime_type;
+    """
+    params = [value for i, (lat, lon) in enumerate(points) for value in (i, lon, lat, radius_meters)]
+    params += [
+        value for i, polygon_points in enumerate(polygons, start=len(points))
+        for value in (i, f"SRID=4326;{_polygon_wkt(polygon_points)}", 0)
+    ]
+    date_start_fmt = f"{dates[0]}-01"
+    date_end_fmt = f"{dates[-1]}-01"
+    return _batch_counts_rows_to_df(fetch_all(query, (*params, date_start_fmt, date_end_fmt)))
+
+def get_crime_counts_points_dates(points, dates, radius_meters=1609.34):
+    """
+    Counts the crimes per month and crime type around several points with a
+    single query. See get_crime_counts_locations_dates().
+    """
+    return get_crime_counts_locations_dates(tuple(points), (), dates, radius_meters)
+
+def get_crime_counts_postcodes_dates(postcodes, dates, radius_meters=1609.34):
+    """
+    Counts the crimes per month and crime type around many postcodes: the
+    postcodes are resolved in bulk with api.locate_postcodes() and counted
+    with one get_crime_counts_points_dates() query.
+
+    Parameters:
+    -----------
+    postcodes : list of str
+        Postcodes, in any case and spacing.
+    dates : list of str
+        Months in YYYY-MM format.
+    radius_meters : float, optional
+        Search radius, one mile by default.
+
+    Returns:
+    --------
+    tuple
+        (counts, located, unresolved) where counts has columns 'postcode' (as
+        given) followed by api.COUNT_COLUMNS, located lists the (postcode,
+        latitude, longitude) of the resolved postcodes and unresolved lists
+        the postcodes that could not be found or have no coordinates.
+    """
+    located, unresolved = api.locate_postcodes(postcodes)
+    counts = get_crime_counts_points_dates(
+        tuple((lat, lon) for _, lat, lon in located), dates, radius_meters)
+    counts.insert(0, 'postcode', [located[i][0] for i in counts['location_id']])
+    return counts.drop(columns='location_id'), located, unresolved
+
+
+@st.cache_data(ttl='30d',max_entries=10000,show_spinner=False)
+def get_crime_location_counts_point_dates(lat, lon, dates, radius_meters=1609.34):
+    """
+    Counts the crimes per location and crime type around a point. PostGIS
+    sums the counts over the date range per location and crime type, which
+    are pivoted into columns here, so the result has one row per location
+    instead of one row per crime or month.
+
+    Parameters:
+    -----------
+    lat : float
+        Latitude of the point.
+    lon : float
+        Longitude of the point.
+    dates : list of str
+        Months in YYYY-MM format.
+    radius_meters : float, optional
+        Search radius, one mile by default.
+
+    Returns:
+    --------
+    pandas.DataFrame
+        Columns 'latitude', 'longitude' and one column per crime type with
+        the number of crimes of that type at the location.
+    """
+    query = """
+    SELECT latitude, longitude, crime_type, SUM(crime_count)
+    FROM crime_location_counts
+    WHERE ST_DWithin(
+        geom,
+        ST_SetSRID(ST_MakePoint(%s, %s), 4326)::geography,
+        %s
+    )
+    AND month BETWEEN %s AND %s
+    GROUP BY latitude, longitude, crime_type;
+    """
+    date_start_fmt = f"{dates[0]}-01"
+    date_end_fmt = f"{dates[-1]}-01"
+    return _location_counts_rows_to_df(fetch_all(query, (lon, lat, radius_meters, date_start_fmt, date_end_fmt)))
+
+@st.cache_data(ttl='30d',max_entries=10000,show_spinner=False)
+def get_crime_location_counts_area_dates(polygon_points, dates):
+    """
+    Counts the crimes per location and crime type inside a polygon. See
+    get_crime_location_counts_point_dates().
+    """
+    query = """
+    SELECT latitude, longitude, crime_type, SUM(crime_count)
+    FROM crime_location_counts
+    WHERE {area_filter}
+    AND month BETWEEN %s AND %s
+    GROUP BY latitude, longitude, crime_type;
+    """.format(area_filter=AREA_FILTER)
+    date_start_fmt = f"{dates[0]}-01"
+    date_end_fmt = f"{dates[-1]}-01"
+    return _location_counts_rows_to_df(fetch_all(query, (_polygon_wkt(polygon_points), date_start_fmt, date_end_fmt)))
+
+
+def _grid_rows_to_df(data, cell_size):
+    if not data:
+        return pd.DataFrame(columns=api.GRID_COLUMNS)
+    gx, gy, counts = zip(*data)
+    lat_min, lon_min, lat_max, lon_max = grid_cell_bounds(gx, gy, cell_size)
+    return pd.DataFrame({
+        'lat_min': lat_min, 'lon_min': lon_min,
+        'lat_max': lat_max, 'lon_max': lon_max,
+        'count': pd.Series(counts, dtype=int),
+    })[api.GRID_COLUMNS]
+
+# Bins the matching crime_location_counts rows into square Web Mercator cells
+_GRID_QUERY = """
+SELECT gx, gy, SUM(crime_count)
+FROM (
+    SELECT
+        FLOOR(ST_X(ST_Transform(geom::geometry, 3857)) / %s) AS gx,
+        FLOOR(ST_Y(ST_Transform(geom::geometry, 3857)) / %s) AS gy,
+        crime_count
+    FROM crime_location_counts
+    WHERE {location_filter}
+    AND month BETWEEN %s AND %s
+    AND crime_type = ANY(%s)
+) AS binned
+GROUP BY gx, gy;
+"""
+
+@st.cache_data(ttl='30d',max_entries=10000,show_spinner=False)
+def get_crime_grid_counts_point_dates(lat, lon, dates, cell_size, crime_types, radius_meters=1609.34):
+    """
+    Counts the crimes around a point per square grid cell. Only non-empty cells
+    are returned, so the result size depends on the cell size and not on the
+    number of crimes.
+
+    Parameters:
+    -----------
+    lat : float
+        Latitude of the point.
+    lon : float
+        Longitude of the point.
+    dates : list of str
+        Months in YYYY-MM format.
+    cell_size : float
+        Cell width in Web Mercator units, see geo_utils.grid_cell_size().
+    crime_types : list of str
+        Crime types to count.
+    radius_meters : float, optional
+        Search radius, one mile by default.
+
+    Returns:
+    --------
+    pandas.DataFrame
+        One row per cell with columns api.GRID_COLUMNS.
+    """
+    query = _GRID_QUERY.format(location_filter="""ST_DWithin(
+        geom,
+        ST_SetSRID(ST_MakePoint(%s, %s), 4326)::geography,
+        %s
+    )""")
+    date_start_fmt = f"{dates[0]}-01"
+    date_end_fmt = f"{dates[-1]}-01"
+    data = fetch_all(query, (cell_size, cell_size, lon, lat, radius_meters, date_start_fmt, date_end_fmt, api.archive_crime_types(crime_types)))
+    return _grid_rows_to_df(data, cell_size)
+
+@st.cache_data(ttl='30d',max_entries=10000,show_spinner=False)
+def get_crime_grid_counts_area_dates(polygon_points, dates, cell_size, crime_types):
+    """
+    Counts the crimes inside a polygon per square grid cell. See
+    get_crime_grid_counts_point_dates().
+    """
+    query = _GRID_QUERY.format(location_filter=AREA_FILTER)
+    date_start_fmt = f"{dates[0]}-01"
+    date_end_fmt = f"{dates[-1]}-01"
+    data = fetch_all(query, (cell_size, cell_size, _polygon_wkt(polygon_points), date_start_fmt, date_end_fmt, api.archive_crime_types(crime_types)))
+    return _grid_rows_to_df(data, cell_size)
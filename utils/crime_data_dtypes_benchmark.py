@@ -0,0 +1,57 @@
+"""
+Measures the memory and the st.cache_data (pickled) size per row of crime
+DataFrames with the compact dtypes of api.compact_crimes_df() against the
+dtypes the backends used before (object strings and float64 coordinates).
+
+The synthetic crimes mimic the police.uk archive: 64 character hex crime ids
+(empty for anti-social behaviour), the pretty crime type names and a year of
+months.
+
+Run from the repository root with:
+    python -m utils.crime_data_dtypes_benchmark [number of crimes]
+"""
+import sys
+import pickle
+import numpy as np
+import pandas as pd
+import utils.crime_data_fetch as api
+
+def legacy_crimes_df(n, rng):
+    """
+    Synthetic crimes with the dtypes the backends returned before
+    compact_crimes_df(): object crime types and ids, float64 coordinates.
+    """
+    crime_types = np.array(list(api.TO_PRETTY_CATEGORIES.values()), dtype=object)
+    crime_type = crime_types[rng.integers(0, len(crime_types), n)]
+    crime_id = np.array([rng.bytes(32).hex() for _ in range(n)], dtype=object)
+    crime_id[crime_type == 'Anti-social behaviour'] = ''
+    months = pd.date_range("2024-01-01", periods=12, freq="MS")
+    return pd.DataFrame({
+        'crime_type': crime_type,
+        'crime_id': crime_id,
+        'month': months[rng.integers(0, len(months), n)],
+        'latitude': rng.normal(51.5074, 0.05, n),
+        'longitude': rng.normal(-0.1278, 0.08, n),
+    })[api.DF_COLUMNS]
+
+def memory_per_row(df):
+    """
+    Bytes per row in memory, with the Python strings counted.
+    """
+    return df.memory_usage(deep=True, index=False).sum() / len(df)
+
+def pickled_per_row(df):
+    """
+    Bytes per row of the pickle st.cache_data stores.
+    """
+    return len(pickle.dumps(df, protocol=pickle.HIGHEST_PROTOCOL)) / len(df)
+
+if __name__ == "__main__":
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 26_000
+    legacy = legacy_crimes_df(n, np.random.default_rng(0))
+    compact = api.compact_crimes_df(legacy)
+    print(f"{n} crimes, bytes per row (legacy -> compact)")
+    print(f"in memory: {memory_per_row(legacy):.0f} -> {memory_per_row(compact):.0f}")
+    for column in api.DF_COLUMNS:
+        print(f"  {column}: {memory_per_row(legacy[[column]]):.0f} -> {memory_per_row(compact[[column]]):.0f}")
+    print(f"pickled for st.cache_data: {pickled_per_row(legacy):.0f} -> {pickled_per_row(compact):.0f}")
@@ -1,7 +1,17 @@
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 import pandas as pd
+import numpy as np
 from datetime import datetime
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
 import streamlit as st
+from streamlit.runtime.scriptrunner import add_script_run_ctx, get_script_run_ctx
+import utils.postcode_index as postcode_index
+from utils.postcode_index import POSTCODE_PATTERN, postcode_key
 
 CATEGORIES =[
     'anti-social-behaviour', 'bicycle-theft', 'burglary',
@@ -29,37 +39,314 @@ TO_PRETTY_CATEGORIES = {
 
 FROM_PRETTY_CATEGORIES = {v: k for k, v in TO_PRETTY_CATEGORIES.items()}
 
+# Crime types of the police.uk archive (so of the database and the Parquet
+# store) whose names differ from the pretty names of the API categories
+ARCHIVE_CRIME_TYPES = {'Violence and sexual offences': 'Violent crime'}
+
 DF_COLUMNS = ['crime_type', 'crime_id', 'month', 'latitude', 'longitude']
 
-@st.cache_data(ttl='30d',max_entries=10000,show_spinner=False)
+# Compact dtypes of the crime DataFrames of every backend. crime_type is a
+# one byte code over the pretty category names (unknown types become NaN),
+# crime_id strings are stored contiguously by pyarrow and the coordinates are
+# float32, precise to about half a metre. month stays datetime64, which takes
+# 8 bytes per row like a monthly Period and is what the charts expect.
+CRIME_TYPE_DTYPE = pd.CategoricalDtype(list(TO_PRETTY_CATEGORIES.values()))
+CRIME_ID_DTYPE = pd.StringDtype("pyarrow")
+COORDINATE_DTYPE = np.float32
+
+# Columns of the aggregated crime counts per month and crime type
+COUNT_COLUMNS = ['month', 'crime_type', 'count']
+
+# Columns of the crime counts per month and crime type of several locations
+BATCH_COUNT_COLUMNS = ['location_id'] + COUNT_COLUMNS
+
+# Columns of the crime counts per heatmap grid cell
+GRID_COLUMNS = ['lat_min', 'lon_min', 'lat_max', 'lon_max', 'count']
+
+# Connections kept alive per host by the shared session
+HTTP_POOL_SIZE = 16
+# Connect and read timeouts in seconds
+HTTP_TIMEOUT = (5, 30)
+# Retries on connection errors and 500/502/504 responses. 429 is handled by
+# _police_api_get() and 503 is how the police API reports too many crimes, so
+# neither is retried here.
+HTTP_RETRIES = 3
+HTTP_BACKOFF_FACTOR = 0.5
+
+@st.cache_resource
+def get_http_session():
+    """
+    Creates the requests.Session shared by every HTTP helper of this module,
+    so that repeated calls reuse keep-alive connections.
+    """
+    retry = Retry(
+        total=HTTP_RETRIES,
+        backoff_factor=HTTP_BACKOFF_FACTOR,
+        status_forcelist=[500, 502, 504],
+        allowed_methods=["GET", "POST"],
+        raise_on_status=False,
+    )
+    adapter = HTTPAdapter(pool_connections=HTTP_POOL_SIZE, pool_maxsize=HTTP_POOL_SIZE, max_retries=retry)
+    session = requests.Session()
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    return session
+
+def http_get(url, params=None):
+    """
+    GET request through the shared session with the default timeouts.
+    """
+    return get_http_session().get(url, params=params, timeout=HTTP_TIMEOUT)
+
+def http_post(url, json=None):
+    """
+    POST request with a JSON body through the shared session with the default timeouts.
+    """
+    return get_http_session().post(url, json=json, timeout=HTTP_TIMEOUT)
+
+# data.police.uk allows 15 requests per second with bursts of up to 30. The
+# bucket is per process, so its bursts stay at 15 to leave room for other
+# processes calling the API from the same address
+POLICE_API_RATE = 15
+POLICE_API_BURST = 15
+# Maximum number of months requested at the same time
+POLICE_API_MAX_WORKERS = 8
+# Retries after a 429 (Too Many Requests) response
+POLICE_API_MAX_RETRIES = 4
+
+class TokenBucket:
+    """
+    Thread-safe token bucket rate limiter. Tokens are added at `rate` per
+    second up to `capacity`; acquire() blocks until a token is available.
+    """
+    def __init__(self, rate, capacity):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.last = time.monotonic()
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.last) * self.rate)
+                self.last = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait = (1 - self.tokens) / self.rate
+            time.sleep(wait)
+
+# Shared by every session of the app, as the limit is per client IP
+_police_api_bucket = TokenBucket(POLICE_API_RATE, POLICE_API_BURST)
+
+def _police_api_get(url, params=None):
+    """
+    GET request to data.police.uk that respects the API rate limit. On a 429
+    response it waits (Retry-After if given, exponential backoff otherwise)
+    and retries up to POLICE_API_MAX_RETRIES times.
+    """
+    for attempt in range(POLICE_API_MAX_RETRIES + 1):
+        _police_api_bucket.acquire()
+        response = http_get(url, params)
+        if response.status_code != 429 or attempt == POLICE_API_MAX_RETRIES:
+            return response
+        retry_after = response.headers.get("Retry-After")
+        try:
+            wait = float(retry_after)
+        except (TypeError, ValueError):
+            wait = 0.5 * 2 ** attempt
+        time.sleep(wait)
+
+# Shown when a postcode is not found
+DEFAULT_POSTCODE = "SL41PE"
+
 def get_postcode_info_from_postcode(postcode):
+    """
+    Looks up a postcode in the offline postcode index (utils/postcode_index.py)
+    if it has been built, otherwise with api.postcodes.io.
+
+    Returns:
+    --------
+    tuple
+        (f_error, error, postcode_info). On error postcode_info is the info of
+        DEFAULT_POSTCODE.
+    """
+    index = postcode_index.get_postcode_index()
+    if index is None:
+        return _get_postcode_info_from_postcode_api(postcode)
+    postcode_info = index.lookup(postcode)
+    if postcode_info is not None:
+        return False, "", postcode_info
+    if POSTCODE_PATTERN.match(postcode_key(postcode)):
+        error = "Postcode not found"
+    else:
+        error = "Invalid postcode"
+    default_info = index.lookup(DEFAULT_POSTCODE)
+    if default_info is None:
+        default_info = _get_postcode_info_from_postcode_api(DEFAULT_POSTCODE)[2]
+    return True, error, default_info
+
+def get_postcode_info_from_lat_long(lat, long):
+    """
+    Finds the postcodes nearest to a point in the offline postcode index if it
+    has been built, otherwise with api.postcodes.io.
+
+    Returns:
+    --------
+    tuple
+        (f_error, error, postcode_info) where postcode_info is a list of
+        postcodes sorted by distance, or None if there is none nearby.
+    """
+    index = postcode_index.get_postcode_index()
+    if index is None:
+        return _get_postcode_info_from_lat_long_api(lat, long)
+    return False, "", index.nearest(lat, long) or None
+
+# postcodes.io bulk lookups take up to 100 postcodes per request
+POSTCODES_BULK_URL = "https://api.postcodes.io/postcodes"
+POSTCODES_BULK_SIZE = 100
+POSTCODES_BULK_MAX_WORKERS = 4
+POSTCODE_CACHE_MAX_ENTRIES = 100_000
+
+class PostcodeCache:
+    """
+    Thread-safe LRU cache of postcode info keyed by postcode_key(). Postcodes
+    that do not exist are cached as None.
+    """
+    def __init__(self, max_entries=POSTCODE_CACHE_MAX_ENTRIES):
+        self.max_entries = max_entries
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+
+    def get_many(self, keys):
+        with self.lock:
+            found = {}
+            for key in keys:
+                if key in self.entries:
+                    self.entries.move_to_end(key)
+                    found[key] = self.entries[key]
+            return found
+
+    def put_many(self, infos):
+        with self.lock:
+            self.entries.update(infos)
+            for key in infos:
+                self.entries.move_to_end(key)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+
+@st.cache_resource
+def get_postcode_cache():
+    return PostcodeCache()
+
+def _bulk_lookup_postcodes(keys):
+    """
+    Looks up at most POSTCODES_BULK_SIZE postcodes with one postcodes.io bulk
+    request. Returns {key: postcode_info or None}, or an empty dict if the
+    request failed.
+    """
+    try:
+        response = http_post(POSTCODES_BULK_URL, json={"postcodes": keys})
+    except requests.RequestException:
+        return {}
+    if response.status_code != 200:
+        return {}
+    infos = {key: None for key in keys}
+    for item in response.json()["result"]:
+        infos[postcode_key(item["query"])] = item["result"]
+    return infos
+
+def get_postcode_info_from_postcodes(postcodes):
+    """
+    Looks up many postcodes at once: in the offline postcode index if it has
+    been built, otherwise with concurrent postcodes.io bulk requests for the
+    postcodes that are not already cached.
+
+    Parameters:
+    -----------
+    postcodes : list of str
+        Postcodes, in any case and spacing.
+
+    Returns:
+    --------
+    list
+        The postcode info of every postcode, in the order of postcodes, with
+        None for postcodes that do not exist or could not be looked up.
+    """
+    keys = [postcode_key(postcode) for postcode in postcodes]
+    index = postcode_index.get_postcode_index()
+    if index is not None:
+        return [index.lookup(key) for key in keys]
+
+    cache = get_postcode_cache()
+    found = cache.get_many(set(keys))
+    missing = sorted(set(keys) - found.keys())
+    batches = [missing[i:i + POSTCODES_BULK_SIZE] for i in range(0, len(missing), POSTCODES_BULK_SIZE)]
+    if batches:
+        # Worker threads need the script context to use st.cache_data
+        ctx = get_script_run_ctx()
+        def lookup_batch(batch):
+            add_script_run_ctx(threading.current_thread(), ctx)
+            return _bulk_lookup_postcodes(batch)
+
+        with ThreadPoolExecutor(max_workers=min(len(batches), POSTCODES_BULK_MAX_WORKERS)) as executor:
+            for infos in executor.map(lookup_batch, batches):
+                # Failed batches are not cached and retried on the next call
+                cache.put_many(infos)
+                found.update(infos)
+    return [found.get(key) for key in keys]
+
+def locate_postcodes(postcodes):
+    """
+    Resolves many postcodes at once with get_postcode_info_from_postcodes().
+
+    Returns:
+    --------
+    tuple
+        (located, unresolved) where located lists (postcode, latitude,
+        longitude) in the order of postcodes, and unresolved lists the
+        postcodes that could not be found or have no coordinates.
+    """
+    located = []
+    unresolved = []
+    for postcode, postcode_info in zip(postcodes, get_postcode_info_from_postcodes(postcodes)):
+        if postcode_info is None or postcode_info["latitude"] is None:
+            unresolved.append(postcode)
+        else:
+            located.append((postcode, postcode_info["latitude"], postcode_info["longitude"]))
+    return located, unresolved
+
+@st.cache_data(ttl='30d',max_entries=10000,show_spinner=False)
+def _get_postcode_info_from_postcode_api(postcode):
     postcode = postcode.replace(" ", "").upper()
     url = f"https://api.postcodes.io/postcodes/{postcode}"
-    response = requests.get(url)
+    response = http_get(url)
     response_json = response.json()
     if "error" in response_json:
         error = response_json["error"]
-        postcode = "SL41PE"
+        postcode = DEFAULT_POSTCODE
         url = f"https://api.postcodes.io/postcodes/{postcode}"
-        response = requests.get(url)
+        response = http_get(url)
         response_json = response.json()
         return True, error, response_json["result"]
     else:
         return False, "", response_json["result"]
 
 @st.cache_data(ttl='30d',max_entries=10000,show_spinner=False)
-def get_postcode_info_from_lat_long(lat, long):
+def _get_postcode_info_from_lat_long_api(lat, long):
     lat, long = str(lat), str(long)
     url = f"https://api.postcodes.io/postcodes/"
     params = {
         "lon": long,
         "lat": lat
     }
-    response = requests.get(url, params)
+    response = http_get(url, params)
     response_json = response.json()
     if "error" in response_json:
         error = response_json["error"]
-        postcode = "SL41PE"
+        postcode = DEFAULT_POSTCODE
         url = f"https://api.postcodes.io/postcodes/{postcode}"
         response_json = response.json()
         return True, error, response_json["result"]
@@ -77,7 +364,7 @@ def get_crime_categories(date):
     if is_valid_date_format(date):
         url = "https://data.police.uk/api/crime-categories"
         params = {"date": date}
-        response = requests.get(url, params)
+        response = _police_api_get(url, params)
         return response.json()
     else:
         return []
@@ -87,21 +374,21 @@ def get_crime_categories(date):
 def locate_neighbourhood(lat, long):
     base_url = "https://data.police.uk/api/locate-neighbourhood"
     params = {'q': f"{lat},{long}"}
-    response = requests.get(base_url, params)
+    response = _police_api_get(base_url, params)
     return response.json()
 
 # Get neighbourhood boundary as a list of latitude/longitude pairs.
 def get_boundary_neighbourhood(lat, long):
     neigh = locate_neighbourhood(lat, long)
     url = f"https://data.police.uk/api/{neigh['force']}/{neigh['neighbourhood']}/boundary"
-    response = requests.get(url)
+    response = _police_api_get(url)
     return response.json()
 
 # Return a list of available data sets. 
 def get_availability():
     try:
         base_url = "https://data.police.uk/api/crimes-street-dates"
-        response = requests.get(base_url)
+        response = _police_api_get(base_url)
         return response.json()
     except requests.ConnectionError:
         print("Connection error! The server may be too slow or down. Reload current page.")
@@ -155,7 +442,7 @@ def get_crime_street_level_point(lat, long, date=None):
         params['date'] = date
 
     # Make the API request
-    response = requests.get(base_url, params)
+    response = _police_api_get(base_url, params)
 
     # Check if the request was successful
     if response.status_code == 200:
@@ -163,17 +450,52 @@ def get_crime_street_level_point(lat, long, date=None):
     else:
         return [], response.status_code # Return empty list and error code
 
-def get_crime_street_level_point_dates(lat, long, dates):
+def _fetch_dates_concurrently(fetch, args, dates, max_workers=POLICE_API_MAX_WORKERS):
+    """
+    Calls fetch(*args, date) for every date on a thread pool and joins the
+    results in the order of dates.
+
+    Parameters:
+    -----------
+    fetch : callable
+        Function returning (list of crimes, status code) for one month.
+    args : tuple
+        Arguments passed to fetch before the date.
+    dates : list of str
+        Months in YYYY-MM format.
+    max_workers : int, optional
+        Maximum number of concurrent requests. The rate limit of the API is
+        enforced separately by _police_api_get().
+
+    Returns:
+    --------
+    tuple
+        (list of crimes, status code). As with a sequential loop, the crimes
+        stop at the first month that failed and its status code is returned.
+    """
     list_crimes = []
     status_code = 200
-    for date in dates:
-        crimes, code = get_crime_street_level_point(lat, long, date)
+    if not dates:
+        return list_crimes, status_code
+
+    # Worker threads need the script context to use st.cache_data
+    ctx = get_script_run_ctx()
+    def fetch_date(date):
+        add_script_run_ctx(threading.current_thread(), ctx)
+        return fetch(*args, date)
+
+    with ThreadPoolExecutor(max_workers=min(max_workers, len(dates))) as executor:
+        results = list(executor.map(fetch_date, dates))
+    for crimes, code in results:
         list_crimes.extend(crimes)
         if code!=200:
             status_code=code
             break
     return list_crimes, status_code
 
+def get_crime_street_level_point_dates(lat, long, dates):
+    return _fetch_dates_concurrently(get_crime_street_level_point, (lat, long), dates)
+
 # Returns just the crimes which occurred at the nearest location from a given
 # latitude and longitude in the form of a list of dict.
 @st.cache_data(ttl='30d',max_entries=1000,show_spinner=False)
@@ -216,7 +538,7 @@ def get_crime_street_level_location(lat, long, date=None):
         params['date'] = date
 
     # Make the API request
-    response = requests.get(base_url, params)
+    response = _police_api_get(base_url, params)
 
     # Check if the request was successful
     if response.status_code == 200:
@@ -236,37 +558,69 @@ def get_crime_street_level_area(list_lat_long, date=None):
     }
     if date != None and is_valid_date_format(date):
         params['date'] = date
-    response = requests.get(base_url, params)
+    response = _police_api_get(base_url, params)
     if response.status_code == 200:
         return response.json(), 200
     else:
         return [], response.status_code
 
 def get_crime_street_level_area_dates(list_lat_long, dates=[]):
-    list_crimes = []
-    status_code = 200
-    for date in dates:
-        crimes, code = get_crime_street_level_area(list_lat_long, date)
-        list_crimes.extend(crimes)
-        if code!=200:
-            status_code=code
-            break
-    return list_crimes, status_code
+    return _fetch_dates_concurrently(get_crime_street_level_area, (list_lat_long,), dates)
+
+def pretty_crime_types(crime_types):
+    """
+    Renames the archive crime types of a Series to the pretty category names.
+    """
+    return crime_types.replace(ARCHIVE_CRIME_TYPES)
+
+def archive_crime_types(crime_types):
+    """
+    Pretty category names with the archive names of the same crime types, to
+    filter the crime_type column of the database.
+    """
+    aliases = {pretty: archive for archive, pretty in ARCHIVE_CRIME_TYPES.items()}
+    return list(crime_types) + [aliases[c] for c in crime_types if c in aliases]
+
+def compact_crimes_df(df):
+    """
+    Converts a crime DataFrame to the columns DF_COLUMNS with the compact
+    dtypes CRIME_TYPE_DTYPE, CRIME_ID_DTYPE and COORDINATE_DTYPE, renaming the
+    archive crime types.
+
+    Parameters:
+    -----------
+    df : pandas.DataFrame
+        Crimes with at least the columns DF_COLUMNS and pretty or archive
+        crime type names.
+
+    Returns:
+    --------
+    pandas.DataFrame
+        A new DataFrame.
+    """
+    crime_type = df['crime_type']
+    if crime_type.dtype != CRIME_TYPE_DTYPE:
+        crime_type = pretty_crime_types(crime_type.astype(object)).astype(CRIME_TYPE_DTYPE)
+    return pd.DataFrame({
+        'crime_type': crime_type,
+        'crime_id': df['crime_id'].astype(CRIME_ID_DTYPE),
+        'month': pd.to_datetime(df['month']),
+        'latitude': df['latitude'].astype(COORDINATE_DTYPE),
+        'longitude': df['longitude'].astype(COORDINATE_DTYPE),
+    })[DF_COLUMNS]
 
 def list_crimes_to_df(list_crimes):
     if list_crimes == []:
-        df = pd.DataFrame(columns=DF_COLUMNS)
-        df['month'] = pd.to_datetime(df['month'])
-        return df
+        return compact_crimes_df(pd.DataFrame(columns=DF_COLUMNS))
     df = pd.json_normalize(list_crimes, sep='_')
     df.rename(
         columns={
             'category': 'crime_type', 'persistent_id': 'crime_id', 
             'location_latitude': 'latitude', 'location_longitude': 'longitude'}, 
         inplace=True)
-    df['crime_type'] = df['crime_type'].replace(TO_PRETTY_CATEGORIES)
-    df['month'] = pd.to_datetime(df['month'])
-    return df[DF_COLUMNS]
+    # Category slugs straight to the pretty categorical
+    df['crime_type'] = pd.Categorical(df['crime_type'].map(TO_PRETTY_CATEGORIES), dtype=CRIME_TYPE_DTYPE)
+    return compact_crimes_df(df)
 
 def list_crimes_to_list_coordinates(list_crimes):
     list_coordinates = [
@@ -0,0 +1,313 @@
+"""
+In-process crime query engine for deployments without PostGIS.
+
+All the crimes of the Parquet store (utils/crime_data_parquet.py) are loaded
+once into compact NumPy arrays (float32 coordinates, int16 month, uint8 crime
+type code) sorted by the cell of a fixed latitude/longitude grid. A radius or
+polygon query only reads the contiguous runs of rows of the cells overlapping
+its bounding box, then applies the exact distance or point-in-polygon test.
+
+The arrays can also be written to a snapshot file, which every app process
+on the host maps read-only instead of loading its own copy, so that the
+replicas share the page cache:
+    python -m utils.crime_data_parquet path/to/latest.zip --snapshot
+
+Enabled by setting CRIME_MEMORY_INDEX=1; the snapshot is used if it exists,
+the Parquet store otherwise. The query functions return the same DataFrames as
+their crime_data_db counterparts.
+"""
+import os
+import json
+import time
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import streamlit as st
+import utils.crime_data_fetch as api
+import utils.crime_data_parquet as store
+from utils.geo_utils import haversine_meters_array, points_in_polygon
+
+MEMORY_INDEX_ENABLED = os.environ.get("CRIME_MEMORY_INDEX", "0") == "1"
+CRIME_SNAPSHOT_PATH = os.environ.get("CRIME_SNAPSHOT_PATH", "crime_snapshot.bin")
+
+# Snapshot layout: SNAPSHOT_MAGIC, the length of the JSON header as a
+# little-endian uint64, the JSON header, then the columns, each one starting
+# at an offset aligned to SNAPSHOT_ALIGNMENT bytes
+SNAPSHOT_MAGIC = b"CRIMESNAP1"
+SNAPSHOT_ALIGNMENT = 64
+
+# Grid cells of about 500 m: a one mile radius query reads 8 slices of 8 cells,
+# with few rows outside the circle
+INDEX_CELL_LAT = 0.0045
+INDEX_CELL_LON = 0.0075
+_INDEX_COLUMNS = int(np.ceil(360 / INDEX_CELL_LON))
+
+def _month_number(dates):
+    """
+    Months (YYYY-MM) as year * 12 + month - 1, which fits in an int16.
+    """
+    return np.array([int(d[:4]) * 12 + int(d[5:7]) - 1 for d in dates], dtype=np.int16)
+
+def _aligned(offset):
+    return -(-offset // SNAPSHOT_ALIGNMENT) * SNAPSHOT_ALIGNMENT
+
+def _cell_rows_cols(lats, lons):
+    rows = np.floor((np.asarray(lats, dtype=np.float64) + 90) / INDEX_CELL_LAT).astype(np.int64)
+    cols = np.floor((np.asarray(lons, dtype=np.float64) + 180) / INDEX_CELL_LON).astype(np.int64)
+    return rows, cols
+
+class CrimeIndex:
+    """
+    Crimes held in NumPy arrays sorted by grid cell, with the sorted cell id
+    of every row for binary search. The arrays are either in memory or
+    memory-mapped from a snapshot; queries only copy the selected rows.
+    """
+    def __init__(self, cells, latitude, longitude, month, crime_type_code, crime_types, months, crime_id=None):
+        self.cells = cells
+        self.latitude = latitude
+        self.longitude = longitude
+        self.month = month
+        self.crime_type_code = crime_type_code
+        self.crime_types = np.asarray(crime_types, dtype=object)
+        # Code of each crime type in api.CRIME_TYPE_DTYPE, -1 if unknown
+        self._category_codes = api.CRIME_TYPE_DTYPE.categories.get_indexer(
+            api.pretty_crime_types(pd.Series(self.crime_types)))
+        # Months (YYYY-MM) present, sorted
+        self.months = list(months)
+        # Arrow string array, which stores the strings contiguously
+        self.crime_id = crime_id
+
+    @classmethod
+    def from_arrays(cls, latitude, longitude, month, crime_type_code, crime_types, crime_id=None):
+        """
+        Sorts unsorted columns by grid cell. month holds month numbers (see
+        _month_number()) and crime_id is an Arrow string array or None.
+        """
+        rows, cols = _cell_rows_cols(latitude, longitude)
+        cells = rows * _INDEX_COLUMNS + cols
+        order = np.argsort(cells, kind="stable")
+        return cls(
+            cells=cells[order],
+            latitude=np.asarray(latitude, dtype=np.float32)[order],
+            longitude=np.asarray(longitude, dtype=np.float32)[order],
+            month=np.asarray(month, dtype=np.int16)[order],
+            crime_type_code=np.asarray(crime_type_code, dtype=np.uint8)[order],
+            crime_types=crime_types,
+            months=[f"{m // 12:04d}-{m % 12 + 1:02d}" for m in np.unique(month)],
+            crime_id=None if crime_id is None else crime_id.take(pa.array(order)),
+        )
+
+    @classmethod
+    def from_store(cls, store_path=store.CRIME_STORE_PATH, load_crime_ids=True):
+        """
+        Loads every month of the Parquet store.
+        """
+        columns = ["crime_type", "latitude", "longitude", "month"] + (["crime_id"] if load_crime_ids else [])
+        table = store.get_crime_store(store_path).to_table(columns=columns)
+        crime_type = table.column("crime_type").combine_chunks().dictionary_encode()
+        if len(crime_type.dictionary) > 255:
+            raise ValueError("More than 255 crime types, they do not fit in a uint8 code")
+        month = table.column("month").to_numpy(zero_copy_only=False)
+        unique_months, month_inverse = np.unique(month, return_inverse=True)
+        return cls.from_arrays(
+            latitude=table.column("latitude").to_numpy(),
+            longitude=table.column("longitude").to_numpy(),
+            month=_month_number(unique_months)[month_inverse],
+            crime_type_code=crime_type.indices.to_numpy(zero_copy_only=False),
+            crime_types=crime_type.dictionary.to_pylist(),
+            # large_string: 32-bit string offsets overflow past 2 GiB of ids
+            crime_id=table.column("crime_id").cast(pa.large_string()).combine_chunks() if load_crime_ids else None,
+        )
+
+    @classmethod
+    def from_snapshot(cls, snapshot_path=CRIME_SNAPSHOT_PATH):
+        """
+        Maps a snapshot written by write_snapshot() read-only. Nothing is read
+        until queried, and the pages are shared with the other processes
+        mapping the same file.
+        """
+        with open(snapshot_path, "rb") as f:
+            if f.read(len(SNAPSHOT_MAGIC)) != SNAPSHOT_MAGIC:
+                raise ValueError(f"{snapshot_path} is not a crime snapshot")
+            header_size = int.from_bytes(f.read(8), "little")
+            header = json.loads(f.read(header_size))
+        data = np.memmap(snapshot_path, dtype=np.uint8, mode="r", offset=_aligned(len(SNAPSHOT_MAGIC) + 8 + header_size))
+        columns = {
+            name: data[c["offset"]:c["offset"] + c["nbytes"]].view(np.dtype(c["dtype"]))
+            for name, c in header["columns"].items()
+        }
+        crime_id = None
+        if "crime_id_offsets" in columns:
+            crime_id = pa.Array.from_buffers(pa.large_string(), header["rows"], [
+                None, pa.py_buffer(columns["crime_id_offsets"]), pa.py_buffer(columns["crime_id_data"]),
+            ])
+        return cls(
+            cells=columns["cells"],
+            latitude=columns["latitude"],
+            longitude=columns["longitude"],
+            month=columns["month"],
+            crime_type_code=columns["crime_type_code"],
+            crime_types=header["crime_types"],
+            months=header["months"],
+            crime_id=crime_id,
+        )
+
+    def write_snapshot(self, snapshot_path=CRIME_SNAPSHOT_PATH):
+        """
+        Writes the arrays to a snapshot file, replacing the previous one
+        atomically: processes that mapped it keep reading the old file until
+        they reload.
+        """
+        columns = {
+            "cells": self.cells,
+            "latitude": self.latitude,
+            "longitude": self.longitude,
+            "month": self.month,
+            "crime_type_code": self.crime_type_code,
+        }
+        if self.crime_id is not None:
+            crime_id = self.crime_id.cast(pa.large_string()).fill_null("")
+            offsets = np.frombuffer(crime_id.buffers()[1], dtype=np.int64)[crime_id.offset:crime_id.offset + len(crime_id) + 1]
+            columns["crime_id_data"] = np.frombuffer(crime_id.buffers()[2], dtype=np.uint8)[offsets[0]:offsets[-1]]
+            columns["crime_id_offsets"] = offsets - offsets[0]
+
+        # Column offsets are relative to the first aligned byte after the header
+        header = {"rows": len(self), "crime_types": self.crime_types.tolist(), "months": self.months, "columns": {}}
+        offset = 0
+        for name, array in columns.items():
+            header["columns"][name] = {"dtype": array.dtype.str, "offset": offset, "nbytes": array.nbytes}
+            offset = _aligned(offset + array.nbytes)
+        header_bytes = json.dumps(header).encode()
+        data_start = _aligned(len(SNAPSHOT_MAGIC) + 8 + len(header_bytes))
+
+        tmp_path = snapshot_path + ".tmp"
+        with open(tmp_path, "wb") as f:
+            f.write(SNAPSHOT_MAGIC)
+            f.write(len(header_bytes).to_bytes(8, "little"))
+            f.write(header_bytes)
+            for name, array in columns.items():
+                f.seek(data_start + header["columns"][name]["offset"])
+                f.write(memoryview(np.ascontiguousarray(array)))
+        os.replace(tmp_path, snapshot_path)
+        print(f"Wrote {len(self)} crimes to {snapshot_path} ({os.path.getsize(snapshot_path) / 2**20:.0f} MB)")
+
+    def __len__(self):
+        return len(self.cells)
+
+    def nbytes(self):
+        """
+        Memory used by the arrays, in bytes.
+        """
+        arrays = [self.cells, self.latitude, self.longitude, self.month, self.crime_type_code]
+        return sum(a.nbytes for a in arrays) + (self.crime_id.nbytes if self.crime_id is not None else 0)
+
+    def _candidates(self, lat_min, lat_max, lon_min, lon_max):
+        """
+        Positions of the rows in the grid cells overlapping a bounding box.
+        The cells of a grid row are contiguous in the sorted cell ids, so each
+        grid row is one slice.
+        """
+        row_min, col_min = _cell_rows_cols(lat_min, lon_min)
+        row_max, col_max = _cell_rows_cols(lat_max, lon_max)
+        ranges = []
+        for row in range(int(row_min), int(row_max) + 1):
+            start = np.searchsorted(self.cells, row * _INDEX_COLUMNS + col_min, side="left")
+            end = np.searchsorted(self.cells, row * _INDEX_COLUMNS + col_max, side="right")
+            if end > start:
+                ranges.append(np.arange(start, end))
+        return np.concatenate(ranges) if ranges else np.empty(0, dtype=np.int64)
+
+    def _filter_months(self, positions, dates):
+        # Lookup table indexed by month number, much faster than np.isin
+        wanted = np.zeros(np.iinfo(np.int16).max + 1, dtype=bool)
+        wanted[_month_number(dates)] = True
+        return positions[wanted[self.month[positions]]]
+
+    def point_positions(self, lat, lon, dates, radius_meters):
+        d_lat = radius_meters / 111320
+        d_lon = radius_meters / (111320 * max(np.cos(np.radians(lat)), 1e-6))
+        positions = self._filter_months(self._candidates(lat - d_lat, lat + d_lat, lon - d_lon, lon + d_lon), dates)
+        distances = haversine_meters_array(lat, lon, self.latitude[positions], self.longitude[positions])
+        return positions[distances <= radius_meters]
+
+    def polygon_positions(self, polygon_points, dates):
+        lons, lats = zip(*polygon_points)
+        positions = self._filter_months(self._candidates(min(lats), max(lats), min(lons), max(lons)), dates)
+        inside = points_in_polygon(self.longitude[positions], self.latitude[positions], polygon_points)
+        return positions[inside]
+
+    def to_df(self, positions):
+        """
+        DataFrame with columns api.DF_COLUMNS of the rows at positions, in the
+        compact dtypes of api.compact_crimes_df().
+        """
+        # Months since 1970-01 as datetime64[M]
+        months = (self.month[positions].astype(np.int64) - 1970 * 12).astype("datetime64[M]")
+        if self.crime_id is not None:
+            crime_id = pd.arrays.ArrowStringArray(self.crime_id.take(pa.array(positions)))
+        else:
+            crime_id = pd.arrays.ArrowStringArray(pa.nulls(len(positions), pa.string()))
+        df = pd.DataFrame({
+            'crime_type': pd.Categorical.from_codes(
+                self._category_codes[self.crime_type_code[positions]], dtype=api.CRIME_TYPE_DTYPE),
+            'crime_id': crime_id,
+            'month': months.astype("datetime64[ns]"),
+            'latitude': self.latitude[positions],
+            'longitude': self.longitude[positions],
+        })
+        return df[api.DF_COLUMNS]
+
+@st.cache_resource(show_spinner="Loading crimes into memory...")
+def _load_crime_index():
+    start = time.perf_counter()
+    index = CrimeIndex.from_store()
+    print(f"Loaded {len(index)} crimes into memory ({index.nbytes() / 2**20:.0f} MB) in {time.perf_counter() - start:.1f}s")
+    return index
+
+@st.cache_resource(max_entries=1, show_spinner=False)
+def _map_crime_snapshot(snapshot_mtime):
+    # Keyed on the modification time so that a rewritten snapshot is mapped
+    # again, and the mapping of the previous one released
+    return CrimeIndex.from_snapshot(CRIME_SNAPSHOT_PATH)
+
+def get_crime_index():
+    """
+    Returns the index of the app process: the snapshot mapped read-only if it
+    exists, otherwise the Parquet store loaded into memory once.
+
+    Returns:
+    --------
+    CrimeIndex or None
+        None if CRIME_MEMORY_INDEX is not enabled or neither the snapshot nor
+        the Parquet store have been built.
+    """
+    if not MEMORY_INDEX_ENABLED:
+        return None
+    if os.path.exists(CRIME_SNAPSHOT_PATH):
+        return _map_crime_snapshot(os.path.getmtime(CRIME_SNAPSHOT_PATH))
+    if store.get_crime_store() is None:
+        return None
+    return _load_crime_index()
+
+def get_availability():
+    """
+    Months (YYYY-MM) in the index.
+    """
+    index = get_crime_index()
+    return [] if index is None else index.months
+
+def get_crime_street_level_point_dates(lat, lon, dates, radius_meters=1609.34):
+    """
+    Crimes within radius_meters of a point in the given months, as
+    db.get_crime_street_level_point_dates().
+    """
+    index = get_crime_index()
+    return index.to_df(index.point_positions(lat, lon, dates, radius_meters))
+
+def get_crime_street_level_area_dates(polygon_points, dates):
+    """
+    Crimes inside a polygon ([longitude, latitude] vertices) in the given
+    months, as db.get_crime_street_level_area_dates().
+    """
+    index = get_crime_index()
+    return index.to_df(index.polygon_positions(polygon_points, dates))
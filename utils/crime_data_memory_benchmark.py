@@ -0,0 +1,77 @@
+"""
+Microbenchmark of the in-memory crime engine (utils/crime_data_memory.py).
+
+Builds a CrimeIndex over synthetic crimes spread over England and Wales, with
+denser urban clusters, and times one mile radius and polygon queries over a
+year of data against a brute force scan of the same arrays.
+
+Run from the repository root with:
+    python -m utils.crime_data_memory_benchmark [number of crimes]
+"""
+import sys
+import os
+import time
+import tempfile
+import numpy as np
+import utils.crime_data_fetch as api
+from utils.crime_data_memory import CrimeIndex, _month_number
+from utils.geo_utils import haversine_meters_array
+
+# (latitude, longitude, share of the crimes) of a few city centres
+CITIES = [(51.5074, -0.1278, 0.25), (52.4862, -1.8904, 0.1), (53.4808, -2.2426, 0.1), (53.8008, -1.5491, 0.05)]
+
+def synthetic_crimes(n, months, rng):
+    lat = rng.uniform(50.0, 55.5, n)
+    lon = rng.uniform(-5.5, 1.7, n)
+    start = 0
+    for city_lat, city_lon, share in CITIES:
+        end = start + int(n * share)
+        lat[start:end] = rng.normal(city_lat, 0.08, end - start)
+        lon[start:end] = rng.normal(city_lon, 0.12, end - start)
+        start = end
+    month = rng.choice(_month_number(months), n)
+    crime_type_code = rng.integers(0, 14, n)
+    return lat, lon, month, crime_type_code
+
+def _time(function, repeat=20):
+    start = time.perf_counter()
+    for _ in range(repeat):
+        result = function()
+    return (time.perf_counter() - start) / repeat * 1000, result
+
+if __name__ == "__main__":
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 18_000_000
+    rng = np.random.default_rng(0)
+    months = [f"{year}-{month:02d}" for year in (2022, 2023, 2024) for month in range(1, 13)]
+    lat, lon, month, crime_type_code = synthetic_crimes(n, months, rng)
+
+    start = time.perf_counter()
+    index = CrimeIndex.from_arrays(lat, lon, month, crime_type_code, list(api.TO_PRETTY_CATEGORIES.values()))
+    print(f"{n} crimes indexed in {time.perf_counter() - start:.1f}s, {index.nbytes() / 2**20:.0f} MB")
+
+    year = months[-12:]
+    lat32, lon32 = index.latitude, index.longitude
+    for name, (qlat, qlon) in [("London", CITIES[0][:2]), ("Rural Wales", (52.3, -3.6))]:
+        ms, positions = _time(lambda: index.point_positions(qlat, qlon, year, 1609.34))
+        brute_ms, brute = _time(lambda: np.flatnonzero(
+            np.isin(index.month, _month_number(year))
+            & (haversine_meters_array(qlat, qlon, lat32, lon32) <= 1609.34)
+        ), repeat=1)
+        assert np.array_equal(np.sort(positions), brute)
+        df_ms, _ = _time(lambda: index.to_df(positions))
+        print(f"{name}: {len(positions)} crimes in {ms:.2f} ms (+{df_ms:.2f} ms DataFrame), brute force {brute_ms:.0f} ms")
+
+    d = 0.02
+    polygon = [[-0.1278 - d, 51.5074 - d], [-0.1278 + d, 51.5074 - d], [-0.1278, 51.5074 + d]]
+    ms, positions = _time(lambda: index.polygon_positions(polygon, year))
+    print(f"London triangle: {len(positions)} crimes in {ms:.2f} ms")
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        snapshot_path = os.path.join(tmp_dir, "crime_snapshot.bin")
+        index.write_snapshot(snapshot_path)
+        start = time.perf_counter()
+        mapped = CrimeIndex.from_snapshot(snapshot_path)
+        print(f"Snapshot mapped in {(time.perf_counter() - start) * 1000:.2f} ms")
+        ms, mapped_positions = _time(lambda: mapped.point_positions(*CITIES[0][:2], year, 1609.34))
+        assert np.array_equal(mapped_positions, index.point_positions(*CITIES[0][:2], year, 1609.34))
+        print(f"London from the snapshot: {len(mapped_positions)} crimes in {ms:.2f} ms")
@@ -0,0 +1,238 @@
+"""
+File based crime store: the police.uk archive converted to Parquet, queried
+with pyarrow on a single machine without a database server.
+
+The store is built (or updated) from the downloaded archive with
+    python -m utils.crime_data_parquet path/to/latest.zip
+and has one Hive partition per month (month=YYYY-MM/data.parquet). Within a
+month the rows are sorted by a Z-order key of their coordinates and written in
+small row groups, so the latitude/longitude statistics of the row groups let
+pyarrow skip most of the file for a point or area query.
+
+The query functions return the same DataFrames as their crime_data_db
+counterparts.
+"""
+import os
+import json
+import time
+import hashlib
+import zipfile
+import argparse
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.dataset as ds
+import pyarrow.parquet as pq
+import streamlit as st
+import utils.crime_data_fetch as api
+from utils.database_update import get_street_csv_members, member_checksum, open_member, DOWNLOAD_PATH
+from utils.geo_utils import haversine_meters_array, morton_key, points_in_polygon
+
+CRIME_STORE_PATH = os.environ.get("CRIME_STORE_PATH", "crime_store")
+# Rows per row group. Smaller groups prune better but add metadata per file
+STORE_ROW_GROUP_SIZE = 20_000
+# Month of each file of the store, with the checksums of the archive files
+# it was built from. Ignored by pyarrow as it starts with "_"
+STORE_MANIFEST = "_manifest.json"
+
+STORE_SCHEMA = pa.schema([
+    ("crime_type", pa.string()),
+    ("crime_id", pa.string()),
+    ("latitude", pa.float64()),
+    ("longitude", pa.float64()),
+])
+STORE_PARTITIONING = ds.partitioning(pa.schema([("month", pa.string())]), flavor="hive")
+
+# Columns read from the street.csv files and their names in the store
+CSV_STORE_COLUMNS = {
+    'Crime ID': 'crime_id',
+    'Longitude': 'longitude',
+    'Latitude': 'latitude',
+    'Crime type': 'crime_type',
+}
+
+def _read_manifest(store_path):
+    try:
+        with open(os.path.join(store_path, STORE_MANIFEST)) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+def _write_manifest(store_path, manifest):
+    tmp_path = os.path.join(store_path, STORE_MANIFEST + ".tmp")
+    with open(tmp_path, "w") as f:
+        json.dump(manifest, f, indent=1, sort_keys=True)
+    os.replace(tmp_path, os.path.join(store_path, STORE_MANIFEST))
+
+def _read_street_csv(zip_ref, member):
+    """
+    Reads the columns of the store from one street.csv member. Rows without a
+    Crime ID get the same surrogate id as in database_update.load_street_csv_copy().
+    """
+    file_name = os.path.basename(member.filename)
+    with open_member(zip_ref, member) as csv_file:
+        df = pd.read_csv(
+            csv_file,
+            usecols=lambda col: col.strip() in CSV_STORE_COLUMNS,
+            dtype={"Crime ID": str, "Crime type": str},
+        )
+    df.columns = [CSV_STORE_COLUMNS[col.strip()] for col in df.columns]
+    for col in CSV_STORE_COLUMNS.values():
+        if col not in df.columns:
+            df[col] = None
+    missing_id = df["crime_id"].isna() | (df["crime_id"] == "")
+    df.loc[missing_id, "crime_id"] = [
+        "nid-" + hashlib.md5(f"{file_name}:{line_no}".encode()).hexdigest()
+        for line_no in np.flatnonzero(missing_id.to_numpy()) + 1
+    ]
+    return df
+
+def _write_month(store_path, month, df):
+    """
+    Writes the crimes of one month sorted by Z-order key, replacing the
+    previous file of the month atomically.
+    """
+    df = df.dropna(subset=["latitude", "longitude"])
+    df = df.iloc[np.argsort(morton_key(df["latitude"], df["longitude"]), kind="stable")]
+    table = pa.Table.from_pandas(df[STORE_SCHEMA.names], schema=STORE_SCHEMA, preserve_index=False)
+    month_dir = os.path.join(store_path, f"month={month}")
+    os.makedirs(month_dir, exist_ok=True)
+    tmp_path = os.path.join(month_dir, "_data.parquet.tmp")
+    pq.write_table(table, tmp_path, row_group_size=STORE_ROW_GROUP_SIZE, compression="zstd")
+    os.replace(tmp_path, os.path.join(month_dir, "data.parquet"))
+    return table.num_rows
+
+def build_crime_store(zip_path=DOWNLOAD_PATH, store_path=CRIME_STORE_PATH, rebuild=False):
+    """
+    Converts the street.csv files of the archive into the Parquet store. Only
+    the months whose files changed since the last build are rewritten.
+
+    Parameters:
+    -----------
+    zip_path : str, optional
+        Path of the police.uk archive. Default is database_update.DOWNLOAD_PATH.
+    store_path : str, optional
+        Directory of the store. Default is CRIME_STORE_PATH.
+    rebuild : bool, optional
+        If True every month is rewritten.
+
+    Returns:
+    --------
+    list of str
+        The months written.
+    """
+    os.makedirs(store_path, exist_ok=True)
+    manifest = {} if rebuild else _read_manifest(store_path)
+    by_month = {}
+    for member in get_street_csv_members(zip_path):
+        by_month.setdefault(os.path.basename(member.filename)[:7], []).append(member)
+
+    written = []
+    with zipfile.ZipFile(zip_path, "r") as zip_ref:
+        for month, members in sorted(by_month.items()):
+            checksum = ",".join(member_checksum(m) for m in members)
+            if manifest.get(month) == checksum:
+                continue
+            month_start = time.perf_counter()
+            # Files are read in archive order and the last occurrence of a
+            # repeated crime id is kept, as the database upserts do
+            df = pd.concat([_read_street_csv(zip_ref, m) for m in members], ignore_index=True)
+            df = df.drop_duplicates(subset="crime_id", keep="last")
+            rows = _write_month(store_path, month, df)
+            manifest[month] = checksum
+            _write_manifest(store_path, manifest)
+            written.append(month)
+            print(f"Wrote {month}: {rows} rows from {len(members)} files in {time.perf_counter() - month_start:.1f}s")
+    print(f"{len(written)} of {len(by_month)} months written to {store_path}")
+    return written
+
+@st.cache_resource(ttl="1d", show_spinner=False)
+def get_crime_store(store_path=CRIME_STORE_PATH):
+    """
+    Opens the Parquet store once per app process (the file list is refreshed
+    daily).
+
+    Returns:
+    --------
+    pyarrow.dataset.Dataset or None
+        None if the store has not been built.
+    """
+    if not os.path.isdir(store_path) or not _read_manifest(store_path):
+        return None
+    return ds.dataset(store_path, format="parquet", partitioning=STORE_PARTITIONING, schema=STORE_SCHEMA.append(pa.field("month", pa.string())))
+
+def get_availability():
+    """
+    Months (YYYY-MM) in the store.
+    """
+    store = get_crime_store()
+    if store is None:
+        return []
+    return sorted(_read_manifest(CRIME_STORE_PATH))
+
+def _read_crimes(dates, lat_min, lat_max, lon_min, lon_max):
+    """
+    Reads the crimes of the given months inside a bounding box. The month
+    filter selects the partitions and the box filter skips the row groups
+    whose coordinate statistics do not overlap it.
+    """
+    store = get_crime_store()
+    if store is None:
+        return api.compact_crimes_df(pd.DataFrame(columns=api.DF_COLUMNS))
+    latitude, longitude = ds.field("latitude"), ds.field("longitude")
+    table = store.to_table(
+        columns=["crime_type", "crime_id", "month", "latitude", "longitude"],
+        filter=(
+            ds.field("month").isin(list(dates))
+            & (latitude >= lat_min) & (latitude <= lat_max)
+            & (longitude >= lon_min) & (longitude <= lon_max)
+        ),
+    )
+    # Strings straight to pyarrow backed columns, without Python objects
+    return api.compact_crimes_df(table.to_pandas(types_mapper={pa.string(): api.CRIME_ID_DTYPE}.get))
+
+def get_crime_street_level_point_dates(lat, lon, dates, radius_meters=1609.34):
+    """
+    Crimes within radius_meters of a point in the given months, as
+    db.get_crime_street_level_point_dates().
+
+    Returns:
+    --------
+    pandas.DataFrame
+        Columns api.DF_COLUMNS.
+    """
+    d_lat = radius_meters / 111320
+    d_lon = radius_meters / (111320 * max(np.cos(np.radians(lat)), 1e-6))
+    df = _read_crimes(dates, lat - d_lat, lat + d_lat, lon - d_lon, lon + d_lon)
+    distances = haversine_meters_array(lat, lon, df['latitude'].to_numpy(), df['longitude'].to_numpy())
+    return df[distances <= radius_meters].reset_index(drop=True)
+
+def get_crime_street_level_area_dates(polygon_points, dates):
+    """
+    Crimes inside a polygon ([longitude, latitude] vertices) in the given
+    months, as db.get_crime_street_level_area_dates().
+
+    Returns:
+    --------
+    pandas.DataFrame
+        Columns api.DF_COLUMNS.
+    """
+    lons, lats = zip(*polygon_points)
+    df = _read_crimes(dates, min(lats), max(lats), min(lons), max(lons))
+    inside = points_in_polygon(df['longitude'].to_numpy(), df['latitude'].to_numpy(), polygon_points)
+    return df[inside].reset_index(drop=True)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Convert the police.uk archive into the Parquet crime store.")
+    parser.add_argument("zip_path", nargs="?", default=DOWNLOAD_PATH, help="Path of the downloaded archive.")
+    parser.add_argument("--store", default=CRIME_STORE_PATH, help="Directory of the store.")
+    parser.add_argument("--rebuild", action="store_true", help="Rewrite every month, not only the changed ones.")
+    parser.add_argument("--snapshot", nargs="?", const="", metavar="PATH",
+                        help="Also write the memory-mapped snapshot of utils/crime_data_memory.py (default path: CRIME_SNAPSHOT_PATH).")
+    args = parser.parse_args()
+    written = build_crime_store(args.zip_path, args.store, args.rebuild)
+    if args.snapshot is not None:
+        import utils.crime_data_memory as memory
+        snapshot_path = args.snapshot or memory.CRIME_SNAPSHOT_PATH
+        if written or not os.path.exists(snapshot_path):
+            memory.CrimeIndex.from_store(args.store).write_snapshot(snapshot_path)
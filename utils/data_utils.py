@@ -1,9 +1,60 @@
 import pandas as pd
+import numpy as np
 import utils.crime_data_fetch as api
 import utils.crime_data_db as db
+import utils.crime_data_parquet as store
+import utils.crime_data_memory as memory
+import utils.tile_server as tiles
 import streamlit as st
 from datetime import datetime, timedelta
 import altair as alt
+from utils.geo_utils import lonlat_to_web_mercator, grid_cell_bounds
+
+def add_pills_filter():
+    """
+    Displays a multi-selection pills component for crime categories.
+
+    Returns:
+    --------
+    list
+        The selected pretty category names.
+    """
+    # Create a pills selector with pretty category names as options
+    return st.pills("Crime Category", api.FROM_PRETTY_CATEGORIES.keys(), selection_mode="multi", default=api.FROM_PRETTY_CATEGORIES.keys())
+
+def add_map_display_selector(key="", modes=("Bubbles", "Heatmap")):
+    """
+    Displays a selector for how crimes are drawn on the map. "Tiles" (vector
+    tiles from utils/tile_server.py) is added to modes when the database is
+    available and the tile server has a public URL.
+
+    Returns:
+    --------
+    str
+        The selected mode, modes[0] if none is selected. No selector is shown
+        when only one mode is available.
+    """
+    modes = list(modes)
+    if st.session_state["db_connection"] != None and tiles.start_tile_server() != None:
+        modes.append("Tiles")
+    if len(modes) == 1:
+        return modes[0]
+    mode = st.segmented_control("Map display", modes, default=modes[0], key=key+"display_mode") or modes[0]
+    if mode == "Tiles":
+        st.caption(f"Crime tiles are shown from zoom level {tiles.TILE_MIN_ZOOM}, zoom in if the map is empty.")
+    return mode
+
+def filter_crime_types(df, selection):
+    """
+    Returns a copy of df with only the rows whose 'crime_type' is in selection.
+    Works for both crime DataFrames and crime count DataFrames.
+    """
+    # Only filter if the DataFrame is not empty
+    if df.shape[0] != 0:
+        return df[df['crime_type'].isin(selection)].copy()
+    else:
+        # Return a copy of the original DataFrame if it's empty
+        return df.copy()
 
 def add_pills_filter_df(df=pd.DataFrame(columns=api.DF_COLUMNS)):
     """
@@ -24,17 +75,101 @@ def add_pills_filter_df(df=pd.DataFrame(columns=api.DF_COLUMNS)):
         A filtered copy of the input DataFrame containing only the selected categories.
         If the input DataFrame is empty, returns a copy of the original empty DataFrame.
     """
-    # Create a pills selector with pretty category names as options
-    selection = st.pills("Crime Category", api.FROM_PRETTY_CATEGORIES.keys(), selection_mode="multi", default=api.FROM_PRETTY_CATEGORIES.keys())
+    return filter_crime_types(df, add_pills_filter())
 
-    # Only filter if the DataFrame is not empty
-    if df.shape[0] != 0:
-        # Filter the DataFrame to include only selected categories
-        filtered_df = df[df['crime_type'].isin(selection)].copy()
-        return filtered_df
-    else:
-        # Return a copy of the original DataFrame if it's empty
-        return df.copy()
+def get_crime_data_point_dates(lat, lon, dates):
+    """
+    Crimes around a point when the database is not available: from the
+    in-memory index (utils/crime_data_memory.py) if it is enabled, else from
+    the local Parquet store (utils/crime_data_parquet.py) if it has been built,
+    otherwise from the police API.
+
+    Returns:
+    --------
+    tuple
+        (DataFrame with columns api.DF_COLUMNS, HTTP status code)
+    """
+    if memory.get_crime_index() is not None:
+        return memory.get_crime_street_level_point_dates(lat, lon, dates), 200
+    if store.get_crime_store() is not None:
+        return store.get_crime_street_level_point_dates(lat, lon, dates), 200
+    list_crimes, status_code = api.get_crime_street_level_point_dates(lat, lon, dates)
+    return api.list_crimes_to_df(list_crimes), status_code
+
+def get_crime_data_area_dates(polygon_points, dates):
+    """
+    Crimes inside a polygon when the database is not available. See
+    get_crime_data_point_dates().
+    """
+    if memory.get_crime_index() is not None:
+        return memory.get_crime_street_level_area_dates(polygon_points, dates), 200
+    if store.get_crime_store() is not None:
+        return store.get_crime_street_level_area_dates(polygon_points, dates), 200
+    list_crimes, status_code = api.get_crime_street_level_area_dates(polygon_points, dates)
+    return api.list_crimes_to_df(list_crimes), status_code
+
+def count_crimes_by_month_type(df):
+    """
+    Counts the crimes of a crime DataFrame per month and crime type.
+
+    Returns:
+    --------
+    pandas.DataFrame
+        One row per month and crime type with columns api.COUNT_COLUMNS, in the
+        same format as db.get_crime_counts_point_dates().
+    """
+    counts = df.groupby(['month', 'crime_type'], observed=True).size().reset_index(name='count')
+    # Plain strings as in the database counts, so that grouping the counts
+    # again does not add the crime types without crimes
+    counts['crime_type'] = counts['crime_type'].astype(object)
+    return counts[api.COUNT_COLUMNS]
+
+def count_crimes_by_location(df):
+    """
+    Counts the crimes of a crime DataFrame per location and crime type.
+
+    Returns:
+    --------
+    pandas.DataFrame
+        Columns 'latitude', 'longitude' and one column per crime type, in the
+        same format as db.get_crime_location_counts_point_dates().
+    """
+    if df.shape[0] == 0:
+        return pd.DataFrame(columns=['latitude', 'longitude'])
+    counts = pd.crosstab([df['latitude'], df['longitude']], df['crime_type'])
+    counts.columns.name = None
+    return counts.reset_index()
+
+def filter_location_counts(location_counts, selection):
+    """
+    Keeps the crime type columns of a location counts DataFrame that are in
+    selection and drops the locations left without crimes.
+    """
+    columns = [col for col in location_counts.columns if col in selection]
+    filtered = location_counts[['latitude', 'longitude'] + columns]
+    return filtered[filtered[columns].sum(axis=1) > 0].reset_index(drop=True)
+
+def count_crimes_by_grid(df, cell_size):
+    """
+    Counts the crimes of a crime DataFrame per square Web Mercator grid cell.
+
+    Returns:
+    --------
+    pandas.DataFrame
+        One row per non-empty cell with columns api.GRID_COLUMNS, in the same
+        format as db.get_crime_grid_counts_point_dates().
+    """
+    if df.shape[0] == 0:
+        return pd.DataFrame(columns=api.GRID_COLUMNS)
+    x, y = lonlat_to_web_mercator(df['longitude'].astype(float).to_numpy(), df['latitude'].astype(float).to_numpy())
+    cells = pd.DataFrame({'gx': np.floor(x / cell_size), 'gy': np.floor(y / cell_size)})
+    counts = cells.groupby(['gx', 'gy']).size().reset_index(name='count')
+    lat_min, lon_min, lat_max, lon_max = grid_cell_bounds(counts['gx'], counts['gy'], cell_size)
+    return pd.DataFrame({
+        'lat_min': lat_min, 'lon_min': lon_min,
+        'lat_max': lat_max, 'lon_max': lon_max,
+        'count': counts['count'],
+    })[api.GRID_COLUMNS]
 
 def _generate_date_range_extended(start_year, start_month, end_year, end_month):
     """
@@ -106,6 +241,10 @@ def add_start_end_month(key=""):
     if key+"valid_dates" not in st.session_state:
         if st.session_state["db_connection"] != None:
             valid_dates = sorted(db.get_availability())
+        elif memory.get_crime_index() is not None:
+            valid_dates = memory.get_availability()
+        elif store.get_crime_store() is not None:
+            valid_dates = store.get_availability()
         else:
             valid_dates = sorted([i['date'] for i in api.get_availability()])
         if valid_dates == []:
@@ -193,7 +332,7 @@ def add_start_end_month(key=""):
     end_month = reverse_month_map[end_month]
     st.session_state[key+"list_crime_dates"],st.session_state[key+"stat_crime_dates"]=_generate_date_range_extended(start_year, start_month, end_year, end_month)
 
-def add_area_line_plot_crime_statistics(df, key):
+def add_area_line_plot_crime_statistics(counts_df, key):
     if key+"chart_type" not in st.session_state:
         st.session_state[key+"chart_type"] = False
 
@@ -210,8 +349,7 @@ def add_area_line_plot_crime_statistics(df, key):
             on_change=on_change,
         )
 
-    # Group by month and crime_type to get counts
-    crime_counts = df.groupby([pd.Grouper(key='month', freq='ME'), 'crime_type']).size().reset_index(name='count')
+    crime_counts = counts_df[api.COUNT_COLUMNS].copy()
     crime_counts.columns = ['Month', 'Crime Type', 'Count']
 
     # Order by total count for each crime type
@@ -256,9 +394,9 @@ def add_area_line_plot_crime_statistics(df, key):
     # Display the chart
     st.altair_chart(chart, use_container_width=True)
 
-def add_bar_plot_crime_statistics(df):
+def add_bar_plot_crime_statistics(counts_df):
     # Get total count for each crime type
-    crime_type_counts = df['crime_type'].value_counts().reset_index()
+    crime_type_counts = counts_df.groupby('crime_type')['count'].sum().sort_values(ascending=False).reset_index()
     crime_type_counts.columns = ['Crime type', 'Count']
     
     # Create horizontal bar chart with Altair
@@ -272,4 +410,39 @@ def add_bar_plot_crime_statistics(df):
     
     # Display chart
     st.subheader('Crime Distribution by Type')
-    st.altair_chart(chart, use_container_width=True)
\ No newline at end of file
+    st.altair_chart(chart, use_container_width=True)
+
+def add_compare_plot_crime_statistics(compare_counts):
+    """
+    Plots the crimes of several locations side by side: the total per month
+    and the total per crime type of every location.
+
+    Parameters:
+    -----------
+    compare_counts : pandas.DataFrame
+        Columns 'location' followed by api.COUNT_COLUMNS.
+    """
+    monthly_counts = compare_counts.groupby(['location', 'month'])['count'].sum().reset_index()
+    monthly_counts.columns = ['Location', 'Month', 'Count']
+    chart = alt.Chart(monthly_counts).mark_line(point=True).encode(
+        x=alt.X('Month:T', title='Month'),
+        y=alt.Y('Count:Q', title='Number of Crimes'),
+        color=alt.Color('Location:N', title='Location').scale(scheme='tableau10'),
+        tooltip=['Location', 'Month', 'Count']
+    )
+    st.subheader('Crime Counts Over Time')
+    st.altair_chart(chart, use_container_width=True)
+
+    type_counts = compare_counts.groupby(['location', 'crime_type'])['count'].sum().reset_index()
+    type_counts.columns = ['Location', 'Crime type', 'Count']
+    chart = alt.Chart(type_counts).mark_bar().encode(
+        y=alt.Y('Crime type:N', title='Crime Type', sort='-x'),
+        yOffset=alt.YOffset('Location:N'),
+        x=alt.X('Count:Q', title='Number of Crimes'),
+        color=alt.Color('Location:N', title='Location').scale(scheme='tableau10'),
+        tooltip=['Location', 'Crime type', 'Count']
+    ).properties(
+        height=max(300, type_counts['Crime type'].nunique() * 15 * max(1, type_counts['Location'].nunique()))
+    )
+    st.subheader('Crime Distribution by Type')
+    st.altair_chart(chart, use_container_width=True)
@@ -1,9 +1,14 @@
 import os
+import io
+import json
+import csv
+import time
 import requests
 import zipfile
 import pandas as pd
 import psycopg2
-import shutil
+import argparse
+from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED
 
 # PostgreSQL connection details
 # Check DB_HOST with "docker inspect -f '{{range .NetworkSettings.Networks}}{{.IPAddress}}{{end}}' postgresql-server"
@@ -15,101 +20,733 @@ DB_PASSWORD = os.environ.get("DB_PASSWORD")
 
 DATA_URL = "https://data.police.uk/data/archive/latest.zip"
 DOWNLOAD_PATH = "../../latest.zip"
-EXTRACT_PATH = "../../crime_data"
+DOWNLOAD_STATE_PATH = "../../latest.zip.state.json"
+DOWNLOAD_CHUNK_SIZE = 8 * 1024 * 1024
+# Connect and read timeouts in seconds
+DOWNLOAD_TIMEOUT = (10, 60)
+# Bytes read from the archive per COPY round-trip
+COPY_BUFFER_SIZE = 1024 * 1024
 
 
-def getPaths(data_path = '.', ext=".csv"):
+def _read_download_state(state_path):
+    try:
+        with open(state_path, "r") as file:
+            return json.load(file)
+    except (OSError, ValueError):
+        return {}
+
+def _write_download_state(state_path, state):
+    with open(state_path, "w") as file:
+        json.dump(state, file)
+
+def _response_version(response):
+    return response.headers.get("ETag") or response.headers.get("Last-Modified")
+
+def _content_length(response):
     """
-    Gets all files that include the string ext within the given path.
+    Content-Length of a response, None if the server did not send it.
     """
-    filepaths = []
-    for subdir, dirs, files in os.walk(data_path):
-        for file in files:
-            filepaths.append(os.path.join(subdir, file))
-    filepaths.sort()
-    return [i for i in filepaths if ext in i]
+    length = response.headers.get("Content-Length")
+    return int(length) if length is not None else None
 
 # Download the latest crime data
-def download_crime_data():
+def download_crime_data(url=DATA_URL, path=DOWNLOAD_PATH, state_path=DOWNLOAD_STATE_PATH, retries=5):
+    """
+    Downloads the crime archive, resuming from a partial file when possible.
+
+    The remote ETag (or Last-Modified) and size are kept in state_path. A
+    partial download of the same remote version is resumed with a Range
+    request, dropped connections are retried with exponential backoff and the
+    final size is checked against Content-Length when the server sends it. The
+    version of every response is checked, so a changed archive is never
+    appended to a stale partial file. Nothing is downloaded when
+    the remote version is the one loaded by the last successful run (see
+    mark_archive_loaded()).
+
+    Parameters:
+    -----------
+    url : str, optional
+        Archive URL. Default is DATA_URL.
+    path : str, optional
+        Where to write the archive. Default is DOWNLOAD_PATH.
+    state_path : str, optional
+        JSON file with the download state. Default is DOWNLOAD_STATE_PATH.
+    retries : int, optional
+        Number of attempts before giving up. Default is 5.
+
+    Returns:
+    --------
+    bool
+        True if the archive at path needs loading, False if the remote archive
+        has not changed since the last successful run.
+    """
+    head = requests.head(url, allow_redirects=True, timeout=DOWNLOAD_TIMEOUT)
+    head.raise_for_status()
+    version = _response_version(head)
+    size = _content_length(head)
+    accepts_ranges = head.headers.get("Accept-Ranges", "").lower() == "bytes"
+
+    state = _read_download_state(state_path)
+    same_version = version is not None and state.get("version") == version
+    if same_version and state.get("loaded"):
+        print("Latest crime data already loaded, skipping download.")
+        return False
+    if not same_version:
+        state = {"version": version, "size": size, "complete": False, "loaded": False}
+        _write_download_state(state_path, state)
+        if os.path.exists(path):
+            os.remove(path)
+    elif state.get("complete") and os.path.exists(path) and (size is None or os.path.getsize(path) == size):
+        print("Latest crime data already downloaded.")
+        return True
+
     print("Downloading latest crime data...")
-    response = requests.get(DATA_URL, stream=True)
-    with open(DOWNLOAD_PATH, "wb") as file:
-        for chunk in response.iter_content(chunk_size=1024):
-            file.write(chunk)
+    for attempt in range(retries):
+        offset = os.path.getsize(path) if os.path.exists(path) else 0
+        headers = {}
+        if offset > 0 and accepts_ranges and version is not None:
+            headers["Range"] = f"bytes={offset}-"
+            headers["If-Range"] = version
+        try:
+            with requests.get(url, headers=headers, stream=True, timeout=DOWNLOAD_TIMEOUT) as response:
+                response_version = _response_version(response)
+                changed = response_version is not None and response_version != version
+                if response.status_code == 416 and "Range" in headers:
+                    # Nothing after offset: the partial file is complete,
+                    # unless it is longer than the archive or the archive changed
+                    if not changed and (size is None or offset == size):
+                        break
+                    print(f"Partial archive has {offset} bytes, expected {size}, downloading it again...")
+                    os.remove(path)
+                    continue
+                response.raise_for_status()
+                if response.status_code == 206:
+                    if changed:
+                        print("The archive changed during the download, downloading it again...")
+                        os.remove(path)
+                        continue
+                    print(f"Resuming download from byte {offset}...")
+                    mode = "ab"
+                else:
+                    # Server sent the whole file (no range support or the file changed)
+                    offset = 0
+                    mode = "wb"
+                    if changed:
+                        # The archive changed since the HEAD request
+                        version, size = response_version, _content_length(response)
+                        state = {"version": version, "size": size, "complete": False, "loaded": False}
+                        _write_download_state(state_path, state)
+                with open(path, mode) as file:
+                    for chunk in response.iter_content(chunk_size=DOWNLOAD_CHUNK_SIZE):
+                        file.write(chunk)
+            break
+        except requests.RequestException as e:
+            if attempt == retries - 1:
+                raise
+            wait_seconds = 2 ** attempt
+            print(f"Download interrupted ({e}), retrying in {wait_seconds}s...")
+            time.sleep(wait_seconds)
+    else:
+        raise IOError(f"Could not download {url} in {retries} attempts.")
+
+    downloaded = os.path.getsize(path)
+    if size is not None and downloaded != size:
+        raise IOError(f"Downloaded archive has {downloaded} bytes, expected {size}.")
+    state["complete"] = True
+    _write_download_state(state_path, state)
     print("Download complete.")
+    return True
+
+def mark_archive_loaded(state_path=DOWNLOAD_STATE_PATH):
+    """
+    Records that the downloaded archive was loaded, so the next run skips the
+    download while the remote ETag is unchanged.
+    """
+    state = _read_download_state(state_path)
+    if state.get("complete"):
+        state["loaded"] = True
+        _write_download_state(state_path, state)
 
-# Extract ZIP file
-def extract_data():
-    print("Extracting files...")
-    with zipfile.ZipFile(DOWNLOAD_PATH, "r") as zip_ref:
-        zip_ref.extractall(EXTRACT_PATH)
-    print("Extraction complete.")
+def get_street_csv_members(zip_path=DOWNLOAD_PATH):
+    """
+    Lists the street.csv files in the archive, sorted by name.
+    """
+    with zipfile.ZipFile(zip_path, "r") as zip_ref:
+        members = [m for m in zip_ref.infolist() if m.filename.endswith("street.csv")]
+    return sorted(members, key=lambda m: m.filename)
 
-# Process CSV files and insert into database
-def process_and_load_data():
-    conn = psycopg2.connect(
-        host=DB_HOST, port=DB_PORT, dbname=DB_NAME, user=DB_USER, password=DB_PASSWORD
-    )
-    cursor = conn.cursor()
-    
-    paths = getPaths(data_path=EXTRACT_PATH, ext="street.csv")
-    
-    # Default columns in the csv
-    required_columns = ['Crime ID','Month','Reported by','Falls within','Longitude',
-                        'Latitude','Location','LSOA code','LSOA name','Crime type',
-                        'Last outcome category','Context']
-    for file_path in paths:
-        print(f"Processing {file_path}...")
-        df = pd.read_csv(file_path)
-        
-        # Convert Month to date
-        df["Month"] = pd.to_datetime(df["Month"], format="%Y-%m").dt.date
-        
-        for col in required_columns:
-            if col not in df.columns:
-                print(f"Warning: Adding empty column {col}")
-                df[col] = None
-
-        total_rows = len(df)
-        print(f"{total_rows} records to process...")
-
-        for i, (_, row) in enumerate(df.iterrows(), 1):
-            # Check if Longitude or Latitude is missing
-            if pd.isna(row["Longitude"]) or pd.isna(row["Latitude"]):
-                geom_value = None  # Insert NULL for missing coordinates
+def member_checksum(member):
+    """
+    Checksum of an archive member taken from the ZIP directory (CRC-32 and
+    size), so it is available without reading the file.
+    """
+    return f"{member.CRC:08x}:{member.file_size}"
+
+def ensure_load_ledger(cursor):
+    """
+    Creates the table recording which files have been loaded and their checksum.
+    """
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS load_ledger (
+            file_name TEXT PRIMARY KEY,
+            month DATE,
+            checksum TEXT,
+            row_count BIGINT,
+            loaded_at TIMESTAMPTZ NOT NULL DEFAULT NOW()
+        );
+    """)
+
+def _record_load(cursor, file_name, checksum, row_count):
+    cursor.execute("""
+        INSERT INTO load_ledger (file_name, month, checksum, row_count, loaded_at)
+        VALUES (%s, TO_DATE(LEFT(%s, 7), 'YYYY-MM'), %s, %s, NOW())
+        ON CONFLICT (file_name)
+        DO UPDATE SET
+            month = EXCLUDED.month,
+            checksum = EXCLUDED.checksum,
+            row_count = EXCLUDED.row_count,
+            loaded_at = EXCLUDED.loaded_at;
+    """, (file_name, file_name, checksum, row_count))
+
+def select_changed_members(members):
+    """
+    Keeps the archive members that need loading: files whose checksum differs
+    from the one in load_ledger, and files never recorded in the ledger whose
+    month is not yet in crime_months.
+
+    Databases loaded before the ledger existed are not reloaded in full: the
+    unrecorded files of their loaded months are recorded in the ledger with
+    their current checksum (and no row count), so that later revisions of
+    those files are detected.
+
+    Parameters:
+    -----------
+    members : list of zipfile.ZipInfo
+        street.csv members of the archive.
+
+    Returns:
+    --------
+    list of zipfile.ZipInfo
+    """
+    conn = connect_db()
+    with conn.cursor() as cursor:
+        ensure_load_ledger(cursor)
+        cursor.execute("SELECT file_name, checksum FROM load_ledger;")
+        ledger = dict(cursor.fetchall())
+        cursor.execute("SELECT to_regclass('crime_months') IS NOT NULL;")
+        if cursor.fetchone()[0]:
+            cursor.execute("SELECT month_str FROM crime_months;")
+            loaded_months = {row[0] for row in cursor.fetchall()}
+        else:
+            loaded_months = set()
+
+        selected = []
+        seeded = 0
+        for member in members:
+            file_name = os.path.basename(member.filename)
+            if file_name in ledger:
+                if ledger[file_name] != member_checksum(member):
+                    selected.append(member)
+            elif file_name[:7] not in loaded_months:
+                selected.append(member)
             else:
-                geom_value = f"ST_SetSRID(ST_MakePoint({row['Longitude']}, {row['Latitude']}), 4326)"
-            cursor.execute("""
-                INSERT INTO crimes (crime_id, month, reported_by, falls_within, longitude, latitude, location, lsoa_code, lsoa_name, crime_type, last_outcome_category, context, geom)
-                VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, ST_SetSRID(ST_MakePoint(%s, %s), 4326)::geography)
-                ON CONFLICT (crime_id) 
-                DO UPDATE SET 
-                    month = EXCLUDED.month,
-                    reported_by = EXCLUDED.reported_by,
-                    falls_within = EXCLUDED.falls_within,
-                    longitude = EXCLUDED.longitude,
-                    latitude = EXCLUDED.latitude,
-                    location = EXCLUDED.location,
-                    lsoa_code = EXCLUDED.lsoa_code,
-                    lsoa_name = EXCLUDED.lsoa_name,
-                    crime_type = EXCLUDED.crime_type,
-                    last_outcome_category = EXCLUDED.last_outcome_category,
-                    context = EXCLUDED.context,
-                    geom = EXCLUDED.geom;
-            """, (
-                row["Crime ID"], row["Month"], row["Reported by"], row["Falls within"], 
-                row["Longitude"], row["Latitude"], row["Location"], row["LSOA code"], 
-                row["LSOA name"], row["Crime type"], row["Last outcome category"],
-                row["Context"], row["Longitude"], row["Latitude"]
-            ))
-            
-            if i % (total_rows // 10 + 1) == 0:  # Print progress every ~10%
-                print(f"{i}/{total_rows} records processed...")
-        
+                _record_load(cursor, file_name, member_checksum(member), None)
+                seeded += 1
+    conn.commit()
+    conn.close()
+
+    if seeded:
+        print(f"Recorded the checksums of {seeded} files loaded before load_ledger existed")
+    months = sorted({os.path.basename(m.filename)[:7] for m in selected})
+    print(f"{len(selected)} of {len(members)} files to load, months: {', '.join(months) if months else 'none'}")
+    return selected
+
+# Default columns in the street.csv files and their names in the database
+CSV_COLUMNS = {
+    'Crime ID': 'crime_id',
+    'Month': 'month',
+    'Reported by': 'reported_by',
+    'Falls within': 'falls_within',
+    'Longitude': 'longitude',
+    'Latitude': 'latitude',
+    'Location': 'location',
+    'LSOA code': 'lsoa_code',
+    'LSOA name': 'lsoa_name',
+    'Crime type': 'crime_type',
+    'Last outcome category': 'last_outcome_category',
+    'Context': 'context',
+}
+
+UPSERT_CONFLICT_SQL = """
+    ON CONFLICT (crime_id) 
+    DO UPDATE SET 
+        month = EXCLUDED.month,
+        reported_by = EXCLUDED.reported_by,
+        falls_within = EXCLUDED.falls_within,
+        longitude = EXCLUDED.longitude,
+        latitude = EXCLUDED.latitude,
+        location = EXCLUDED.location,
+        lsoa_code = EXCLUDED.lsoa_code,
+        lsoa_name = EXCLUDED.lsoa_name,
+        crime_type = EXCLUDED.crime_type,
+        last_outcome_category = EXCLUDED.last_outcome_category,
+        context = EXCLUDED.context,
+        geom = EXCLUDED.geom;
+"""
+
+# Types of the columns of the crimes table. crime_id is the primary key of
+# every month partition (a primary key on the partitioned table would have
+# to include month).
+CRIMES_COLUMN_TYPES = {
+    'crime_id': 'TEXT NOT NULL',
+    'month': 'DATE NOT NULL',
+    'reported_by': 'TEXT',
+    'falls_within': 'TEXT',
+    'longitude': 'DOUBLE PRECISION',
+    'latitude': 'DOUBLE PRECISION',
+    'location': 'TEXT',
+    'lsoa_code': 'TEXT',
+    'lsoa_name': 'TEXT',
+    'crime_type': 'TEXT',
+    'last_outcome_category': 'TEXT',
+    'context': 'TEXT',
+    'geom': 'GEOGRAPHY(Point, 4326)',
+}
+
+def _has_index(cursor, table, method, column):
+    """
+    True if table has an index of the given access method (gist, brin,
+    btree, ...) whose first column is column, whatever its name. Databases set
+    up by hand may already have one under another name.
+    """
+    cursor.execute("""
+        SELECT 1
+        FROM pg_index AS i
+        JOIN pg_class AS c ON c.oid = i.indexrelid
+        JOIN pg_am AS am ON am.oid = c.relam
+        JOIN pg_attribute AS a ON a.attrelid = i.indrelid AND a.attnum = i.indkey[0]
+        WHERE i.indrelid = %s::regclass AND am.amname = %s AND a.attname = %s;
+    """, (table, method, column))
+    return cursor.fetchone() is not None
+
+def ensure_index(cursor, table, method, column):
+    """
+    Creates an index USING method on table (column) unless an equivalent one
+    exists. Returns True if the index was created.
+    """
+    if _has_index(cursor, table, method, column):
+        return False
+    print(f"Creating {method} index on {table} ({column})...")
+    cursor.execute(f"CREATE INDEX ON {table} USING {method} ({column});")
+    return True
+
+def is_partitioned(cursor, table):
+    cursor.execute("SELECT relkind = 'p' FROM pg_class WHERE oid = to_regclass(%s);", (table,))
+    row = cursor.fetchone()
+    return row is not None and row[0]
+
+def ensure_crimes_schema(cursor):
+    """
+    Creates the crimes table, partitioned by month, and the indexes the app's
+    queries rely on: a GiST index on geom for ST_DWithin/ST_Within. Month
+    filters are answered by partition pruning.
+
+    Databases created before partitioning keep their plain crimes table (see
+    migrate_crimes_to_partitions()), with a BRIN index on month for the month
+    filters. Files are loaded in month order, so BRIN stays small and selective.
+    """
+    cursor.execute("CREATE EXTENSION IF NOT EXISTS postgis;")
+    cursor.execute("SELECT to_regclass('crimes') IS NULL;")
+    if cursor.fetchone()[0]:
+        _create_partitioned_crimes(cursor)
+    ensure_index(cursor, "crimes", "gist", "geom")
+    if not is_partitioned(cursor, "crimes"):
+        ensure_index(cursor, "crimes", "brin", "month")
+
+def _create_partitioned_crimes(cursor):
+    columns = ",\n".join(f"{col} {col_type}" for col, col_type in CRIMES_COLUMN_TYPES.items())
+    cursor.execute(f"""
+        CREATE TABLE crimes (
+            {columns}
+        ) PARTITION BY RANGE (month);
+    """)
+
+def partition_name(table, month):
+    """
+    Name of the partition of table holding a month (YYYY-MM), e.g. crimes_y2024m01.
+    """
+    year, month_number = month.split("-")
+    return f"{table}_y{year}m{month_number}"
+
+def _month_bounds(month):
+    """
+    First day of a month (YYYY-MM) and of the following month.
+    """
+    year, month_number = (int(part) for part in month.split("-"))
+    next_year, next_month = (year + 1, 1) if month_number == 12 else (year, month_number + 1)
+    return f"{year:04d}-{month_number:02d}-01", f"{next_year:04d}-{next_month:02d}-01"
+
+def get_partition_months(cursor, table):
+    """
+    Months (YYYY-MM) of the partitions attached to table, sorted.
+    """
+    cursor.execute("""
+        SELECT child.relname
+        FROM pg_inherits
+        JOIN pg_class AS child ON child.oid = pg_inherits.inhrelid
+        WHERE pg_inherits.inhparent = to_regclass(%s);
+    """, (table,))
+    prefix = f"{table}_y"
+    months = []
+    for (name,) in cursor.fetchall():
+        if name.startswith(prefix):
+            year, month_number = name[len(prefix):].split("m")
+            months.append(f"{year}-{month_number}")
+    return sorted(months)
+
+def create_month_table(cursor, month):
+    """
+    Creates an empty standalone table with the layout of crimes for one month,
+    to be loaded and then swapped in with attach_month_table(). Its CHECK
+    constraint on month lets ATTACH PARTITION skip scanning the rows.
+
+    Returns:
+    --------
+    str
+        Name of the table.
+    """
+    start, end = _month_bounds(month)
+    table = f"{partition_name('crimes_load', month)}_{int(time.time())}"
+    cursor.execute(f"""
+        CREATE TABLE {table} (
+            LIKE crimes INCLUDING DEFAULTS,
+            PRIMARY KEY (crime_id),
+            CHECK (month >= DATE '{start}' AND month < DATE '{end}')
+        );
+    """)
+    return table
+
+def drop_stale_month_tables(cursor):
+    """
+    Drops the month tables left behind by a load that stopped before
+    attaching them (see create_month_table()), and clears the checksums of
+    the files of their months in load_ledger so that the next incremental run
+    loads those months again. Only one load may run at a time.
+    """
+    cursor.execute("SELECT relname FROM pg_class WHERE relkind = 'r' AND relname LIKE %s;", (r"crimes\_load\_%",))
+    tables = [row[0] for row in cursor.fetchall()]
+    if not tables:
+        return
+    # crimes_load_yYYYYmMM_<epoch>
+    month_starts = sorted({
+        "{}-{}-01".format(*table[len("crimes_load_y"):].split("_")[0].split("m")) for table in tables
+    })
+    print(f"Dropping {len(tables)} month tables of an interrupted load: {', '.join(tables)}")
+    _discard_month_tables(cursor, tables, [])
+    cursor.execute("UPDATE load_ledger SET checksum = NULL WHERE month = ANY(%s::date[]);", (month_starts,))
+
+def _deduplicate_month_table(cursor, table, month):
+    """
+    Keeps each crime id in a single month, the latest one, as the primary key
+    of the unpartitioned table did for files loaded in month order: a
+    partitioned table can only enforce unique (crime_id, month). Rows of the
+    month table already in a later month are deleted, and so are the rows of
+    earlier months with the same ids.
+
+    Returns:
+    --------
+    list of str
+        The earlier months (YYYY-MM) that lost rows, whose counts are stale.
+    """
+    start, end = _month_bounds(month)
+    cursor.execute(f"""
+        DELETE FROM {table} AS t
+        USING crimes AS c
+        WHERE c.crime_id = t.crime_id AND c.month >= %s;
+    """, (end,))
+    cursor.execute(f"""
+        DELETE FROM crimes AS c
+        USING {table} AS t
+        WHERE c.crime_id = t.crime_id AND c.month < %s
+        RETURNING TO_CHAR(c.month, 'YYYY-MM');
+    """, (start,))
+    return sorted({row[0] for row in cursor.fetchall()})
+
+def attach_month_table(cursor, table, month):
+    """
+    Indexes a loaded month table and swaps it in as the partition of its
+    month, replacing (and dropping) the previous partition if there is one.
+    The indexes are built before the swap so that the parent is only locked
+    for the detach and attach. Crime ids also present in other months are
+    deduplicated first (see _deduplicate_month_table()).
+
+    Returns:
+    --------
+    list of str
+        The other months (YYYY-MM) whose rows changed.
+    """
+    changed_months = _deduplicate_month_table(cursor, table, month)
+    ensure_index(cursor, table, "gist", "geom")
+    cursor.execute(f"ANALYZE {table};")
+    start, end = _month_bounds(month)
+    partition = partition_name("crimes", month)
+    if month in get_partition_months(cursor, "crimes"):
+        cursor.execute(f"ALTER TABLE crimes DETACH PARTITION {partition};")
+        cursor.execute(f"DROP TABLE {partition};")
+    cursor.execute(f"ALTER TABLE {table} RENAME TO {partition};")
+    cursor.execute(f"ALTER TABLE crimes ATTACH PARTITION {partition} FOR VALUES FROM ('{start}') TO ('{end}');")
+    return changed_months
+
+def detach_months_before(cursor, before_month, drop=False):
+    """
+    Detaches the partitions of crimes and crime_location_counts for the months
+    before before_month (YYYY-MM). Detaching only updates the catalog, the
+    rows are not touched. Detached crimes partitions are kept as
+    detached_crimes_yYYYYmMM tables unless drop is True; the counts, which can
+    be rebuilt, are always dropped.
+
+    Returns:
+    --------
+    list of str
+        The detached months.
+    """
+    months = [m for m in get_partition_months(cursor, "crimes") if m < before_month]
+    for month in months:
+        partition = partition_name("crimes", month)
+        cursor.execute(f"ALTER TABLE crimes DETACH PARTITION {partition};")
+        if drop:
+            cursor.execute(f"DROP TABLE {partition};")
+        else:
+            cursor.execute(f"ALTER TABLE {partition} RENAME TO detached_{partition};")
+    if is_partitioned(cursor, "crime_location_counts"):
+        for month in get_partition_months(cursor, "crime_location_counts"):
+            if month < before_month:
+                partition = partition_name("crime_location_counts", month)
+                cursor.execute(f"ALTER TABLE crime_location_counts DETACH PARTITION {partition};")
+                cursor.execute(f"DROP TABLE {partition};")
+    elif months:
+        cursor.execute("DELETE FROM crime_location_counts WHERE month < %s;", (f"{before_month}-01",))
+    if months:
+        print(f"Detached {len(months)} months: {', '.join(months)}")
+    return months
+
+def migrate_crimes_to_partitions(conn):
+    """
+    Converts a plain crimes table into a month-partitioned one, one month per
+    transaction. The old table is kept as crimes_unpartitioned until it is
+    dropped by hand.
+    """
+    with conn.cursor() as cursor:
+        if is_partitioned(cursor, "crimes"):
+            print("crimes is already partitioned")
+            return
+        # crime_months reads the table it was created on, it is recreated below
+        cursor.execute("DROP MATERIALIZED VIEW IF EXISTS crime_months;")
+        cursor.execute("ALTER TABLE crimes RENAME TO crimes_unpartitioned;")
+        _create_partitioned_crimes(cursor)
+        ensure_index(cursor, "crimes", "gist", "geom")
+        cursor.execute("SELECT DISTINCT TO_CHAR(month, 'YYYY-MM') FROM crimes_unpartitioned ORDER BY 1;")
+        months = [row[0] for row in cursor.fetchall()]
+    conn.commit()
+
+    columns = ", ".join(CRIMES_COLUMN_TYPES)
+    for month in months:
+        start, end = _month_bounds(month)
+        with conn.cursor() as cursor:
+            table = create_month_table(cursor, month)
+            cursor.execute(f"""
+                INSERT INTO {table} ({columns})
+                SELECT {columns} FROM crimes_unpartitioned
+                WHERE month >= %s AND month < %s;
+            """, (start, end))
+            attach_month_table(cursor, table, month)
         conn.commit()
-        print(f"Finished processing {file_path}")
+        print(f"Migrated {month}")
 
-    # Create and updating a view for the available months
+    with conn.cursor() as cursor:
+        refresh_crime_months(cursor)
+    conn.commit()
+    print("crimes is partitioned, crimes_unpartitioned can be dropped")
+
+def analyze_tables(cursor):
+    """
+    Updates the planner statistics of the tables the app queries, so the new
+    rows are taken into account when choosing between index and sequential scans.
+    """
+    print("Analyzing crimes and crime_location_counts...")
+    cursor.execute("ANALYZE crimes;")
+    cursor.execute("ANALYZE crime_location_counts;")
+
+def cluster_crime_location_counts(cursor):
+    """
+    Rewrites crime_location_counts in the order of its GiST index, so that the
+    rows of nearby locations are stored in the same pages. Takes an exclusive
+    lock on the table while it runs.
+    """
+    print("Clustering crime_location_counts on its geom index...")
+    if is_partitioned(cursor, "crime_location_counts") and cursor.connection.server_version < 150000:
+        # CLUSTER of a partitioned table needs PostgreSQL 15, cluster each
+        # partition on its own part of the geom index
+        cursor.execute("""
+            SELECT t.relname, i.relname
+            FROM pg_inherits AS inh
+            JOIN pg_class AS i ON i.oid = inh.inhrelid
+            JOIN pg_index AS x ON x.indexrelid = i.oid
+            JOIN pg_class AS t ON t.oid = x.indrelid
+            WHERE inh.inhparent = 'crime_location_counts_geom_idx'::regclass
+            ORDER BY t.relname;
+        """)
+        for table, index in cursor.fetchall():
+            cursor.execute(f"CLUSTER {table} USING {index};")
+    else:
+        cursor.execute("CLUSTER crime_location_counts USING crime_location_counts_geom_idx;")
+
+def _create_staging_table(cursor):
+    """
+    Creates a temporary text-only table with the layout of the street.csv files.
+    The table is dropped automatically when the transaction commits.
+    """
+    columns = ",\n".join(f"{col} TEXT" for col in CSV_COLUMNS.values())
+    cursor.execute(f"""
+        CREATE TEMP TABLE crimes_staging (
+            {columns},
+            line_no BIGSERIAL
+        ) ON COMMIT DROP;
+    """)
+
+def _read_csv_header(csv_file):
+    """
+    Reads the header line of an open street.csv file and returns the matching
+    staging table columns in file order. The file is left positioned on the
+    first data line so it can be passed straight to COPY.
+    """
+    header = next(csv.reader([csv_file.readline()]))
+    header = [col.strip() for col in header]
+    unknown = [col for col in header if col not in CSV_COLUMNS]
+    if unknown:
+        raise ValueError(f"Unexpected columns in csv: {unknown}")
+    for col in CSV_COLUMNS:
+        if col not in header:
+            print(f"Warning: Column {col} missing, it will be loaded as NULL")
+    return [CSV_COLUMNS[col] for col in header]
+
+def _moved_months(cursor, table):
+    """
+    Months of the rows of table whose crime id is in crimes_staging with
+    another month. The upsert moves these crimes to their new month, so the
+    counts of the old months must be refreshed as well.
+    """
+    cursor.execute(f"""
+        SELECT DISTINCT TO_CHAR(c.month, 'YYYY-MM')
+        FROM {table} AS c
+        JOIN crimes_staging AS s ON c.crime_id = s.crime_id
+        WHERE c.month <> TO_DATE(s.month, 'YYYY-MM');
+    """)
+    return {row[0] for row in cursor.fetchall()}
+
+def load_street_csv_copy(cursor, csv_file, source_name, table="crimes"):
+    """
+    Loads one street.csv file into the crimes table (or a month table, see
+    create_month_table()) using COPY.
+
+    The file is streamed into a temporary staging table with COPY FROM STDIN,
+    the geometry is built in SQL and the rows are merged into crimes with a
+    single upsert.
+
+    Parameters:
+    -----------
+    cursor : psycopg2.extensions.cursor
+        Cursor of an open connection. The caller is responsible for committing.
+    csv_file : file object
+        Open text file positioned at the start of the csv (header included).
+    source_name : str
+        Name of the file, used to build stable ids for rows without a Crime ID.
+    table : str, optional
+        Table to load into, with a primary key on crime_id. Default is crimes.
+
+    Returns:
+    --------
+    tuple
+        (number of rows read from the file, set of the months in YYYY-MM
+        format that lost crimes re-published in this file)
+    """
+    columns = _read_csv_header(csv_file)
+    _create_staging_table(cursor)
+    cursor.copy_expert(
+        f"COPY crimes_staging ({', '.join(columns)}) FROM STDIN WITH (FORMAT csv)",
+        csv_file,
+        size=COPY_BUFFER_SIZE
+    )
+    cursor.execute("SELECT COUNT(*) FROM crimes_staging;")
+    total_rows = cursor.fetchone()[0]
+    # Month tables are new and empty, only the plain crimes table has rows to move
+    moved_months = _moved_months(cursor, table) if table == "crimes" else set()
+
+    # Rows without a Crime ID (e.g. anti-social behaviour) get an id derived
+    # from the file name and line number so that reloading a file updates
+    # them instead of duplicating them. DISTINCT ON keeps the last occurrence
+    # of a repeated id, as the row by row upsert did.
+    cursor.execute(f"""
+        INSERT INTO {table} (crime_id, month, reported_by, falls_within, longitude, latitude, location, lsoa_code, lsoa_name, crime_type, last_outcome_category, context, geom)
+        SELECT DISTINCT ON (crime_id)
+            crime_id, month, reported_by, falls_within, longitude, latitude, location, lsoa_code, lsoa_name, crime_type, last_outcome_category, context,
+            ST_SetSRID(ST_MakePoint(longitude, latitude), 4326)::geography
+        FROM (
+            SELECT
+                COALESCE(NULLIF(crime_id, ''), 'nid-' || md5(%s || ':' || line_no)) AS crime_id,
+                TO_DATE(month, 'YYYY-MM') AS month,
+                reported_by, falls_within,
+                NULLIF(longitude, '')::double precision AS longitude,
+                NULLIF(latitude, '')::double precision AS latitude,
+                location, lsoa_code, lsoa_name, crime_type, last_outcome_category, context,
+                line_no
+            FROM crimes_staging
+        ) AS staged
+        ORDER BY crime_id, line_no DESC
+    """ + UPSERT_CONFLICT_SQL, (source_name,))
+    return total_rows, moved_months
+
+def load_street_csv_rows(cursor, csv_file, table="crimes"):
+    """
+    Loads one street.csv file into the crimes table with one upsert per row.
+    Much slower than load_street_csv_copy(), kept for databases where COPY is
+    not available. Returns the same tuple as load_street_csv_copy().
+    """
+    df = pd.read_csv(csv_file)
+
+    # Convert Month to date
+    df["Month"] = pd.to_datetime(df["Month"], format="%Y-%m").dt.date
+
+    for col in CSV_COLUMNS:
+        if col not in df.columns:
+            print(f"Warning: Adding empty column {col}")
+            df[col] = None
+
+    total_rows = len(df)
+    print(f"{total_rows} records to process...")
+
+    moved_months = set()
+    for i, (_, row) in enumerate(df.iterrows(), 1):
+        cursor.execute(f"SELECT TO_CHAR(month, 'YYYY-MM') FROM {table} WHERE crime_id = %s AND month <> %s;", (row["Crime ID"], row["Month"]))
+        moved_months.update(moved[0] for moved in cursor.fetchall())
+        cursor.execute(f"""
+            INSERT INTO {table} (crime_id, month, reported_by, falls_within, longitude, latitude, location, lsoa_code, lsoa_name, crime_type, last_outcome_category, context, geom)
+            VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, ST_SetSRID(ST_MakePoint(%s, %s), 4326)::geography)
+        """ + UPSERT_CONFLICT_SQL, (
+            row["Crime ID"], row["Month"], row["Reported by"], row["Falls within"], 
+            row["Longitude"], row["Latitude"], row["Location"], row["LSOA code"], 
+            row["LSOA name"], row["Crime type"], row["Last outcome category"],
+            row["Context"], row["Longitude"], row["Latitude"]
+        ))
+        
+        if i % (total_rows // 10 + 1) == 0:  # Print progress every ~10%
+            print(f"{i}/{total_rows} records processed...")
+    return total_rows, moved_months
+
+def refresh_crime_months(cursor):
+    """
+    Creates (if needed) and refreshes the materialized view with the available months.
+    """
     cursor.execute("""
     DO $$ 
     BEGIN
@@ -124,21 +761,376 @@ def process_and_load_data():
 
     REFRESH MATERIALIZED VIEW crime_months;
     """)
+
+def ensure_crime_location_counts(cursor):
+    """
+    Creates the table with crime counts per location, month and crime type.
+    Crime locations in the archive are already anonymised to a set of map
+    points, so each point is used as the spatial cell. The table is
+    partitioned by month like crimes when crimes is partitioned.
+
+    Returns:
+    --------
+    bool
+        True if the table was created by this call.
+    """
+    cursor.execute("SELECT to_regclass('crime_location_counts') IS NULL;")
+    created = cursor.fetchone()[0]
+    partition_by = "PARTITION BY RANGE (month)" if created and is_partitioned(cursor, "crimes") else ""
+    cursor.execute(f"""
+        CREATE TABLE IF NOT EXISTS crime_location_counts (
+            month DATE NOT NULL,
+            latitude DOUBLE PRECISION NOT NULL,
+            longitude DOUBLE PRECISION NOT NULL,
+            crime_type TEXT NOT NULL,
+            crime_count INTEGER NOT NULL,
+            geom GEOGRAPHY(Point, 4326) NOT NULL
+        ) {partition_by};
+        CREATE INDEX IF NOT EXISTS crime_location_counts_geom_idx
+            ON crime_location_counts USING GIST (geom);
+    """)
+    if not is_partitioned(cursor, "crime_location_counts"):
+        cursor.execute("""
+            CREATE INDEX IF NOT EXISTS crime_location_counts_month_idx
+                ON crime_location_counts (month);
+        """)
+    return created
+
+def _ensure_counts_partition(cursor, month):
+    partition = partition_name("crime_location_counts", month)
+    start, end = _month_bounds(month)
+    cursor.execute(f"""
+        CREATE TABLE IF NOT EXISTS {partition}
+            PARTITION OF crime_location_counts FOR VALUES FROM ('{start}') TO ('{end}');
+    """)
+    return partition
+
+def refresh_crime_location_counts(cursor, months=None):
+    """
+    Rebuilds the rows of crime_location_counts for the given months. When the
+    table is partitioned the partitions of the months are truncated instead of
+    deleting their rows.
+
+    Parameters:
+    -----------
+    cursor : psycopg2.extensions.cursor
+        Cursor of an open connection. The caller is responsible for committing.
+    months : list of str, optional
+        Months in YYYY-MM format. If None the whole table is rebuilt.
+    """
+    partitioned = is_partitioned(cursor, "crime_location_counts")
+    if months is None:
+        cursor.execute("TRUNCATE crime_location_counts;")
+        month_filter, params = "", ()
+        if partitioned:
+            if is_partitioned(cursor, "crimes"):
+                crime_months = get_partition_months(cursor, "crimes")
+            else:
+                cursor.execute("SELECT DISTINCT TO_CHAR(month, 'YYYY-MM') FROM crimes;")
+                crime_months = [row[0] for row in cursor.fetchall()]
+            for month in crime_months:
+                _ensure_counts_partition(cursor, month)
+    else:
+        month_starts = [f"{month}-01" for month in months]
+        if partitioned:
+            for month in months:
+                cursor.execute(f"TRUNCATE {_ensure_counts_partition(cursor, month)};")
+        else:
+            cursor.execute("DELETE FROM crime_location_counts WHERE month = ANY(%s::date[]);", (month_starts,))
+        month_filter, params = "AND month = ANY(%s::date[])", (month_starts,)
+    cursor.execute(f"""
+        INSERT INTO crime_location_counts (month, latitude, longitude, crime_type, crime_count, geom)
+        SELECT month, latitude, longitude, crime_type, COUNT(*),
+            ST_SetSRID(ST_MakePoint(longitude, latitude), 4326)::geography
+        FROM crimes
+        WHERE latitude IS NOT NULL AND longitude IS NOT NULL AND crime_type IS NOT NULL
+        {month_filter}
+        GROUP BY month, latitude, longitude, crime_type;
+    """, params)
+
+def connect_db():
+    return psycopg2.connect(
+        host=DB_HOST, port=DB_PORT, dbname=DB_NAME, user=DB_USER, password=DB_PASSWORD
+    )
+
+def open_member(zip_ref, member):
+    """
+    Opens an archive member as a text stream. The file is decompressed as it
+    is read, nothing is written to disk.
+    """
+    return io.TextIOWrapper(zip_ref.open(member), encoding="utf-8-sig", newline="")
+
+def load_file(conn, zip_ref, member, bulk=True, table="crimes"):
+    """
+    Loads a single street.csv member of the archive into table in its own
+    transaction and records it in load_ledger.
+
+    Returns:
+    --------
+    tuple
+        (number of rows, seconds taken, set of the months that lost crimes
+        re-published in this file)
+    """
+    file_start = time.perf_counter()
+    file_name = os.path.basename(member.filename)
+    try:
+        with conn.cursor() as cursor, open_member(zip_ref, member) as csv_file:
+            if bulk:
+                total_rows, moved_months = load_street_csv_copy(cursor, csv_file, file_name, table)
+            else:
+                total_rows, moved_months = load_street_csv_rows(cursor, csv_file, table)
+            _record_load(cursor, file_name, member_checksum(member), total_rows)
+        conn.commit()
+    except Exception:
+        if not conn.closed:
+            conn.rollback()
+        raise
+    return total_rows, time.perf_counter() - file_start, moved_months
+
+# Connection and archive used by each process of the worker pool
+_worker_conn = None
+_worker_zip = None
+
+def _init_worker(zip_path):
+    global _worker_conn, _worker_zip
+    _worker_conn = connect_db()
+    _worker_zip = zipfile.ZipFile(zip_path, "r")
+
+def _load_file_worker(member_name, bulk, table):
+    """
+    Runs load_file() inside a pool worker. Errors are returned instead of
+    raised so that a bad file does not stop the rest of the run.
+    """
+    global _worker_conn
+    try:
+        if _worker_conn is None or _worker_conn.closed:
+            _worker_conn = connect_db()
+        member = _worker_zip.getinfo(member_name)
+        total_rows, elapsed, moved_months = load_file(_worker_conn, _worker_zip, member, bulk, table)
+        return member_name, total_rows, elapsed, moved_months, None
+    except Exception as e:
+        return member_name, 0, 0.0, set(), f"{type(e).__name__}: {e}"
+
+def _load_files_parallel(zip_path, members, bulk, workers, tables):
+    """
+    Loads the members on a pool of worker processes, each with its own
+    database connection and handle on the archive. At most 2 * workers files
+    are queued at any time. tables maps each member name to its target table.
+    """
+    max_pending = 2 * workers
+    pending = set()
+    members = iter(members)
+    with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker, initargs=(zip_path,)) as executor:
+        while True:
+            for member in members:
+                pending.add(executor.submit(_load_file_worker, member.filename, bulk, tables[member.filename]))
+                if len(pending) >= max_pending:
+                    break
+            if not pending:
+                break
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                yield future.result()
+
+def _load_files_sequential(zip_path, members, bulk, tables):
+    conn = connect_db()
+    try:
+        with zipfile.ZipFile(zip_path, "r") as zip_ref:
+            for member in members:
+                print(f"Processing {member.filename}...")
+                try:
+                    if conn.closed:
+                        conn = connect_db()
+                    total_rows, elapsed, moved_months = load_file(conn, zip_ref, member, bulk, tables[member.filename])
+                    yield member.filename, total_rows, elapsed, moved_months, None
+                except Exception as e:
+                    yield member.filename, 0, 0.0, set(), f"{type(e).__name__}: {e}"
+    finally:
+        conn.close()
+
+def _member_month(member):
+    return os.path.basename(member.filename)[:7]
+
+def _discard_month_tables(cursor, month_tables, file_names):
+    """
+    Drops month tables that will not be attached and clears the checksum of
+    their files in load_ledger, so that they are loaded again by the next
+    incremental run.
+    """
+    for table in month_tables:
+        cursor.execute(f"DROP TABLE IF EXISTS {table};")
+    if file_names:
+        cursor.execute("UPDATE load_ledger SET checksum = NULL WHERE file_name = ANY(%s);", (list(file_names),))
+
+# Process CSV files and insert into database
+def process_and_load_data(bulk=True, workers=1, members=None, zip_path=DOWNLOAD_PATH, cluster=False):
+    """
+    Loads the street.csv files of the archive into the crimes table. The files
+    are read straight from the ZIP, the archive is never extracted to disk.
+
+    When crimes is partitioned, every month is loaded into a new table that
+    then replaces the partition of that month (see attach_month_table()), so
+    the rows the app reads are never upserted in place. All the files of a
+    month are loaded when any of them is selected. A month with a file that
+    fails to load keeps its previous partition.
+
+    Otherwise each file is upserted into crimes; a file that fails to load is
+    rolled back and the remaining files are still loaded.
+
+    Failed files are reported at the end.
+
+    Parameters:
+    -----------
+    bulk : bool, optional
+        If True (default) each file is loaded with COPY and a single upsert,
+        otherwise rows are upserted one at a time.
+    workers : int, optional
+        Number of processes loading files concurrently. Default is 1.
+    members : list of zipfile.ZipInfo, optional
+        Archive members to load. If None, every street.csv file in the
+        archive is loaded.
+    zip_path : str, optional
+        Path of the archive. Default is DOWNLOAD_PATH.
+    cluster : bool, optional
+        If True crime_location_counts is clustered on its geom index after
+        it is refreshed. Default is False.
+
+    Returns:
+    --------
+    list
+        Names of the archive members that failed to load.
+    """
+    all_members = get_street_csv_members(zip_path)
+    if members is None:
+        members = all_members
+
+    conn = connect_db()
+    with conn.cursor() as cursor:
+        ensure_crimes_schema(cursor)
+        ensure_load_ledger(cursor)
+        drop_stale_month_tables(cursor)
+        partitioned = is_partitioned(cursor, "crimes")
+        month_tables = {}
+        if partitioned:
+            months = {_member_month(m) for m in members}
+            members = [m for m in all_members if _member_month(m) in months]
+            month_tables = {month: create_month_table(cursor, month) for month in sorted(months)}
     conn.commit()
+    conn.close()
+    tables = {
+        m.filename: month_tables[_member_month(m)] if partitioned else "crimes"
+        for m in members
+    }
+
+    if workers > 1:
+        results = _load_files_parallel(zip_path, members, bulk, workers, tables)
+    else:
+        results = _load_files_sequential(zip_path, members, bulk, tables)
+
+    loaded_rows = 0
+    failed = []
+    # Months of the plain crimes table that lost crimes re-published later
+    moved_months = set()
+    load_start = time.perf_counter()
+    for file_name, total_rows, elapsed, file_moved_months, error in results:
+        if error is not None:
+            failed.append(file_name)
+            print(f"Failed processing {file_name}: {error}")
+            continue
+        loaded_rows += total_rows
+        moved_months.update(file_moved_months)
+        print(f"Finished processing {file_name}: {total_rows} rows in {elapsed:.1f}s ({total_rows / max(elapsed, 1e-9):.0f} rows/s)")
+
+    elapsed = time.perf_counter() - load_start
+    print(f"Loaded {loaded_rows} rows from {len(members) - len(failed)} files in {elapsed:.1f}s ({loaded_rows / max(elapsed, 1e-9):.0f} rows/s)")
+    if failed:
+        print(f"{len(failed)} files failed to load:")
+        for file_name in failed:
+            print(f"  {file_name}")
+
+    loaded_months = sorted({_member_month(m) for m in members} | moved_months)
+    if partitioned:
+        # Swap in the months whose files all loaded
+        failed_months = {os.path.basename(file_name)[:7] for file_name in failed}
+        conn = connect_db()
+        changed_months = set()
+        for month, table in month_tables.items():
+            with conn.cursor() as cursor:
+                if month in failed_months:
+                    print(f"Keeping the previous data of {month}")
+                    _discard_month_tables(cursor, [table], [
+                        os.path.basename(m.filename) for m in members if _member_month(m) == month
+                    ])
+                else:
+                    print(f"Attaching {month}...")
+                    changed_months.update(attach_month_table(cursor, table, month))
+            conn.commit()
+        conn.close()
+        loaded_months = [month for month in loaded_months if month not in failed_months]
+        # Months that lost crimes re-published in a loaded month
+        loaded_months = sorted(set(loaded_months) | changed_months)
 
-    cursor.close()
+    # Update the aggregated counts of the months that were loaded
+    conn = connect_db()
+    with conn.cursor() as cursor:
+        if ensure_crime_location_counts(cursor):
+            print("Building crime_location_counts...")
+            refresh_crime_location_counts(cursor)
+        elif loaded_months:
+            print(f"Refreshing crime_location_counts for {', '.join(loaded_months)}...")
+            refresh_crime_location_counts(cursor, loaded_months)
+
+        if cluster:
+            cluster_crime_location_counts(cursor)
+
+        # Create and updating a view for the available months
+        refresh_crime_months(cursor)
+        analyze_tables(cursor)
+    conn.commit()
     conn.close()
     print("Database updated successfully!")
+    return failed
 
 def remove_downloaded_files():
     print("Removing downloaded files")
     os.remove(DOWNLOAD_PATH)
-    shutil.rmtree(EXTRACT_PATH)
     print("Removed files")
 
 # TODO: Use logging instead of printing
 if __name__ == "__main__":
-    download_crime_data()
-    extract_data()
-    process_and_load_data()
-    remove_downloaded_files()
+    parser = argparse.ArgumentParser(description="Download the police.uk archive and load it into the database.")
+    parser.add_argument("--workers", type=int, default=1,
+                        help="Number of processes loading files concurrently (default: 1).")
+    parser.add_argument("--row-by-row", action="store_true",
+                        help="Upsert rows one at a time instead of using COPY.")
+    parser.add_argument("--incremental", action="store_true",
+                        help="Only load files that are new or changed since the last load.")
+    parser.add_argument("--cluster", action="store_true",
+                        help="Cluster crime_location_counts on its geom index after loading.")
+    parser.add_argument("--migrate-partitions", action="store_true",
+                        help="Convert an existing plain crimes table into month partitions and exit.")
+    parser.add_argument("--detach-before", metavar="YYYY-MM",
+                        help="Detach the partitions of the months before YYYY-MM and exit.")
+    parser.add_argument("--drop-detached", action="store_true",
+                        help="With --detach-before, drop the detached crimes partitions instead of keeping them.")
+    args = parser.parse_args()
+
+    if args.migrate_partitions:
+        conn = connect_db()
+        migrate_crimes_to_partitions(conn)
+        conn.close()
+    elif args.detach_before:
+        conn = connect_db()
+        with conn.cursor() as cursor:
+            detach_months_before(cursor, args.detach_before, drop=args.drop_detached)
+            refresh_crime_months(cursor)
+        conn.commit()
+        conn.close()
+    elif download_crime_data():
+        members = get_street_csv_members()
+        if args.incremental:
+            members = select_changed_members(members)
+        failed = process_and_load_data(bulk=not args.row_by_row, workers=args.workers, members=members, cluster=args.cluster)
+        if not failed:
+            mark_archive_loaded()
+            remove_downloaded_files()
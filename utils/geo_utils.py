@@ -0,0 +1,205 @@
+import math
+import numpy as np
+
+GEOHASH_BASE32 = "0123456789bcdefghjkmnpqrstuvwxyz"
+
+# Geohash precision used to snap clicked points before querying. Precision 7
+# cells are about 153 m x 153 m (at most ~110 m from the clicked point), which
+# is small next to the one mile query radius. None disables snapping.
+CLICK_SNAP_PRECISION = 7
+
+def geohash_encode(lat, lon, precision):
+    """
+    Encodes a latitude/longitude pair as a geohash string of the given length.
+    """
+    lat_range = [-90.0, 90.0]
+    lon_range = [-180.0, 180.0]
+    geohash = []
+    bits = 0
+    bit_count = 0
+    even = True
+    while len(geohash) < precision:
+        if even:
+            mid = (lon_range[0] + lon_range[1]) / 2
+            if lon >= mid:
+                bits = (bits << 1) | 1
+                lon_range[0] = mid
+            else:
+                bits = bits << 1
+                lon_range[1] = mid
+        else:
+            mid = (lat_range[0] + lat_range[1]) / 2
+            if lat >= mid:
+                bits = (bits << 1) | 1
+                lat_range[0] = mid
+            else:
+                bits = bits << 1
+                lat_range[1] = mid
+        even = not even
+        bit_count += 1
+        if bit_count == 5:
+            geohash.append(GEOHASH_BASE32[bits])
+            bits = 0
+            bit_count = 0
+    return "".join(geohash)
+
+def geohash_bounds(geohash):
+    """
+    Returns the bounding box (lat_min, lat_max, lon_min, lon_max) of a geohash cell.
+    """
+    lat_range = [-90.0, 90.0]
+    lon_range = [-180.0, 180.0]
+    even = True
+    for char in geohash:
+        value = GEOHASH_BASE32.index(char)
+        for shift in range(4, -1, -1):
+            bit = (value >> shift) & 1
+            target = lon_range if even else lat_range
+            mid = (target[0] + target[1]) / 2
+            if bit:
+                target[0] = mid
+            else:
+                target[1] = mid
+            even = not even
+    return lat_range[0], lat_range[1], lon_range[0], lon_range[1]
+
+def haversine_meters(lat1, lon1, lat2, lon2):
+    """
+    Great-circle distance in metres between two points.
+    """
+    radius = 6371008.8
+    phi1, phi2 = math.radians(lat1), math.radians(lat2)
+    d_phi = phi2 - phi1
+    d_lambda = math.radians(lon2 - lon1)
+    a = math.sin(d_phi / 2) ** 2 + math.cos(phi1) * math.cos(phi2) * math.sin(d_lambda / 2) ** 2
+    return 2 * radius * math.asin(math.sqrt(a))
+
+def haversine_meters_array(lat, lon, lats, lons):
+    """
+    Vectorized haversine_meters(): distances in metres from one point to
+    arrays of points.
+    """
+    radius = 6371008.8
+    phi1, phi2 = np.radians(lat), np.radians(lats)
+    d_phi = phi2 - phi1
+    d_lambda = np.radians(np.asarray(lons) - lon)
+    a = np.sin(d_phi / 2) ** 2 + np.cos(phi1) * np.cos(phi2) * np.sin(d_lambda / 2) ** 2
+    return 2 * radius * np.arcsin(np.sqrt(a))
+
+def snap_point(lat, lon, precision=CLICK_SNAP_PRECISION):
+    """
+    Snaps a point to the centre of the geohash cell containing it, so that
+    nearby points share the same cache key.
+
+    Parameters:
+    -----------
+    lat : float
+        Latitude of the point.
+    lon : float
+        Longitude of the point.
+    precision : int or None, optional
+        Geohash length. If None the point is returned unchanged.
+
+    Returns:
+    --------
+    tuple
+        (snapped latitude, snapped longitude, distance in metres between the
+        original and the snapped point)
+    """
+    if precision is None:
+        return lat, lon, 0.0
+    lat_min, lat_max, lon_min, lon_max = geohash_bounds(geohash_encode(lat, lon, precision))
+    snapped_lat = (lat_min + lat_max) / 2
+    snapped_lon = (lon_min + lon_max) / 2
+    return snapped_lat, snapped_lon, haversine_meters(lat, lon, snapped_lat, snapped_lon)
+
+# Web Mercator (EPSG:3857) units per pixel at zoom level 0
+WEB_MERCATOR_UNITS_PER_PIXEL_Z0 = 156543.03392804097
+WEB_MERCATOR_RADIUS = 6378137.0
+
+# Width in screen pixels of a heatmap grid cell
+HEATMAP_CELL_PIXELS = 24
+
+def grid_cell_size(zoom, cell_pixels=HEATMAP_CELL_PIXELS):
+    """
+    Size in Web Mercator units of a grid cell that is cell_pixels wide on
+    screen at the given map zoom level.
+    """
+    return cell_pixels * WEB_MERCATOR_UNITS_PER_PIXEL_Z0 / 2 ** zoom
+
+def lonlat_to_web_mercator(lon, lat):
+    """
+    Projects longitudes and latitudes (scalars or NumPy arrays) to Web Mercator x, y.
+    """
+    x = np.radians(lon) * WEB_MERCATOR_RADIUS
+    y = np.log(np.tan(np.pi / 4 + np.radians(lat) / 2)) * WEB_MERCATOR_RADIUS
+    return x, y
+
+def web_mercator_to_lonlat(x, y):
+    """
+    Inverse of lonlat_to_web_mercator().
+    """
+    lon = np.degrees(x / WEB_MERCATOR_RADIUS)
+    lat = np.degrees(2 * np.arctan(np.exp(y / WEB_MERCATOR_RADIUS)) - np.pi / 2)
+    return lon, lat
+
+def grid_cell_bounds(gx, gy, cell_size):
+    """
+    Bounds of square Web Mercator grid cells given their integer indices
+    (floor(x / cell_size), floor(y / cell_size)).
+
+    Returns:
+    --------
+    tuple
+        (lat_min, lon_min, lat_max, lon_max) arrays.
+    """
+    gx = np.asarray(gx, dtype=float)
+    gy = np.asarray(gy, dtype=float)
+    lon_min, lat_min = web_mercator_to_lonlat(gx * cell_size, gy * cell_size)
+    lon_max, lat_max = web_mercator_to_lonlat((gx + 1) * cell_size, (gy + 1) * cell_size)
+    return lat_min, lon_min, lat_max, lon_max
+
+def morton_key(lats, lons, bits=16):
+    """
+    Z-order (Morton) key of arrays of points: the bits of the quantised
+    latitude and longitude interleaved, so that sorting by the key keeps
+    nearby points close together.
+    """
+    scale = (1 << bits) - 1
+    y = np.round((np.asarray(lats, dtype=float) + 90) / 180 * scale).astype(np.uint64)
+    x = np.round((np.asarray(lons, dtype=float) + 180) / 360 * scale).astype(np.uint64)
+    key = np.zeros(len(y), dtype=np.uint64)
+    for bit in range(bits):
+        key |= ((x >> np.uint64(bit)) & np.uint64(1)) << np.uint64(2 * bit)
+        key |= ((y >> np.uint64(bit)) & np.uint64(1)) << np.uint64(2 * bit + 1)
+    return key
+
+def points_in_polygon(lons, lats, polygon_points):
+    """
+    Vectorized ray casting test of which points are inside a polygon.
+
+    Parameters:
+    -----------
+    lons, lats : numpy.ndarray
+        Coordinates of the points.
+    polygon_points : list
+        Vertices of the polygon as [longitude, latitude] pairs, closed or not.
+
+    Returns:
+    --------
+    numpy.ndarray
+        Boolean mask of the points inside the polygon.
+    """
+    lons = np.asarray(lons, dtype=float)
+    lats = np.asarray(lats, dtype=float)
+    vertices = np.asarray(polygon_points, dtype=float)
+    inside = np.zeros(len(lons), dtype=bool)
+    x1, y1 = vertices[-1]
+    for x2, y2 in vertices:
+        # Edges crossing the horizontal line through the point, to its right
+        crosses = (y1 > lats) != (y2 > lats)
+        with np.errstate(divide="ignore", invalid="ignore"):
+            x_cross = x1 + (lats - y1) * (x2 - x1) / (y2 - y1)
+        inside ^= crosses & (lons < x_cross)
+        x1, y1 = x2, y2
+    return inside
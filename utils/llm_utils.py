@@ -11,13 +11,9 @@ from mistralai import Mistral
 MODEL = "mistral-large-latest"
 # MODEL = "mistral-small-latest"
 
-def _process_df_stats_into_str(crime_df):
-    # Group by month and crime_type to get counts
-    crime_type_month_counts = (
-        crime_df.groupby([pd.Grouper(key='month', freq='ME'), 'crime_type'])
-        .size()
-        .reset_index(name='Count')
-    )
+def _process_df_stats_into_str(counts_df):
+    # Counts per month and crime_type (columns api.COUNT_COLUMNS)
+    crime_type_month_counts = counts_df[api.COUNT_COLUMNS].copy()
     crime_type_month_counts.columns = ['Month', 'Crime Type', 'Count']
 
     # Total count for each crime type
@@ -42,7 +38,7 @@ def _process_df_stats_into_str(crime_df):
     crime_type_total_counts = crime_type_total_counts.to_string(index=False)
     crime_month_total_counts = crime_month_total_counts.to_string(index=False)
     stats = f"Crimes per month per crime type\n{crime_type_month_counts}\n\
-        Total crimes per crime type\n{crime_type_month_counts}\n\
+        Total crimes per crime type\n{crime_type_total_counts}\n\
         Total crimes per month\n{crime_month_total_counts}\n\
         Total number of crimes: {total_crimes}"
     return stats
@@ -125,14 +121,14 @@ def tool_get_crime_street_level_point_dates(lat, lon, start_year, start_month, e
     end_month = int(end_month)
     dates = _generate_date_range(start_year, start_month, end_year, end_month)
     if st.session_state["db_connection"] != None:
-        df = db.get_crime_street_level_point_dates(lat, lon, dates)
+        counts_df = db.get_crime_counts_point_dates(lat, lon, dates)
     else:
-        list_crimes, status_code = api.get_crime_street_level_point_dates(lat, lon, dates)
+        crime_data, status_code = dutils.get_crime_data_point_dates(lat, lon, dates)
         if status_code != 200:
             return f"Connection problem with police API endpoint. Status code: {status_code}"
         else:
-            df = api.list_crimes_to_df(list_crimes)
-    stats_as_str = _process_df_stats_into_str(df)
+            counts_df = dutils.count_crimes_by_month_type(crime_data)
+    stats_as_str = _process_df_stats_into_str(counts_df)
     return stats_as_str
 
 def tool_get_crime_street_level_postcode_dates(postcode, start_year, start_month, end_year, end_month):
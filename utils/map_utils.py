@@ -1,15 +1,24 @@
 import folium
+import json
+from folium.plugins import VectorGridProtobuf
+from folium.template import Template
+from branca.element import MacroElement
+import numpy as np
+import pandas as pd
 import streamlit as st
 import utils.crime_data_fetch as api
 import math
 
+# Define color stops in RGB
+COLOR_STOPS = [(0, (0, 128, 0)),      # Green
+               (25, (255, 255, 0)),   # Yellow
+               (50, (255, 0, 0))]     # Red
+
+_HEX_BYTES = np.array([f"{i:02x}" for i in range(256)], dtype=object)
+
 def color_function(value):
     """Maps a value from 0 (green) to 25 (yellow) to 50+ (red) with gradient shades."""
-    
-    # Define color stops in RGB
-    color_stops = [(0, (0, 128, 0)),      # Green
-                   (25, (255, 255, 0)),   # Yellow
-                   (50, (255, 0, 0))]     # Red
+    color_stops = COLOR_STOPS
 
     # Find which segment the value falls into
     for i in range(len(color_stops) - 1):
@@ -22,67 +31,255 @@ def color_function(value):
 
     return "#ff0000"  # Red for values above 50
 
+def color_array(values):
+    """
+    Vectorized color_function(): maps an array of values to hex colours with
+    the same colour stops and rounding.
+    """
+    values = np.asarray(values, dtype=float)
+    channels = np.zeros((len(values), 3), dtype=int)
+    channels[:] = COLOR_STOPS[-1][1]  # Red for values above the last stop
+    assigned = np.zeros(len(values), dtype=bool)
+    for i in range(len(COLOR_STOPS) - 1):
+        (x1, c1), (x2, c2) = COLOR_STOPS[i], COLOR_STOPS[i + 1]
+        in_segment = ~assigned & (values <= x2)
+        # Linear interpolation between the two colors
+        ratio = ((values[in_segment] - x1) / (x2 - x1))[:, None]
+        channels[in_segment] = ((1 - ratio) * np.array(c1) + ratio * np.array(c2)).astype(int)
+        assigned |= in_segment
+    return "#" + _HEX_BYTES[channels[:, 0]] + _HEX_BYTES[channels[:, 1]] + _HEX_BYTES[channels[:, 2]]
+
+def bubble_tooltips(location_counts, category_columns, totals):
+    """
+    Builds the tooltip HTML of every location at once: the total followed by
+    the count of each category present at the location.
+    """
+    breakdown = pd.Series("", index=location_counts.index, dtype=object)
+    for cat in category_columns:
+        counts = location_counts[cat]
+        breakdown += np.where(counts > 0, f"{cat}: " + counts.astype(str) + "<br>", "")
+    return "Total crimes: " + totals.astype(str) + "<br>" + breakdown.str.removesuffix("<br>")
+
+# Above this number of locations the bubbles are rendered as a single GeoJSON
+# layer instead of one folium.Circle per location
+GEOJSON_RENDER_THRESHOLD = 1000
+
 # TODO: Should this function be moved to a utils.py file?
 def _normalise(value, max_count, scale=60):
     return (value / max_count) * scale if max_count > scale else value
 
-def add_crime_counts_to_map(crime_df, feature_group):
+def _bubble_properties(location_counts):
+    """
+    Computes the radius, colour and tooltip of the bubble of every location.
+
+    Returns:
+    --------
+    tuple
+        (radii, colors, tooltips) aligned with the rows of location_counts.
+    """
+    category_columns = [col for col in location_counts.columns if col not in ('latitude', 'longitude')]
+    # Count total crimes at each unique location
+    crime_counts = location_counts[category_columns].sum(axis=1)
+    max_counts = crime_counts.max()
+
+    # Compute the size, color and tooltip of every bubble in one pass
+    norm_counts = _normalise(crime_counts.to_numpy(dtype=float), max_counts)
+    radii = 10 + norm_counts * 2  # Scale size based on occurrences
+    colors = color_array(norm_counts)  # Color based on crime intensity
+    tooltips = bubble_tooltips(location_counts, category_columns, crime_counts)
+    return radii, colors, tooltips
+
+def crime_counts_geojson(location_counts):
+    """
+    Converts a location counts DataFrame into a GeoJSON FeatureCollection of
+    points whose properties hold the radius, colour and tooltip of each bubble.
+    """
+    radii, colors, tooltips = _bubble_properties(location_counts)
+    features = [
+        {
+            "type": "Feature",
+            "geometry": {"type": "Point", "coordinates": [float(lon), float(lat)]},
+            "properties": {"radius": round(float(radius), 1), "color": color, "tooltip": tooltip_text},
+        }
+        for lat, lon, radius, color, tooltip_text in zip(
+            location_counts['latitude'], location_counts['longitude'], radii, colors, tooltips
+        )
+    ]
+    return {"type": "FeatureCollection", "features": features}
+
+class _BubbleStyle(MacroElement):
+    """
+    Styles the circles of its parent GeoJson layer from the 'radius' and
+    'color' properties of their features with one JS function. A Python
+    style_function would be compiled by folium into one case per feature,
+    repeating the radius and colour already in the properties.
+    """
+    _template = Template("""
+        {% macro script(this, kwargs) %}
+        {{ this._parent.get_name() }}.eachLayer(function(layer) {
+            var properties = layer.feature.properties;
+            layer.setRadius(properties.radius);
+            layer.setStyle({color: properties.color, fillColor: properties.color});
+        });
+        {% endmacro %}
+    """)
+
+def add_crime_counts_to_map(location_counts, feature_group, render_mode="auto"):
     """
     Adds crime data as interactive circles to a Folium map.
     
-    This function processes a DataFrame of crime data, counts occurrences at each
-    location, and adds circles to the map with size and color proportional to 
-    crime frequency. Each circle includes a tooltip showing total crimes and
+    This function takes the number of crimes per location and category and
+    adds circles to the map with size and color proportional to crime
+    frequency. Each circle includes a tooltip showing total crimes and
     breakdown by category.
     
     Parameters:
     -----------
-    crime_df : pandas.DataFrame
-        DataFrame containing crime data with 'location_latitude', 'location_longitude',
-        and 'category' columns.
+    location_counts : pandas.DataFrame
+        DataFrame with 'latitude' and 'longitude' columns and one column per
+        crime category with the number of crimes at that location, as returned
+        by db.get_crime_location_counts_point_dates() or
+        dutils.count_crimes_by_location().
     feature_group : folium.FeatureGroup
         The Folium feature group to add the crime bubbles to.
+    render_mode : str, optional
+        "circles" adds one folium.Circle per location, "geojson" adds all the
+        locations as a single GeoJSON layer styled from its properties, and
+        "auto" (default) uses "geojson" above GEOJSON_RENDER_THRESHOLD locations.
     
+    Returns:
+    --------
+    str
+        The render mode used. The function modifies the feature_group in place.
+    """
+    if render_mode == "auto":
+        render_mode = "geojson" if location_counts.shape[0] > GEOJSON_RENDER_THRESHOLD else "circles"
+
+    # Only proceed if the DataFrame contains data
+    if location_counts.shape[0]==0:
+        return render_mode
+
+    if render_mode == "geojson":
+        layer = folium.GeoJson(
+            crime_counts_geojson(location_counts),
+            marker=folium.Circle(fill=True, fill_opacity=0.6),
+            tooltip=folium.GeoJsonTooltip(fields=["tooltip"], labels=False),
+        )
+        layer.add_child(_BubbleStyle())
+        feature_group.add_child(layer)
+        return render_mode
+
+    radii, colors, tooltips = _bubble_properties(location_counts)
+    # Add circle markers to the map
+    for lat, lon, radius, color, tooltip_text in zip(
+        location_counts['latitude'], location_counts['longitude'], radii, colors, tooltips
+    ):
+        feature_group.add_child(
+            folium.Circle(
+                location=[lat, lon],
+                radius=radius,
+                color=color,
+                # stroke=False,
+                fill=True,
+                fill_color=color,
+                fill_opacity=0.6,
+                tooltip=tooltip_text # Interactive tooltip with crime details
+            ))
+    return render_mode
+
+def _grid_cell_style(feature):
+    color = feature["properties"]["color"]
+    return {"color": color, "weight": 0, "fillColor": color, "fillOpacity": 0.5}
+
+def add_grid_counts_to_map(grid_counts, feature_group):
+    """
+    Adds heatmap grid cells to a Folium map as a single GeoJSON layer, colored
+    by the number of crimes in each cell.
+
+    Parameters:
+    -----------
+    grid_counts : pandas.DataFrame
+        DataFrame with columns api.GRID_COLUMNS, as returned by
+        db.get_crime_grid_counts_point_dates() or dutils.count_crimes_by_grid().
+    feature_group : folium.FeatureGroup
+        The Folium feature group to add the cells to.
+
     Returns:
     --------
     None
         The function modifies the feature_group in place.
     """
-    # Only proceed if the DataFrame contains data
-    if crime_df.shape[0]>0:
-        # Count total crimes at each unique location
-        crime_counts = crime_df.value_counts(subset=['latitude', 'longitude'], sort=False)
-        max_counts = crime_counts.max()
-
-        # Count crimes per category at each location
-        category_counts = crime_df.groupby(['latitude', 'longitude', 'crime_type']).size()
-
-        # Iterate through each location and its crime count
-        for (lat, lon), total_count in crime_counts.items():
-            # Normalize the count for visual scaling
-            norm_total_count = _normalise(total_count, max_counts)
-
-            # Get crime counts for different categories at this location
-            category_data = category_counts.loc[lat, lon] if (lat, lon) in category_counts.index else {}
-            
-            # Format the category breakdown for tooltip display
-            category_tooltip = "<br>".join([f"{cat}: {count}" for cat, count in category_data.items()])
-
-            # Create tooltip text
-            tooltip_text = f"Total crimes: {total_count}<br>{category_tooltip}"
-
-            # Add circle marker to the map
-            feature_group.add_child(
-                folium.Circle(
-                    location=[lat, lon],
-                    radius=10 + norm_total_count * 2,  # Scale size based on occurrences
-                    color=color_function(norm_total_count), # Color based on crime intensity
-                    # stroke=False,
-                    fill=True,
-                    fill_color=color_function(norm_total_count),
-                    fill_opacity=0.6,
-                    tooltip=tooltip_text # Interactive tooltip with crime details
-                ))
+    if grid_counts.shape[0]==0:
+        return
+    counts = grid_counts['count'].to_numpy(dtype=float)
+    colors = color_array(_normalise(counts, counts.max()))
+    features = [
+        {
+            "type": "Feature",
+            "id": str(i),
+            "geometry": {
+                "type": "Polygon",
+                "coordinates": [[
+                    [lon_min, lat_min], [lon_max, lat_min], [lon_max, lat_max],
+                    [lon_min, lat_max], [lon_min, lat_min],
+                ]],
+            },
+            "properties": {"color": color, "tooltip": f"Crimes: {int(count)}"},
+        }
+        for i, (lat_min, lon_min, lat_max, lon_max, count, color) in enumerate(zip(
+            grid_counts['lat_min'], grid_counts['lon_min'], grid_counts['lat_max'],
+            grid_counts['lon_max'], counts, colors
+        ))
+    ]
+    feature_group.add_child(
+        folium.GeoJson(
+            {"type": "FeatureCollection", "features": features},
+            style_function=_grid_cell_style,
+            tooltip=folium.GeoJsonTooltip(fields=["tooltip"], labels=False),
+        ))
+
+def add_crime_tiles_to_map(folium_map, url):
+    """
+    Adds a vector tile layer of crime locations (see utils/tile_server.py) to
+    a Folium map. The browser only downloads the tiles in view, so panning and
+    zooming does not rerun the app. Points are colored and sized by their
+    'crime_count' with the same color stops as the bubbles.
+
+    Parameters:
+    -----------
+    folium_map : folium.Map
+        The map to add the layer to.
+    url : str
+        Tile URL template, see tile_server.tile_url().
+    """
+    options = """{
+        "vectorTileLayerStyles": {
+            "crimes": function(properties, zoom) {
+                var stops = %s;
+                var value = Math.min(properties.crime_count, stops[stops.length - 1][0]);
+                var color = stops[stops.length - 1][1];
+                for (var i = 0; i < stops.length - 1; i++) {
+                    if (value <= stops[i + 1][0]) {
+                        var ratio = (value - stops[i][0]) / (stops[i + 1][0] - stops[i][0]);
+                        color = [0, 1, 2].map(j => Math.floor((1 - ratio) * stops[i][1][j] + ratio * stops[i + 1][1][j]));
+                        break;
+                    }
+                }
+                var rgb = "rgb(" + color.join(",") + ")";
+                return {radius: 3 + Math.sqrt(properties.crime_count), fill: true, fillColor: rgb, color: rgb, weight: 1, fillOpacity: 0.6};
+            }
+        }
+    }""" % json.dumps(COLOR_STOPS)
+    VectorGridProtobuf(url, "Crimes", options).add_to(folium_map)
+
+def serialized_size(feature_group):
+    """
+    Size in bytes of the HTML/JavaScript generated for a feature group, i.e.
+    what st_folium sends to the browser on every rerun.
+    """
+    folium_map = folium.Map()
+    feature_group.add_to(folium_map)
+    return len(folium_map.get_root().render().encode("utf-8"))
 
 pfa_no_data=["Greater Manchester"]
 country_lower_levels=["Scotland"]
@@ -0,0 +1,80 @@
+"""
+Microbenchmark of the bubble construction in map_utils.add_crime_counts_to_map.
+
+Compares the vectorized implementation with the previous per-location loop
+(MultiIndex lookup, string join and two color_function calls per location),
+and reports the serialized payload size of the "circles" and "geojson"
+render modes.
+
+Run from the repository root with:
+    python -m utils.map_utils_benchmark [number of locations]
+"""
+import sys
+import time
+import numpy as np
+import pandas as pd
+import folium
+import utils.crime_data_fetch as api
+import utils.data_utils as dutils
+from utils.map_utils import add_crime_counts_to_map, color_function, _normalise, serialized_size
+
+def _add_crime_counts_to_map_loop(crime_df, feature_group):
+    # Previous implementation, kept here as the benchmark baseline
+    crime_counts = crime_df.value_counts(subset=['latitude', 'longitude'], sort=False)
+    max_counts = crime_counts.max()
+    category_counts = crime_df.groupby(['latitude', 'longitude', 'crime_type']).size()
+    for (lat, lon), total_count in crime_counts.items():
+        norm_total_count = _normalise(total_count, max_counts)
+        category_data = category_counts.loc[lat, lon] if (lat, lon) in category_counts.index else {}
+        category_tooltip = "<br>".join([f"{cat}: {count}" for cat, count in category_data.items()])
+        tooltip_text = f"Total crimes: {total_count}<br>{category_tooltip}"
+        feature_group.add_child(
+            folium.Circle(
+                location=[lat, lon],
+                radius=10 + norm_total_count * 2,
+                color=color_function(norm_total_count),
+                fill=True,
+                fill_color=color_function(norm_total_count),
+                fill_opacity=0.6,
+                tooltip=tooltip_text
+            ))
+
+def _random_crimes(n_locations, crimes_per_location=8, seed=0):
+    rng = np.random.default_rng(seed)
+    lats = np.round(51.4 + rng.random(n_locations) * 0.2, 6)
+    lons = np.round(-0.2 + rng.random(n_locations) * 0.3, 6)
+    idx = rng.integers(0, n_locations, n_locations * crimes_per_location)
+    categories = np.array(list(api.TO_PRETTY_CATEGORIES.values()))
+    return pd.DataFrame({
+        'crime_type': categories[rng.integers(0, len(categories), len(idx))],
+        'crime_id': None,
+        'month': pd.Timestamp("2024-01-01"),
+        'latitude': lats[idx],
+        'longitude': lons[idx],
+    })
+
+def _time(function, repeat=3):
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        function()
+        best = min(best, time.perf_counter() - start)
+    return best
+
+if __name__ == "__main__":
+    n_locations = int(sys.argv[1]) if len(sys.argv) > 1 else 5000
+    crime_df = _random_crimes(n_locations)
+    location_counts = dutils.count_crimes_by_location(crime_df)
+    print(f"{len(crime_df)} crimes at {len(location_counts)} locations")
+
+    loop_time = _time(lambda: _add_crime_counts_to_map_loop(crime_df, folium.FeatureGroup()))
+    vectorized_time = _time(lambda: add_crime_counts_to_map(dutils.count_crimes_by_location(crime_df), folium.FeatureGroup(), "circles"))
+    geojson_time = _time(lambda: add_crime_counts_to_map(dutils.count_crimes_by_location(crime_df), folium.FeatureGroup(), "geojson"))
+    print(f"Loop:       {loop_time * 1000:8.1f} ms")
+    print(f"Vectorized: {vectorized_time * 1000:8.1f} ms ({loop_time / vectorized_time:.1f}x faster)")
+    print(f"GeoJSON:    {geojson_time * 1000:8.1f} ms ({loop_time / geojson_time:.1f}x faster)")
+
+    for render_mode in ["circles", "geojson"]:
+        feature_group = folium.FeatureGroup()
+        add_crime_counts_to_map(location_counts, feature_group, render_mode)
+        print(f"Payload ({render_mode}): {serialized_size(feature_group) / 1e6:.2f} MB")
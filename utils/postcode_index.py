@@ -0,0 +1,263 @@
+"""
+Offline postcode lookups built from the ONS Postcode Directory (ONSPD).
+
+The index is built once from the ONSPD zip (or its main CSV) with
+    python -m utils.postcode_index ONSPD_MAY_2025.zip
+and saved as a NumPy .npz file holding the live postcodes sorted for binary
+search, their coordinates, and a grid of the coordinates for nearest-postcode
+(reverse) lookups. Lookups return the same dict shape as api.postcodes.io, so
+crime_data_fetch uses the index instead of the API whenever the file exists.
+"""
+import os
+import io
+import re
+import time
+import zipfile
+import argparse
+import numpy as np
+import pandas as pd
+import streamlit as st
+from utils.geo_utils import haversine_meters_array
+
+POSTCODE_INDEX_PATH = os.environ.get("POSTCODE_INDEX_PATH", "postcode_index.npz")
+
+# postcodes.io field name -> ONSPD column with its GSS code
+FIELD_COLUMNS = {
+    "admin_ward": "osward",
+    "admin_district": "oslaua",
+    "region": "rgn",
+    "country": "ctry",
+    "pfa": "pfa",
+}
+# postcodes.io field name -> start of the ONSPD Documents/ file with its names
+NAME_FILE_PREFIXES = {
+    "admin_ward": "Ward names",
+    "admin_district": "LA_UA names",
+    "region": "Region names",
+    "country": "Country names",
+    "pfa": "PFA names",
+}
+ONSPD_COLUMNS = ["pcds", "doterm", "lat", "long"] + list(FIELD_COLUMNS.values())
+ONSPD_CHUNK_SIZE = 500_000
+# ONSPD uses 99.999999 as the latitude of postcodes without coordinates
+ONSPD_NO_LATITUDE = 99.999999
+
+POSTCODE_KEY_DTYPE = "S7"
+POSTCODE_PATTERN = re.compile(r"^[A-Z]{1,2}[0-9][A-Z0-9]?[0-9][A-Z]{2}$")
+
+# Cells of the reverse lookup grid, about 1.1 km north-south
+REVERSE_GRID_DEGREES = 0.01
+_GRID_COLUMNS = int(round(360 / REVERSE_GRID_DEGREES))
+# Same defaults as https://api.postcodes.io/postcodes?lon=..&lat=..
+REVERSE_LOOKUP_RADIUS = 100
+REVERSE_LOOKUP_LIMIT = 10
+
+def postcode_key(postcode):
+    """
+    Normalises a postcode to its index key: upper case without spaces.
+    """
+    return postcode.replace(" ", "").upper()
+
+def _grid_cells(lats, lons):
+    rows = np.floor(np.asarray(lats) / REVERSE_GRID_DEGREES).astype(np.int64)
+    cols = np.floor((np.asarray(lons) + 180) / REVERSE_GRID_DEGREES).astype(np.int64)
+    return rows * _GRID_COLUMNS + cols
+
+class PostcodeIndex:
+    """
+    Forward (postcode -> info) and reverse (coordinates -> nearest postcodes)
+    lookups over the arrays written by build_postcode_index().
+    """
+    def __init__(self, arrays):
+        self.keys = arrays["keys"]
+        self.latitude = arrays["latitude"]
+        self.longitude = arrays["longitude"]
+        self.field_codes = {field: arrays[f"{field}_codes"] for field in FIELD_COLUMNS}
+        self.field_names = {field: arrays[f"{field}_names"] for field in FIELD_COLUMNS}
+        self.field_index = {field: arrays[f"{field}_index"] for field in FIELD_COLUMNS}
+        self.grid_cells = arrays["grid_cells"]
+        self.grid_order = arrays["grid_order"]
+
+    @classmethod
+    def load(cls, path=POSTCODE_INDEX_PATH):
+        with np.load(path) as arrays:
+            return cls({name: arrays[name] for name in arrays.files})
+
+    def __len__(self):
+        return len(self.keys)
+
+    def _record(self, i):
+        key = self.keys[i].decode()
+        latitude, longitude = self.latitude[i], self.longitude[i]
+        record = {
+            "postcode": f"{key[:-3]} {key[-3:]}",
+            "outcode": key[:-3],
+            "incode": key[-3:],
+            "latitude": None if np.isnan(latitude) else float(latitude),
+            "longitude": None if np.isnan(longitude) else float(longitude),
+            "codes": {},
+        }
+        for field in FIELD_COLUMNS:
+            j = self.field_index[field][i]
+            record[field] = str(self.field_names[field][j]) or None
+            record["codes"][field] = str(self.field_codes[field][j]) or None
+        return record
+
+    def lookup(self, postcode):
+        """
+        Returns the postcodes.io style dict of a postcode, or None if it is not
+        a live postcode.
+        """
+        key = postcode_key(postcode).encode()
+        i = np.searchsorted(self.keys, key)
+        if i < len(self.keys) and self.keys[i] == key:
+            return self._record(i)
+        return None
+
+    def nearest(self, lat, lon, radius=REVERSE_LOOKUP_RADIUS, limit=REVERSE_LOOKUP_LIMIT):
+        """
+        Returns the postcodes within radius metres of a point, nearest first,
+        each with its 'distance' in metres (like postcodes.io reverse lookups).
+        """
+        d_lat = radius / 111320
+        d_lon = radius / (111320 * max(np.cos(np.radians(lat)), 1e-6))
+        row_min, col_min = divmod(int(_grid_cells(lat - d_lat, lon - d_lon)), _GRID_COLUMNS)
+        row_max, col_max = divmod(int(_grid_cells(lat + d_lat, lon + d_lon)), _GRID_COLUMNS)
+        # The cells of a grid row are contiguous in the sorted cell ids
+        candidates = []
+        for row in range(row_min, row_max + 1):
+            start = np.searchsorted(self.grid_cells, row * _GRID_COLUMNS + col_min, side="left")
+            end = np.searchsorted(self.grid_cells, row * _GRID_COLUMNS + col_max, side="right")
+            candidates.append(self.grid_order[start:end])
+        candidates = np.concatenate(candidates)
+        distances = haversine_meters_array(lat, lon, self.latitude[candidates], self.longitude[candidates])
+        within = distances <= radius
+        candidates, distances = candidates[within], distances[within]
+        nearest = np.argsort(distances, kind="stable")[:limit]
+        results = []
+        for i, distance in zip(candidates[nearest], distances[nearest]):
+            record = self._record(i)
+            record["distance"] = float(distance)
+            results.append(record)
+        return results
+
+@st.cache_resource(show_spinner=False)
+def get_postcode_index(path=POSTCODE_INDEX_PATH):
+    """
+    Loads the postcode index once per app process.
+
+    Returns:
+    --------
+    PostcodeIndex or None
+        None if the index file does not exist, in which case postcodes are
+        looked up with api.postcodes.io.
+    """
+    if not os.path.exists(path):
+        return None
+    return PostcodeIndex.load(path)
+
+def _read_name_file(csv_file):
+    names = pd.read_csv(csv_file, dtype=str, encoding="utf-8-sig", encoding_errors="replace")
+    code_column = next(col for col in names.columns if col.upper().endswith("CD"))
+    name_column = next(col for col in names.columns if col.upper().endswith("NM"))
+    return dict(zip(names[code_column], names[name_column]))
+
+def _open_onspd(onspd_path):
+    """
+    Returns (main CSV file object, {field: {code: name}}) from an ONSPD zip,
+    or from the main CSV and the Documents/ directory next to it.
+    """
+    def find_names(paths, open_path):
+        names = {}
+        for field, prefix in NAME_FILE_PREFIXES.items():
+            matches = sorted(p for p in paths if os.path.basename(p).startswith(prefix) and p.endswith(".csv"))
+            if matches:
+                with open_path(matches[-1]) as name_file:
+                    names[field] = _read_name_file(name_file)
+            else:
+                print(f"No '{prefix}' file found, {field} names are left empty")
+        return names
+
+    if zipfile.is_zipfile(onspd_path):
+        zip_ref = zipfile.ZipFile(onspd_path)
+        members = zip_ref.namelist()
+        # The main file is Data/ONSPD_<MONTH>_<YEAR>_UK.csv, the Data/multi_csv/
+        # files split it by postcode area
+        data_member = next(
+            m for m in members
+            if m.startswith("Data/") and m.endswith("_UK.csv") and "multi_csv" not in m
+        )
+        names = find_names([m for m in members if m.startswith("Documents/")], zip_ref.open)
+        return io.TextIOWrapper(zip_ref.open(data_member), encoding="utf-8-sig", newline=""), names
+
+    documents_dir = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(onspd_path))), "Documents")
+    paths = [os.path.join(documents_dir, f) for f in os.listdir(documents_dir)] if os.path.isdir(documents_dir) else []
+    return open(onspd_path, encoding="utf-8-sig", newline=""), find_names(paths, open)
+
+def build_postcode_index(onspd_path, output_path=POSTCODE_INDEX_PATH):
+    """
+    Builds the postcode index from the ONS Postcode Directory.
+
+    Parameters:
+    -----------
+    onspd_path : str
+        Path of the ONSPD zip, or of its main CSV (Data/ONSPD_*_UK.csv) with
+        the name files in the sibling Documents/ directory.
+    output_path : str, optional
+        Where to save the index (.npz).
+
+    Returns:
+    --------
+    int
+        Number of postcodes in the index.
+    """
+    start = time.time()
+    csv_file, names = _open_onspd(onspd_path)
+    chunks = []
+    with csv_file:
+        for chunk in pd.read_csv(csv_file, usecols=ONSPD_COLUMNS, dtype=str, chunksize=ONSPD_CHUNK_SIZE):
+            # Only live postcodes, as postcodes.io
+            chunks.append(chunk[chunk["doterm"].isna()].drop(columns="doterm"))
+            print(f"Read {sum(len(c) for c in chunks)} live postcodes")
+    postcodes = pd.concat(chunks, ignore_index=True)
+
+    postcodes["key"] = postcodes["pcds"].str.replace(" ", "", regex=False).str.upper()
+    postcodes = postcodes[postcodes["key"].str.len() <= 7]
+    postcodes = postcodes.sort_values("key", ignore_index=True)
+
+    latitude = pd.to_numeric(postcodes["lat"], errors="coerce").to_numpy(dtype=np.float64)
+    longitude = pd.to_numeric(postcodes["long"], errors="coerce").to_numpy(dtype=np.float64)
+    no_coordinates = np.isnan(latitude) | np.isnan(longitude) | (latitude >= ONSPD_NO_LATITUDE)
+    latitude[no_coordinates] = np.nan
+    longitude[no_coordinates] = np.nan
+
+    arrays = {
+        "keys": postcodes["key"].to_numpy(dtype=POSTCODE_KEY_DTYPE),
+        "latitude": latitude,
+        "longitude": longitude,
+    }
+    for field, column in FIELD_COLUMNS.items():
+        codes = postcodes[column].fillna("").astype("category")
+        field_codes = codes.cat.categories.to_numpy(dtype=str)
+        field_names = names.get(field, {})
+        arrays[f"{field}_codes"] = field_codes
+        arrays[f"{field}_names"] = np.array([field_names.get(code, "") for code in field_codes], dtype=str)
+        arrays[f"{field}_index"] = codes.cat.codes.to_numpy(dtype=np.int32)
+
+    # Reverse lookup grid: positions of the postcodes with coordinates, sorted by cell
+    located = np.flatnonzero(~no_coordinates).astype(np.int32)
+    cells = _grid_cells(latitude[located], longitude[located])
+    order = np.argsort(cells, kind="stable")
+    arrays["grid_cells"] = cells[order]
+    arrays["grid_order"] = located[order]
+
+    np.savez(output_path, **arrays)
+    print(f"Saved {len(postcodes)} postcodes to {output_path} in {time.time() - start:.1f} secs")
+    return len(postcodes)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Build the offline postcode index from the ONS Postcode Directory.")
+    parser.add_argument("onspd_path", help="ONSPD zip, or its main Data/ONSPD_*_UK.csv file")
+    parser.add_argument("--output", default=POSTCODE_INDEX_PATH, help="Index file to write (.npz)")
+    args = parser.parse_args()
+    build_postcode_index(args.onspd_path, args.output)
@@ -0,0 +1,193 @@
+"""
+Small HTTP server serving Mapbox Vector Tiles (MVT) of crime counts built by
+PostGIS with ST_AsMVT.
+
+Tiles are served at
+    /crimes/{z}/{x}/{y}.pbf?start=YYYY-MM&end=YYYY-MM&types=Burglary,Drugs
+and contain one point per crime location with the number of crimes in the
+'crime_count' property. The map pages start the server in a background thread
+with start_tile_server(); it can also be run on its own with
+    python -m utils.tile_server
+
+The "Tiles" map mode is only offered when TILE_SERVER_PUBLIC_URL is set to
+the URL under which browsers reach the server (e.g. an https URL proxied to
+TILE_SERVER_HOST:TILE_SERVER_PORT): a default could not be right for a remote
+deployment, and the map would silently stay empty.
+"""
+import os
+import time
+import logging
+import threading
+from functools import lru_cache
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from urllib.parse import urlparse, parse_qs, urlencode
+import streamlit as st
+import utils.crime_data_fetch as api
+import utils.crime_data_db as db
+
+TILE_SERVER_HOST = os.environ.get("TILE_SERVER_HOST", "127.0.0.1")
+TILE_SERVER_PORT = int(os.environ.get("TILE_SERVER_PORT", 8765))
+# URL under which browsers reach the tile server (differs from the bind
+# address when the app runs behind a proxy). The server is not started
+# unless it is set, e.g. to http://localhost:8765 for a local app
+TILE_SERVER_PUBLIC_URL = os.environ.get("TILE_SERVER_PUBLIC_URL")
+
+TILE_CACHE_MAX_ENTRIES = 4096
+# Tiles are not served below this zoom level, where a tile would cover most
+# of the country
+TILE_MIN_ZOOM = 10
+TILE_LAYER_NAME = "crimes"
+# Seconds between checks of the data version, see get_data_version()
+DATA_VERSION_TTL = 300
+
+logger = logging.getLogger(__name__)
+
+_TILE_QUERY = """
+WITH bounds AS (
+    SELECT ST_TileEnvelope(%s, %s, %s) AS geom_3857
+),
+tile_locations AS (
+    SELECT
+        ST_AsMVTGeom(ST_Transform(c.geom::geometry, 3857), bounds.geom_3857) AS geom,
+        SUM(c.crime_count)::integer AS crime_count
+    FROM crime_location_counts AS c, bounds
+    WHERE ST_Intersects(c.geom, ST_Transform(bounds.geom_3857, 4326)::geography)
+    AND c.month BETWEEN %s AND %s
+    AND c.crime_type = ANY(%s)
+    GROUP BY c.geom, bounds.geom_3857
+)
+SELECT ST_AsMVT(tile_locations.*, %s) FROM tile_locations;
+"""
+
+_data_version = (None, None)
+_data_version_lock = threading.Lock()
+
+def get_data_version():
+    """
+    Time of the last file load recorded in load_ledger, checked at most every
+    DATA_VERSION_TTL seconds. It is part of the tile cache key and of the tile
+    URLs, so that neither the server nor the browsers keep serving tiles from
+    before a load. The tile cache is cleared when the version changes, so
+    stale tiles do not wait for eviction.
+
+    Returns:
+    --------
+    str
+        The version, "" if unknown (e.g. databases without load_ledger).
+    """
+    global _data_version
+    with _data_version_lock:
+        checked_at, version = _data_version
+        if checked_at is None or time.monotonic() - checked_at > DATA_VERSION_TTL:
+            try:
+                rows = db.fetch_all("SELECT MAX(loaded_at)::text FROM load_ledger;")
+                version = rows[0][0] or ""
+            except Exception:
+                version = ""
+            if checked_at is not None and version != _data_version[1]:
+                get_tile.cache_clear()
+            _data_version = (time.monotonic(), version)
+        return version
+
+@lru_cache(maxsize=TILE_CACHE_MAX_ENTRIES)
+def get_tile(z, x, y, date_start, date_end, crime_types, data_version=""):
+    """
+    Builds (or returns from the cache) one vector tile.
+
+    Parameters:
+    -----------
+    z, x, y : int
+        Tile coordinates.
+    date_start, date_end : str
+        First and last month in YYYY-MM format.
+    crime_types : tuple of str
+        Crime types to include.
+    data_version : str, optional
+        Version of the data (see get_data_version()), only used as part of the
+        cache key.
+
+    Returns:
+    --------
+    bytes
+        The MVT encoded tile. Zoom levels below TILE_MIN_ZOOM are not served.
+    """
+    rows = db.fetch_all(_TILE_QUERY, (
+        z, x, y, f"{date_start}-01", f"{date_end}-01", api.archive_crime_types(crime_types), TILE_LAYER_NAME
+    ))
+    return bytes(rows[0][0]) if rows and rows[0][0] is not None else b""
+
+class TileRequestHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        url = urlparse(self.path)
+        parts = url.path.strip("/").split("/")
+        try:
+            if len(parts) != 4 or parts[0] != TILE_LAYER_NAME or not parts[3].endswith(".pbf"):
+                raise ValueError("Unknown path")
+            z, x, y = int(parts[1]), int(parts[2]), int(parts[3][:-len(".pbf")])
+            query = parse_qs(url.query)
+            date_start = query["start"][0]
+            date_end = query["end"][0]
+            crime_types = tuple(sorted(query["types"][0].split(","))) if "types" in query else ()
+        except (ValueError, KeyError):
+            self.send_error(404)
+            return
+        if z < TILE_MIN_ZOOM:
+            # The map pages tell the user to zoom in
+            self.send_response(204)
+            self.send_header("Access-Control-Allow-Origin", "*")
+            self.end_headers()
+            return
+        try:
+            tile = get_tile(z, x, y, date_start, date_end, crime_types, get_data_version())
+        except Exception:
+            # The message may contain SQL or connection details
+            logger.exception("Could not build tile %s", self.path)
+            self.send_error(500)
+            return
+        self.send_response(200)
+        self.send_header("Content-Type", "application/vnd.mapbox-vector-tile")
+        self.send_header("Content-Length", str(len(tile)))
+        self.send_header("Access-Control-Allow-Origin", "*")
+        # Tile URLs change with the data version, see tile_url()
+        self.send_header("Cache-Control", "public, max-age=86400")
+        self.end_headers()
+        self.wfile.write(tile)
+
+    def log_message(self, format, *args):
+        # Keep the Streamlit logs quiet
+        pass
+
+@st.cache_resource
+def start_tile_server():
+    """
+    Starts the tile server in a daemon thread (once per app process).
+
+    Returns:
+    --------
+    str or None
+        Public base URL of the server, or None if TILE_SERVER_PUBLIC_URL is
+        not set or the server could not be started (e.g. the port is in use).
+    """
+    if not TILE_SERVER_PUBLIC_URL:
+        return None
+    try:
+        server = ThreadingHTTPServer((TILE_SERVER_HOST, TILE_SERVER_PORT), TileRequestHandler)
+    except OSError:
+        return None
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return TILE_SERVER_PUBLIC_URL
+
+def tile_url(base_url, dates, crime_types):
+    """
+    Leaflet URL template of the crime tiles for a date range and crime types.
+    The data version is part of the URL, so browsers do not reuse tiles they
+    cached before a load.
+    """
+    query = urlencode({
+        "start": dates[0], "end": dates[-1], "types": ",".join(sorted(crime_types)), "v": get_data_version(),
+    })
+    return f"{base_url}/{TILE_LAYER_NAME}/{{z}}/{{x}}/{{y}}.pbf?{query}"
+
+if __name__ == "__main__":
+    print(f"Serving crime tiles on http://{TILE_SERVER_HOST}:{TILE_SERVER_PORT}/{TILE_LAYER_NAME}/{{z}}/{{x}}/{{y}}.pbf")
+    ThreadingHTTPServer((TILE_SERVER_HOST, TILE_SERVER_PORT), TileRequestHandler).serve_forever()